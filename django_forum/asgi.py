@@ -0,0 +1,204 @@
+"""
+ASGI config for django_forum project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+for servers such as uvicorn or daphne:
+
+    uvicorn django_forum.asgi:application
+
+Django 1.11 has no async request handling of its own, so requests still go through
+the regular handler, on a bounded pool of worker threads (FORUM_ASGI_THREADS) while
+the event loop only moves bytes. Responses that carry an ``async_streaming_content``
+generator (the live comment streams) are sent straight from the loop, so an idle
+stream holds no thread at all.
+"""
+
+import asyncio, io, os, sys
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "django_forum.settings")
+
+django_application = get_wsgi_application()
+
+from django.conf import settings
+from forumapp import live
+
+
+## Serves Django's WSGI handler to an ASGI 3 server
+class ASGIBridge(object):
+
+    def __init__(self, handler, threads):
+        self.handler = handler
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='forum-asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+        else:
+            raise ValueError('Unsupported ASGI scope %r' % scope['type'])
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        loop = asyncio.get_event_loop()
+        body = []
+
+        while True:
+            message = await receive()
+
+            if message['type'] == 'http.disconnect':
+                return
+
+            body.append(message.get('body', b''))
+
+            if not message.get('more_body'):
+                break
+
+        environ = self.get_environ(scope, b''.join(body))
+        status, headers, response = await loop.run_in_executor(self.executor, self.get_response, environ)
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+
+        if isinstance(response, bytes):
+            await send({'type': 'http.response.body', 'body': response})
+
+        elif hasattr(response, 'async_streaming_content'):
+            await self.send_async_stream(response, receive, send)
+
+        else:
+            await self.send_stream(response, send)
+
+    ## Run the request through Django on a worker thread. Plain responses are read and
+    ## closed here too, so everything touching the database (including what runs on
+    ## request_finished) happens on the thread that owns the connection.
+    def get_response(self, environ):
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+
+        response = self.handler(environ, start_response)
+
+        if not getattr(response, 'streaming', False):
+            try:
+                return started['status'], started['headers'], b''.join(response)
+            finally:
+                response.close()
+
+        return started['status'], started['headers'], response
+
+    async def send_stream(self, response, send):
+        loop = asyncio.get_event_loop()
+        chunks = iter(response)
+
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+
+                if chunk is None:
+                    break
+
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+            await send({'type': 'http.response.body', 'body': b''})
+
+        finally:
+            await loop.run_in_executor(self.executor, response.close)
+
+    # the stream only ends on its own when it times out, so stop it as soon as the
+    # client goes away
+    async def send_async_stream(self, response, receive, send):
+        loop = asyncio.get_event_loop()
+        pump = asyncio.ensure_future(self.pump(response, send))
+        disconnect = asyncio.ensure_future(self.wait_disconnect(receive))
+
+        try:
+            await asyncio.wait([pump, disconnect], return_when=asyncio.FIRST_COMPLETED)
+
+        finally:
+            for task in (pump, disconnect):
+                task.cancel()
+
+            await asyncio.wait([pump, disconnect])
+            await response.async_streaming_content.aclose()
+            await loop.run_in_executor(self.executor, response.close)
+
+        if not pump.cancelled() and pump.exception() is not None:
+            raise pump.exception()
+
+    async def pump(self, response, send):
+        async for chunk in response.async_streaming_content:
+            await send({'type': 'http.response.body', 'body': response.make_bytes(chunk), 'more_body': True})
+
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def wait_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    def get_environ(self, scope, body):
+        script_name = scope.get('root_path', '')
+        path = scope['path']
+
+        if script_name and path.startswith(script_name):
+            path = path[len(script_name):]
+
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': script_name,
+            # WSGI carries the undecoded path bytes as latin-1
+            'PATH_INFO': path.encode('utf8').decode('latin1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin1').upper().replace('-', '_')
+            value = value.decode('latin1')
+
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+                continue
+
+            key = 'HTTP_%s' % name
+            environ[key] = '%s,%s' % (environ[key], value) if key in environ else value
+
+        return environ
+
+
+application = ASGIBridge(django_application, getattr(settings, 'FORUM_ASGI_THREADS', 16))
+
+# idle live comment streams cost nothing here, so thread pages open them, and their
+# queries and renders share the pool requests run on
+live.serve_async(application.executor)
@@ -10,11 +10,92 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/1.11/ref/settings/
 """
 
-import os
+import os, tempfile
 
 # Added
 LOGIN_REDIRECT_URL = '/forum'
 
+# Number of threads/comments shown per page
+FORUM_PAGE_SIZE = 25
+
+# List threads and comments as small row objects built from their columns instead of
+# model instances (see forumapp/projections.py), for less work per row on big threads
+FORUM_LIGHT_ROWS = False
+
+# Cache alias that records when each page last changed, for conditional GETs and the
+# shared page versions. Every worker process has to see the same stamps, so it can't
+# be a local-memory cache (manage.py check reports one); the file based 'shared' cache
+# below covers workers on one host, use memcached or the database cache across hosts.
+FORUM_CHANGE_CACHE = 'shared'
+
+# Cache alias and lifetime in seconds for rendered listing rows. Local-memory works:
+# the stamps that retire rows live in FORUM_CHANGE_CACHE, which every worker sees.
+FORUM_FRAGMENT_CACHE = 'default'
+FORUM_FRAGMENT_TIMEOUT = 60 * 60
+
+# Cache alias and lifetime in seconds for whole channel, thread and comment pages, which
+# logged-out readers share. With FORUM_PAGE_CACHE_USERS on, logged-in readers get the
+# shared pages too, and their moderation and favorite buttons are filled in by javascript.
+FORUM_PAGE_CACHE = 'default'
+FORUM_PAGE_TIMEOUT = 5 * 60
+FORUM_PAGE_CACHE_USERS = False
+
+# How long an outdated page is kept, to be served while one request renders its new
+# version (see forumapp/singleflight.py). Requests that have no copy to fall back on
+# wait up to FORUM_SINGLE_FLIGHT_WAIT seconds for it. The lock only coordinates the
+# threads of one process; with several workers use 'forumapp.singleflight.FileLock'
+# (one host) or 'forumapp.singleflight.CacheLock' (a cache all hosts share).
+FORUM_PAGE_STALE_TIMEOUT = 60 * 60
+FORUM_SINGLE_FLIGHT_LOCK = 'forumapp.singleflight.LocalLock'
+FORUM_SINGLE_FLIGHT_WAIT = 2
+
+# Channel owners, moderators, bans and descriptions are kept between requests (see
+# forumapp/channelcache.py), for up to FORUM_CHANNEL_CACHE_SIZE channels per process.
+# Each process reads its entries again after FORUM_CHANNEL_CACHE_LOCAL_TIMEOUT seconds,
+# so changes made through other workers show within that time. FORUM_CHANNEL_CACHE
+# optionally names a cache the workers share, to read them from instead of the database.
+FORUM_CHANNEL_CACHE_SIZE = 1000
+FORUM_CHANNEL_CACHE = None
+FORUM_CHANNEL_CACHE_TIMEOUT = 5 * 60
+FORUM_CHANNEL_CACHE_LOCAL_TIMEOUT = 5
+
+# Search results per page, and how many of the newest matches are ranked
+FORUM_SEARCH_RESULTS = 20
+FORUM_SEARCH_CANDIDATES = 1000
+
+# Queued threads/comments written to the search index at once
+FORUM_SEARCH_BATCH = 200
+
+# Hub behind the live comment streams: forumapp.live.LocalHub for a single process,
+# forumapp.live.CacheHub to share events between processes through FORUM_LIVE_CACHE
+FORUM_LIVE_BACKEND = 'forumapp.live.LocalHub'
+FORUM_LIVE_CACHE = 'default'
+FORUM_LIVE_KEEPALIVE = 15
+FORUM_LIVE_LIFETIME = 5 * 60
+
+# Set FORUM_LIVE_COMMENTS to turn the live comment streams on or off; left unset, they
+# are on only when served through django_forum/asgi.py, since under WSGI every open
+# stream holds a worker thread
+
+# Worker threads running requests under the ASGI entry point (django_forum/asgi.py)
+FORUM_ASGI_THREADS = 16
+
+# FORUM_INSTRUMENTATION counts queries, database/render time and page/fragment cache
+# hits per view (shown on /forum/stats/, and in response headers when DEBUG is on).
+# Logging every query has a cost; left unset, this follows DEBUG.
+
+# Most queries each view may run, at FORUM_PAGE_SIZE; more is logged, and fails the tests
+FORUM_QUERY_BUDGETS = {
+    'forumapp:channel': 10,
+    'forumapp:thread': 14,
+    'forumapp:comment': 18,
+    'forumapp:comment_live': 6,
+    'forumapp:user': 20,
+    'forumapp:favorites': 8,
+    'forumapp:search': 10,
+    'forumapp:reader': 6,
+}
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -45,6 +126,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'forumapp.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,6 +156,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'django_forum.wsgi.application'
 
+TEST_RUNNER = 'forumapp.testing.ForumTestRunner'
+
 
 # Database
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
@@ -85,6 +169,18 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # seen by every process on this host (see FORUM_CHANGE_CACHE)
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'django-forum-cache'),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
@@ -0,0 +1,85 @@
+from django.utils.functional import cached_property
+from .models import Channel, Thread
+from . import channelcache
+
+## Everything the forum templates ask about the channel (and thread) being viewed.
+## Lookups are lazy and happen at most once, so per-row template filters reading
+## from it cost nothing after the first row. Owner, moderators, bans and description
+## come from channelcache.py, so they usually cost no queries at all.
+class ChannelAccess(object):
+
+    def __init__(self, channel_name, thread_id=None):
+        self.channel_name = channel_name
+        self.thread_id = thread_id
+
+    ## Return the access context for a channel/thread, shared across one request
+    @classmethod
+    def for_request(cls, request, channel_name, thread_id=None):
+        resolved = request.__dict__.setdefault('_channel_access', {})
+        key = (channel_name, None if thread_id is None else str(thread_id))
+
+        if key not in resolved:
+            resolved[key] = cls(channel_name, thread_id)
+
+        return resolved[key]
+
+    # the whole row, for what changes too often to be cached (dates and counters)
+    @cached_property
+    def channel(self):
+        return Channel.objects.filter(channel_name=self.channel_name).first()
+
+    @cached_property
+    def info(self):
+        # a miss reads the row the page's validators need anyway
+        return channelcache.get(self.channel_name, lambda: self.channel)
+
+    @cached_property
+    def thread(self):
+        if self.thread_id is None or self.info is None:
+            return None
+
+        return Thread.objects.filter(channel_id=self.channel_name, thread_id=self.thread_id).first()
+
+    @property
+    def moderators(self):
+        return self.info.moderators if self.info else frozenset()
+
+    @property
+    def banned_users(self):
+        return self.info.banned_users if self.info else frozenset()
+
+    @property
+    def owner_name(self):
+        return self.info.owner_name if self.info else None
+
+    @property
+    def description(self):
+        return self.info.description if self.info else ''
+
+    @property
+    def thread_name(self):
+        return self.thread.thread_name if self.thread else ''
+
+    @property
+    def thread_description(self):
+        return self.thread.description if self.thread else ''
+
+    def is_owner(self, user):
+        return self.owner_name is not None and user.get_username() == self.owner_name
+
+    def is_moderator(self, user):
+        return self.is_owner(user) or user.get_username() in self.moderators
+
+    def is_banned(self, user):
+        return user.get_username() in self.banned_users
+
+## Accept an access context, a view's kwargs or a channel name (for templates that
+## don't have an access context in scope)
+def get_access(obj):
+    if isinstance(obj, ChannelAccess):
+        return obj
+
+    if isinstance(obj, dict):
+        return ChannelAccess(obj.get('channel'), obj.get('thread'))
+
+    return ChannelAccess(str(obj))
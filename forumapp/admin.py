@@ -1,7 +1,18 @@
 from django.contrib import admin
-from .models import Channel, Thread, Comment
+from django.contrib.auth.admin import UserAdmin
+from django.contrib.auth.models import User
+from .models import Channel, Thread, Comment, Moderator, Ban
+from . import moderation
 # Register your models here.
 
+class ModeratorInline(admin.TabularInline):
+    model = Moderator
+    extra = 1
+
+class BanInline(admin.TabularInline):
+    model = Ban
+    extra = 1
+
 class ThreadInline(admin.TabularInline):
     model = Thread
     extra = 3
@@ -15,13 +26,11 @@ class ChannelAdmin(admin.ModelAdmin):
         (None,               {'fields': ['channel_name', 'description']}),
         ('Date Information', {'fields': ['pub_date']}),
         ('Owner',            {'fields': ['owner']}),
-        ('Moderators',       {'fields': ['moderators']}),
-        ('Banned',           {'fields': ['banned_users']}),
     ]
 
-    inlines = [ThreadInline]
+    inlines = [ModeratorInline, BanInline, ThreadInline]
 
-    list_display = ('channel_name', 'description', 'owner', 'moderators', 'banned_users', 'pub_date', 'is_recent')
+    list_display = ('channel_name', 'description', 'owner', 'thread_count', 'comment_count', 'pub_date', 'is_recent')
     list_filter = ['pub_date']
     search_fields = ['channel_name']
 
@@ -34,10 +43,25 @@ class ThreadAdmin(admin.ModelAdmin):
 
     inlines = [CommentInline]
 
-    list_display = ('thread_name', 'thread_id', 'channel', 'description', 'owner', 'pub_date', 'is_recent')
+    list_display = ('thread_name', 'thread_id', 'channel', 'description', 'owner', 'comment_count', 'pub_date', 'is_recent')
     list_filter = ['pub_date']
     search_fields = ['thread_name']
 
+    actions = ['delete_in_bulk', 'ban_owners']
+
+    # one set-based delete, rather than delete_selected's pass per thread
+    def delete_in_bulk(self, request, queryset):
+        threads, comments = moderation.delete_threads(queryset)
+        self.message_user(request, "Deleted %d thread(s) and %d comment(s)." % (threads, comments))
+
+    delete_in_bulk.short_description = 'Delete selected threads in bulk'
+
+    def ban_owners(self, request, queryset):
+        bans = moderation.ban_users(queryset.exclude(owner=None).values_list('channel_id', 'owner_id'))
+        self.message_user(request, "Banned %d user(s) from their channel." % bans)
+
+    ban_owners.short_description = 'Ban the owners of selected threads from their channel'
+
 class CommentAdmin(admin.ModelAdmin):
     fieldsets = [
         (None,               {'fields': ['thread', 'comment_id', 'text']}),
@@ -49,6 +73,33 @@ class CommentAdmin(admin.ModelAdmin):
     list_filter = ['pub_date']
     search_fields = ['text']
 
+    actions = ['delete_in_bulk', 'ban_owners']
+
+    def delete_in_bulk(self, request, queryset):
+        comments = moderation.delete_comments(queryset)
+        self.message_user(request, "Deleted %d comment(s)." % comments)
+
+    delete_in_bulk.short_description = 'Delete selected comments in bulk'
+
+    def ban_owners(self, request, queryset):
+        bans = moderation.ban_users(queryset.exclude(owner=None).values_list('thread__channel_id', 'owner_id'))
+        self.message_user(request, "Banned %d user(s) from their channel." % bans)
+
+    ban_owners.short_description = 'Ban the owners of selected comments from their channel'
+
+class ForumUserAdmin(UserAdmin):
+    actions = ['delete_in_bulk']
+
+    # hands on the users' channels in one pass, rather than once per user
+    def delete_in_bulk(self, request, queryset):
+        users = moderation.delete_users(queryset)
+        self.message_user(request, "Deleted %d user(s)." % users)
+
+    delete_in_bulk.short_description = 'Delete selected users in bulk'
+
 admin.site.register(Channel, ChannelAdmin)
 admin.site.register(Thread, ThreadAdmin)
 admin.site.register(Comment, CommentAdmin)
+
+admin.site.unregister(User)
+admin.site.register(User, ForumUserAdmin)
@@ -6,4 +6,5 @@ class ForumappConfig(AppConfig):
 
     def ready(self):
         import forumapp.signals
+        import forumapp.checks
         pass
@@ -0,0 +1,180 @@
+import threading, time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import BooleanField, Value
+from .models import Channel, Moderator, Ban
+
+## What views and templates ask about a channel on nearly every request (its owner,
+## moderators, bans, description and pin state), kept between requests so each
+## request doesn't look them up again. Entries live in a bounded LRU in this process,
+## optionally backed by a shared cache (FORUM_CHANNEL_CACHE) that other processes
+## fill and read too. Channel, Moderator and Ban saves and deletes forget a channel's
+## entry (see signals.py), as do the bulk paths that skip those signals.
+##
+## The signals only reach the process making the change, so local entries are read
+## again (from the shared cache if there is one) once they are
+## FORUM_CHANNEL_CACHE_LOCAL_TIMEOUT old. Permission checks that authorize changes
+## (see views.is_mod) don't wait for that and always read the database.
+
+def get_size():
+    return getattr(settings, 'FORUM_CHANNEL_CACHE_SIZE', 1000)
+
+# the shared cache behind this process's entries, or None
+def get_shared_cache():
+    alias = getattr(settings, 'FORUM_CHANNEL_CACHE', None)
+    return caches[alias] if alias else None
+
+def get_timeout():
+    return getattr(settings, 'FORUM_CHANNEL_CACHE_TIMEOUT', 5 * 60)
+
+def get_local_timeout():
+    return getattr(settings, 'FORUM_CHANNEL_CACHE_LOCAL_TIMEOUT', 5)
+
+def shared_key(channel_name):
+    return 'forumapp:channel-info:%s' % channel_name
+
+## A channel's metadata, with moderators and banned users as sets of usernames
+class ChannelInfo(object):
+    __slots__ = ('channel_name', 'owner_name', 'description', 'pin_date', 'moderators', 'banned_users')
+
+    def __init__(self, channel_name, owner_name, description, pin_date, moderators, banned_users):
+        self.channel_name = channel_name
+        self.owner_name = owner_name
+        self.description = description
+        self.pin_date = pin_date
+        self.moderators = moderators
+        self.banned_users = banned_users
+
+    # slotted objects need these to be pickled into the shared cache
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def is_owner(self, user):
+        return self.owner_name is not None and user.get_username() == self.owner_name
+
+    def is_moderator(self, user):
+        return self.is_owner(user) or user.get_username() in self.moderators
+
+    def is_banned(self, user):
+        return user.get_username() in self.banned_users
+
+## Return a channel's metadata from the database, or None if there is no such channel.
+## get_channel() returns the channel's row if the caller already needs it anyway.
+def load(channel_name, get_channel=None):
+    if get_channel is not None:
+        channel = get_channel()
+    else:
+        channel = Channel._base_manager.filter(channel_name=channel_name).only('owner', 'description', 'pin_date').first()
+
+    if channel is None:
+        return None
+
+    # moderators and bans in one query
+    moderators = Moderator.objects.filter(channel_id=channel_name) \
+            .annotate(banned=Value(False, BooleanField())).values_list('user_id', 'banned')
+    bans = Ban.objects.filter(channel_id=channel_name) \
+            .annotate(banned=Value(True, BooleanField())).values_list('user_id', 'banned')
+    members = list(moderators.union(bans, all=True))
+
+    return ChannelInfo(channel_name, channel.owner_id, channel.description, channel.pin_date, \
+            frozenset(user for user, banned in members if not banned), frozenset(user for user, banned in members if banned))
+
+## Least recently used channels are dropped once there are more than FORUM_CHANNEL_CACHE_SIZE
+class ChannelCache(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # moves on every forget, so a load that raced one isn't stored
+        self.generation = 0
+
+    # fresh: skip the cached copies, storing what the database has now
+    def get(self, channel_name, get_channel=None, fresh=False):
+        channel_name = str(channel_name)
+        shared = get_shared_cache()
+
+        with self.lock:
+            entry = self.entries.get(channel_name)
+
+            if entry is not None and not fresh and time.time() - entry[1] < get_local_timeout():
+                self.entries.move_to_end(channel_name)
+                self.hits += 1
+                return entry[0]
+
+            self.misses += 1
+            generation = self.generation
+
+        info = shared.get(shared_key(channel_name)) if shared is not None and not fresh else None
+
+        if info is None:
+            info = load(channel_name, get_channel)
+
+            # missing channels aren't kept, a new one would need forgetting too
+            if info is None:
+                return None
+
+            if shared is not None:
+                shared.set(shared_key(channel_name), info, get_timeout())
+
+        self.store(channel_name, info, generation)
+        return info
+
+    def store(self, channel_name, info, generation):
+        size = get_size()
+
+        with self.lock:
+            if generation != self.generation or size <= 0:
+                return
+
+            self.entries[channel_name] = (info, time.time())
+            self.entries.move_to_end(channel_name)
+
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def forget(self, *channel_names):
+        shared = get_shared_cache()
+
+        with self.lock:
+            self.generation += 1
+
+            for channel_name in channel_names:
+                self.entries.pop(str(channel_name), None)
+
+        if shared is not None:
+            shared.delete_many([shared_key(channel_name) for channel_name in channel_names])
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = self.misses = self.evictions = 0
+
+cache = ChannelCache()
+
+def get(channel_name, get_channel=None, fresh=False):
+    return cache.get(channel_name, get_channel, fresh)
+
+## Forget the channels' entries now, so this request sees its own change, and again
+## once the change is committed, as other requests may have read the old rows meanwhile
+def forget(*channel_names):
+    cache.forget(*channel_names)
+    transaction.on_commit(lambda: cache.forget(*channel_names))
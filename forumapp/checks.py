@@ -0,0 +1,15 @@
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, register
+from . import conditional
+
+## The change stamps behind conditional GETs have to be seen by every worker process;
+## a local-memory cache would keep each worker's to itself
+@register()
+def check_change_cache(app_configs, **kwargs):
+    if isinstance(conditional.get_cache(), LocMemCache):
+        return [Error("FORUM_CHANGE_CACHE is a local-memory cache, so pages changed through one worker "
+                "process stay unchanged to the others.",
+                hint="Point it at a cache all workers share, e.g. the file based, database or memcached backend.",
+                id='forumapp.E001')]
+
+    return []
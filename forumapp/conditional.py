@@ -0,0 +1,45 @@
+import time
+from django.conf import settings
+from django.core.cache import caches
+
+## When each page of the forum last changed, for answering conditional GETs.
+## recent_date/pub_date already move on every post; these stamps also catch what they
+## miss (edits, pins, deletions, bans) and are set from the save/delete signals.
+## A stamp that was evicted from the cache restarts at the current time, which at
+## worst costs the client one full response. The stamps have to be shared by every
+## worker process (see checks.py), or a change made through one would leave the
+## others answering 304 for the old page.
+
+GLOBAL_SCOPE = 'forum'
+CHANNELS_SCOPE = 'channels'
+
+def get_cache():
+    return caches[getattr(settings, 'FORUM_CHANGE_CACHE', 'default')]
+
+def stamp_key(scope):
+    return 'forumapp:changed:%s' % scope
+
+def channel_scope(channel_name):
+    return 'channel:%s' % channel_name
+
+def thread_scope(thread_pk):
+    return 'thread:%s' % thread_pk
+
+## Record that the pages under each scope changed now
+def touch(*scopes):
+    now = time.time()
+    get_cache().set_many({stamp_key(scope): now for scope in scopes}, None)
+
+## Return when the newest of the scopes last changed, as a unix timestamp
+def last_changed(scopes):
+    cache = get_cache()
+    keys = [stamp_key(scope) for scope in scopes]
+    stamps = cache.get_many(keys)
+
+    missing = [key for key in keys if key not in stamps]
+    if missing:
+        now = time.time()
+        cache.set_many({key: now for key in missing}, None)
+        stamps.update((key, now) for key in missing)
+
+    return max(stamps.values())
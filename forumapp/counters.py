@@ -0,0 +1,61 @@
+from django.db import models
+from django.db.models.functions import Coalesce
+
+## Rebuild the denormalized counters from the rows they summarize. Each table is fixed
+## with a single UPDATE, so this stays cheap enough to run against a live forum.
+## The models are passed in so migrations can hand over their historical versions.
+
+# count rows of model grouped by the field pointing at the outer row
+def count_of(model, field):
+    rows = model._base_manager.filter(**{field: models.OuterRef('pk')}).order_by()
+    rows = rows.values(field).annotate(count=models.Count('pk')).values('count')
+
+    return Coalesce(models.Subquery(rows, output_field=models.IntegerField()), 0)
+
+# value of column on the newest row of model under the outer row
+def newest(model, field, column, *ordering):
+    rows = model._base_manager.filter(**{field: models.OuterRef('pk')}).order_by(*ordering)
+    return models.Subquery(rows.values(column)[:1])
+
+# a thread was last posted in by its newest commenter, or its author if nobody replied
+def thread_last_poster(Comment):
+    return Coalesce(newest(Comment, 'thread', 'owner', '-pub_date', '-comment_id'), 'owner')
+
+# channels take the last poster of their most recently used thread
+def channel_last_poster(Thread):
+    return newest(Thread, 'channel', 'last_poster', '-recent_date', '-thread_id')
+
+# a last poster comparable with =, as either side may be null
+def poster_or_blank(expression):
+    return Coalesce(expression, models.Value(''), output_field=models.CharField())
+
+## Return how many threads and channels have counters or last posters that disagree
+## with their rows
+def count_drift(Channel, Thread, Comment):
+    threads = Thread._base_manager.annotate(actual=count_of(Comment, 'thread'), \
+            poster=poster_or_blank(thread_last_poster(Comment)), stored_poster=poster_or_blank('last_poster')) \
+            .exclude(comment_count=models.F('actual'), stored_poster=models.F('poster')).count()
+
+    channels = Channel._base_manager.annotate(threads=count_of(Thread, 'channel'), \
+            comments=count_of(Comment, 'thread__channel'), \
+            poster=poster_or_blank(channel_last_poster(Thread)), stored_poster=poster_or_blank('last_poster')) \
+            .exclude(thread_count=models.F('threads'), comment_count=models.F('comments'), \
+            stored_poster=models.F('poster')).count()
+
+    return threads, channels
+
+## Recount every thread and channel, or only the given thread pks and channel names
+def reconcile(Channel, Thread, Comment, threads=None, channels=None):
+    thread_rows = Thread._base_manager.all()
+    if threads is not None:
+        thread_rows = thread_rows.filter(pk__in=threads)
+
+    channel_rows = Channel._base_manager.all()
+    if channels is not None:
+        channel_rows = channel_rows.filter(pk__in=channels)
+
+    # threads first, as channels take their last poster from them
+    thread_rows.update(comment_count=count_of(Comment, 'thread'), last_poster=thread_last_poster(Comment))
+
+    channel_rows.update(thread_count=count_of(Thread, 'channel'), \
+            comment_count=count_of(Comment, 'thread__channel'), last_poster=channel_last_poster(Thread))
@@ -1,22 +1,108 @@
-from django.forms import ModelForm
+from django.forms import Form, ModelForm, ValidationError, CharField, SlugField, IntegerField, ChoiceField
+from django.contrib.auth.models import User
 from .models import UserSettings, Channel, Thread, Comment
+from .moderation import ACTIONS
+
+# the fixed routes in urls.py, which a channel of the same name would be hidden behind
+RESERVED_CHANNEL_NAMES = ('settings', 'favorites', 'user', 'search', 'moderate', 'stats', 'me')
 
 class ChannelForm(ModelForm):
     class Meta:
         model = Channel
         fields = ['channel_name', 'description']
 
+    def clean_channel_name(self):
+        channel_name = self.cleaned_data.get('channel_name')
+
+        if channel_name.lower() in RESERVED_CHANNEL_NAMES:
+            raise ValidationError("That channel name is reserved.", code='reserved')
+
+        return channel_name
+
 class ThreadForm(ModelForm):
     class Meta:
         model = Thread
         fields = ['thread_name', 'description']
 
+    def clean_thread_name(self):
+        thread_name = self.cleaned_data.get('thread_name')
+
+        if len(thread_name) <= 5:
+            raise ValidationError("Thread name must be at least 6 characters.")
+
+        return thread_name
+
+    def clean_description(self):
+        description = self.cleaned_data.get('description')
+
+        if len(description) <= 5:
+            raise ValidationError("Thread description must be at least 6 characters.")
+
+        return description
+
 class CommentForm(ModelForm):
     class Meta:
         model = Comment
         fields = ['text']
 
+    def clean_text(self):
+        text = self.cleaned_data.get('text')
+
+        if len(text) <= 5:
+            raise ValidationError("Comments must be at least 6 characters.")
+
+        return text
+
 class UserSettingsForm(ModelForm):
     class Meta:
         model = UserSettings
         fields = ['bio',]
+
+class SearchForm(Form):
+    q = CharField(max_length=100)
+    channel = SlugField(max_length=30, required=False)
+    page = IntegerField(min_value=1, required=False)
+
+class ModerationForm(Form):
+    action = ChoiceField(choices=[(action, action) for action in ACTIONS])
+    channel = SlugField(max_length=30, required=False)
+    user = CharField(max_length=150, required=False)
+    hours = IntegerField(min_value=1, required=False)
+
+    # comma separated thread_ids
+    threads = CharField(required=False)
+
+    def clean_user(self):
+        user = self.cleaned_data.get('user')
+
+        if user and not User.objects.filter(username=user).exists():
+            raise ValidationError("That user does not exist.")
+
+        return user
+
+    def clean_threads(self):
+        threads = self.cleaned_data.get('threads')
+
+        if not threads:
+            return None
+
+        try:
+            return [int(thread_id) for thread_id in threads.split(',')]
+        except ValueError:
+            raise ValidationError("Threads must be a comma separated list of thread ids.")
+
+    def clean(self):
+        cleaned_data = super(ModerationForm, self).clean()
+        action = cleaned_data.get('action')
+
+        # never act on everything at once
+        if not cleaned_data.get('user') and not cleaned_data.get('threads'):
+            raise ValidationError("Choose a user or threads to moderate.")
+
+        if cleaned_data.get('threads') and not cleaned_data.get('channel'):
+            raise ValidationError("Threads can only be chosen within a channel.")
+
+        if action in ('ban', 'purge') and not cleaned_data.get('user'):
+            raise ValidationError("Choose a user to %(action)s.", params={'action': action})
+
+        return cleaned_data
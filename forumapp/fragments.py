@@ -0,0 +1,91 @@
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+from . import instrumentation, conditional
+
+## Cache for the rendered, user-independent parts of listing rows (see the fragment
+## tag in cache_helpers.py). A row's fragment is stored under its identity along with
+## a signature made of the row's date, the row's own stamp and the version stamps of
+## the scopes it belongs to, so a fragment is served only while all of them still match:
+##   - saving or deleting a row, or changing what it shows without moving its date
+##     (counters, descriptions), restamps it (see signals.py)
+##   - bumping a scope ('forum' or a channel) drops every fragment rendered under it
+##
+## The fragments may stay in a cache local to each worker (FORUM_FRAGMENT_CACHE), but
+## the stamps live in the change cache every worker shares (FORUM_CHANGE_CACHE, see
+## conditional.py), so a change made through one worker retires the others' copies too.
+
+# the date that moves whenever a row's listing changes
+STAMP_FIELDS = {'channel': 'recent_date', 'thread': 'recent_date', 'comment': 'pub_date'}
+
+GLOBAL_SCOPE = 'forum'
+
+def get_cache():
+    return caches[getattr(settings, 'FORUM_FRAGMENT_CACHE', 'default')]
+
+def get_timeout():
+    return getattr(settings, 'FORUM_FRAGMENT_TIMEOUT', 60 * 60)
+
+def row_key(model_name, pk):
+    return 'forumapp:fragment:%s:%s' % (model_name, pk)
+
+def row_stamp_key(model_name, pk):
+    return 'forumapp:row-version:%s:%s' % (model_name, pk)
+
+def scope_key(scope):
+    return 'forumapp:version:%s' % scope
+
+def channel_scope(channel_name):
+    return 'channel:%s' % channel_name
+
+# the current stamp under each key, starting any that are missing. Stamps are random
+# rather than counters so an evicted stamp can't come back with an old value.
+def get_stamps(keys, timeout):
+    cache = conditional.get_cache()
+    stamps = cache.get_many(keys)
+
+    for key in keys:
+        if key not in stamps:
+            cache.add(key, uuid.uuid4().hex, timeout)
+            stamps[key] = cache.get(key)
+
+    return tuple(stamps[key] for key in keys)
+
+## Return the current stamp of each scope
+def get_versions(scopes):
+    return get_stamps([scope_key(scope) for scope in scopes], None)
+
+## Invalidate every fragment rendered under a scope
+def bump(scope):
+    conditional.get_cache().set(scope_key(scope), uuid.uuid4().hex, None)
+
+## Invalidate a single row's fragment. The stamp only has to outlive the fragments
+## rendered under it.
+def forget(model_name, pk):
+    conditional.get_cache().set(row_stamp_key(model_name, pk), uuid.uuid4().hex, get_timeout())
+
+def forget_instance(instance):
+    forget(instance._meta.model_name, instance.pk)
+
+def signature(obj, versions):
+    model_name = obj._meta.model_name
+    stamp = getattr(obj, STAMP_FIELDS[model_name])
+
+    return (stamp.isoformat() if stamp else None,) + get_stamps([row_stamp_key(model_name, obj.pk)], get_timeout()) \
+            + tuple(versions)
+
+## Return the cached fragment for a row, or None if it is missing or out of date.
+## The signature it was checked against goes with it, for set_fragment.
+def get_fragment(obj, versions):
+    current = signature(obj, versions)
+    cached = get_cache().get(row_key(obj._meta.model_name, obj.pk))
+
+    if cached is not None and cached[0] == current:
+        instrumentation.count_cache(True)
+        return cached[1], current
+
+    instrumentation.count_cache(False)
+    return None, current
+
+def set_fragment(obj, current, content):
+    get_cache().set(row_key(obj._meta.model_name, obj.pk), (current, content), get_timeout())
@@ -0,0 +1,159 @@
+import logging, threading, time
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connections
+
+## Per-request measurements (SQL queries, time spent in the database and rendering
+## templates, page and fragment cache hits and misses), grouped by URL name.
+## InstrumentationMiddleware takes them, adds them to the in-process totals behind the
+## stats page and, in debug mode, reports them in response headers. Views can also be
+## given a query budget (FORUM_QUERY_BUDGETS); going over it is logged, and fails the
+## request while the tests run (see ForumTestRunner).
+
+logger = logging.getLogger(__name__)
+
+def is_enabled():
+    return getattr(settings, 'FORUM_INSTRUMENTATION', settings.DEBUG)
+
+## Return the most queries the view named url_name may run, or None if unlimited
+def get_budget(url_name):
+    return getattr(settings, 'FORUM_QUERY_BUDGETS', {}).get(url_name)
+
+def is_strict():
+    return getattr(settings, 'FORUM_QUERY_BUDGETS_STRICT', False)
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+## What one request did
+class RequestStats(object):
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.total_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+# stats of the request being handled on this thread of execution
+_current = threading.local()
+
+def current():
+    return getattr(_current, 'stats', None)
+
+## Count a page or fragment cache lookup against the current request
+def count_cache(hit):
+    stats = current()
+
+    if stats is None:
+        return
+
+    if hit:
+        stats.cache_hits += 1
+    else:
+        stats.cache_misses += 1
+
+## Measure the queries run inside the block. The connections log what they run while
+## this is active, the same way Django's CaptureQueriesContext works.
+@contextmanager
+def measure():
+    stats = RequestStats()
+    _current.stats = stats
+
+    watched = []
+    for connection in connections.all():
+        watched.append((connection, connection.force_debug_cursor, len(connection.queries_log)))
+        connection.force_debug_cursor = True
+
+    start = time.time()
+
+    try:
+        yield stats
+
+    finally:
+        stats.total_time = time.time() - start
+        _current.stats = None
+
+        for connection, force_debug_cursor, offset in watched:
+            connection.force_debug_cursor = force_debug_cursor
+
+            queries = list(connection.queries_log)[offset:]
+            stats.queries += len(queries)
+            stats.db_time += sum(float(query['time']) for query in queries)
+
+@contextmanager
+def measure_render(stats):
+    start = time.time()
+
+    try:
+        yield
+    finally:
+        stats.render_time += time.time() - start
+
+## Totals per URL name since the process started (or the last reset)
+class StatsTable(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def add(self, url_name, stats):
+        with self.lock:
+            totals = self.views.setdefault(url_name, {
+                'requests': 0, 'queries': 0, 'max_queries': 0, 'db_time': 0.0, 'render_time': 0.0,
+                'total_time': 0.0, 'cache_hits': 0, 'cache_misses': 0,
+            })
+
+            totals['requests'] += 1
+            totals['queries'] += stats.queries
+            totals['max_queries'] = max(totals['max_queries'], stats.queries)
+            totals['db_time'] += stats.db_time
+            totals['render_time'] += stats.render_time
+            totals['total_time'] += stats.total_time
+            totals['cache_hits'] += stats.cache_hits
+            totals['cache_misses'] += stats.cache_misses
+
+    ## Return per-request averages for each URL name, times in milliseconds
+    def summary(self):
+        with self.lock:
+            views = {name: dict(totals) for name, totals in self.views.items()}
+
+        summary = {}
+        for name, totals in views.items():
+            requests = totals['requests']
+
+            summary[name] = {
+                'requests': requests,
+                'queries': round(totals['queries'] / requests, 2),
+                'max_queries': totals['max_queries'],
+                'budget': get_budget(name),
+                'db_ms': round(totals['db_time'] * 1000 / requests, 2),
+                'render_ms': round(totals['render_time'] * 1000 / requests, 2),
+                'total_ms': round(totals['total_time'] * 1000 / requests, 2),
+                'cache_hits': totals['cache_hits'],
+                'cache_misses': totals['cache_misses'],
+            }
+
+        return summary
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+table = StatsTable()
+
+## Record a finished request, checking it against its view's budget
+def record(url_name, stats):
+    table.add(url_name, stats)
+
+    budget = get_budget(url_name)
+    if budget is None or stats.queries <= budget:
+        return
+
+    message = '%s ran %d queries, over its budget of %d' % (url_name, stats.queries, budget)
+
+    if is_strict():
+        raise QueryBudgetExceeded(message)
+
+    logger.warning(message)
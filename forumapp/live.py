@@ -0,0 +1,267 @@
+import asyncio, queue, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+from .models import Comment
+
+## Publish/subscribe hub feeding the live comment streams (see LiveCommentView).
+## Posting a comment publishes a small event to the thread's topic and every open
+## stream on that thread receives it. The backend is chosen with FORUM_LIVE_BACKEND:
+##   - LocalHub delivers within one process
+##   - CacheHub goes through a shared cache (e.g. the file based one) so several
+##     worker processes see each other's events, standing in for a real broker
+
+DEFAULT_BACKEND = 'forumapp.live.LocalHub'
+
+# set by django_forum/asgi.py, which waits on idle streams without holding a thread
+_served_async = False
+_executor = None
+_executor_lock = threading.Lock()
+
+def serve_async(executor):
+    global _served_async, _executor
+    _served_async = True
+    _executor = executor
+
+## Return the pool that streams served from an event loop borrow threads from for their
+## blocking work (queries, rendering, cache polls). Under django_forum/asgi.py it's the
+## server's own pool of FORUM_ASGI_THREADS, so streams share the threads requests run on.
+def get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(getattr(settings, 'FORUM_ASGI_THREADS', 16))
+
+        return _executor
+
+## Run func(*args) on that pool from the event loop
+async def run_blocking(func, *args):
+    return await asyncio.get_event_loop().run_in_executor(get_executor(), func, *args)
+
+## Return whether thread pages stream their new comments. Left unset, FORUM_LIVE_COMMENTS
+## is on only under the ASGI entry point: under WSGI every open stream holds a worker
+## thread for up to FORUM_LIVE_LIFETIME, so a few hundred open tabs would use them all up.
+def is_enabled():
+    enabled = getattr(settings, 'FORUM_LIVE_COMMENTS', None)
+    return _served_async if enabled is None else enabled
+
+# events a subscriber may fall behind by before it is cut off (and has to catch up)
+MAX_BACKLOG = 100
+
+# seconds between keepalive comments on an idle stream, and before a stream is ended
+def get_keepalive():
+    return getattr(settings, 'FORUM_LIVE_KEEPALIVE', 15)
+
+def get_lifetime():
+    return getattr(settings, 'FORUM_LIVE_LIFETIME', 5 * 60)
+
+def thread_topic(channel_name, thread_id):
+    return 'thread:%s:%s' % (channel_name, thread_id)
+
+## Handle for receiving one topic's events, in the order they were published. Each
+## hub's subscriptions provide get(timeout), returning the next event or None if there
+## was none within timeout seconds, and aget(timeout), the same for streams served from
+## an event loop (see django_forum/asgi.py).
+class Subscription(object):
+
+    def __init__(self, hub, topic):
+        self.hub = hub
+        self.topic = topic
+        self.overflowed = False
+
+    def close(self):
+        pass
+
+class LocalSubscription(Subscription):
+
+    def __init__(self, hub, topic):
+        super(LocalSubscription, self).__init__(hub, topic)
+        self.events = queue.Queue(MAX_BACKLOG)
+
+        # (loop, future) of an async reader waiting for the next event
+        self.waiter = None
+
+    def put(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+        # publishers run on worker threads, so hand the wakeup to the reader's loop
+        waiter = self.waiter
+        if waiter is not None:
+            loop, future = waiter
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+    def get(self, timeout):
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    # wait on the loop instead of parking a thread per idle stream
+    async def aget(self, timeout):
+        loop = asyncio.get_event_loop()
+        self.waiter = (loop, loop.create_future())
+
+        try:
+            # an event may have arrived before the waiter was in place
+            if self.events.empty():
+                await asyncio.wait_for(self.waiter[1], timeout)
+
+        except asyncio.TimeoutError:
+            pass
+
+        finally:
+            self.waiter = None
+
+        try:
+            return self.events.get_nowait()
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+## Delivers events to the subscribers in this process
+class LocalHub(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def subscribe(self, topic):
+        subscription = LocalSubscription(self, topic)
+
+        with self.lock:
+            self.subscribers.setdefault(topic, set()).add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.topic, set())
+            subscribers.discard(subscription)
+
+            if not subscribers:
+                self.subscribers.pop(subscription.topic, None)
+
+    def publish(self, topic, event):
+        with self.lock:
+            subscribers = list(self.subscribers.get(topic, ()))
+
+        for subscription in subscribers:
+            subscription.put(event)
+
+class CacheSubscription(Subscription):
+
+    def __init__(self, hub, topic):
+        super(CacheSubscription, self).__init__(hub, topic)
+        self.seen = hub.get_sequence(topic)
+
+    # return the next event already published, without waiting
+    def poll(self):
+        latest = self.hub.get_sequence(self.topic)
+
+        if latest - self.seen > MAX_BACKLOG:
+            self.overflowed = True
+            self.seen = latest
+
+        # events can expire before they're read, so skip over missing ones
+        while self.seen < latest:
+            self.seen += 1
+            event = self.hub.cache.get(self.hub.event_key(self.topic, self.seen))
+
+            if event is not None:
+                return event
+
+        return None
+
+    def get(self, timeout):
+        deadline = time.time() + timeout
+
+        while True:
+            event = self.poll()
+
+            if event is not None or time.time() >= deadline:
+                return event
+
+            time.sleep(min(self.hub.poll_interval, max(deadline - time.time(), 0)))
+
+    async def aget(self, timeout):
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+
+        while True:
+            event = await run_blocking(self.poll)
+
+            if event is not None or loop.time() >= deadline:
+                return event
+
+            await asyncio.sleep(min(self.hub.poll_interval, max(deadline - loop.time(), 0)))
+
+## Keeps each topic as a numbered run of events in a shared cache that subscribers poll
+class CacheHub(object):
+
+    def __init__(self):
+        self.cache = caches[getattr(settings, 'FORUM_LIVE_CACHE', 'default')]
+        self.poll_interval = getattr(settings, 'FORUM_LIVE_POLL_INTERVAL', 0.5)
+        self.retention = getattr(settings, 'FORUM_LIVE_RETENTION', 5 * 60)
+
+    def sequence_key(self, topic):
+        return 'forumapp:live:%s' % topic
+
+    def event_key(self, topic, number):
+        return 'forumapp:live:%s:%d' % (topic, number)
+
+    def get_sequence(self, topic):
+        return self.cache.get(self.sequence_key(topic), 0)
+
+    def subscribe(self, topic):
+        return CacheSubscription(self, topic)
+
+    def publish(self, topic, event):
+        key = self.sequence_key(topic)
+        self.cache.add(key, 0, None)
+
+        # backends without an atomic incr can hand out a number twice, so keep taking
+        # numbers until one is free
+        while True:
+            number = self.cache.incr(key)
+
+            if self.cache.add(self.event_key(topic, number), event, self.retention):
+                return
+
+_hub = None
+_hub_lock = threading.Lock()
+
+## Return the process-wide hub
+def get_hub():
+    global _hub
+
+    with _hub_lock:
+        if _hub is None:
+            _hub = import_string(getattr(settings, 'FORUM_LIVE_BACKEND', DEFAULT_BACKEND))()
+
+        return _hub
+
+## The fields a stream needs to show a new comment without going back to the database
+def comment_event(comment):
+    return {
+        'pk': comment.pk,
+        'comment_id': comment.comment_id,
+        'thread_id': comment.thread_id,
+        'text': comment.text,
+        'pub_date': comment.pub_date.isoformat(),
+        'owner_id': comment.owner_id,
+    }
+
+def comment_from_event(event):
+    return Comment(pk=event['pk'], comment_id=event['comment_id'], thread_id=event['thread_id'], \
+            text=event['text'], pub_date=parse_datetime(event['pub_date']), owner_id=event['owner_id'])
+
+def publish_comment(channel_name, comment):
+    get_hub().publish(thread_topic(channel_name, comment.thread.thread_id), comment_event(comment))
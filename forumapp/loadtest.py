@@ -0,0 +1,187 @@
+import math, random, threading, time
+from http.client import HTTPException
+from urllib.error import HTTPError
+from urllib.request import urlopen
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from .models import Channel, Thread
+from .seeding import WORDS, zipf_choices
+
+## Drives the forum's routes the way readers would (see manage.py load_forum) and
+## reports latency percentiles per URL name. Popular channels and threads are visited
+## far more often than the rest, matching the shape of seeding.py's data. Requests
+## go through Django's test client in this process, or to a running server over HTTP.
+
+# share of requests going to each page
+DEFAULT_MIX = (
+    ('forumapp:channel', 1),
+    ('forumapp:thread', 3),
+    ('forumapp:comment', 5),
+    ('forumapp:search', 1),
+    ('forumapp:user', 1),
+)
+
+## Return the value below which p percent of the sorted values fall (nearest rank)
+def percentile(values, p):
+    if not values:
+        return None
+
+    rank = max(int(math.ceil(p / 100.0 * len(values))), 1)
+    return values[rank - 1]
+
+## Build the list of (url name, path) requests to make. The most recently used channels
+## and threads stand in for the popular ones.
+def plan(requests, mix=DEFAULT_MIX, exponent=1.1, seed=None, sample=1000):
+    rng = random.Random(seed)
+
+    channels = list(Channel.objects.values_list('channel_name', flat=True)[:sample])
+    threads = list(Thread.objects.values_list('channel_id', 'thread_id')[:sample])
+    users = list(User.objects.order_by('-last_login', 'pk').values_list('username', flat=True)[:sample])
+
+    names = rng.choices([name for name, weight in mix], weights=[weight for name, weight in mix], k=requests)
+    planned = []
+
+    # draw enough of each up front
+    channel_picks = iter(zipf_choices(rng, channels, requests, exponent) if channels else [])
+    thread_picks = iter(zipf_choices(rng, threads, requests, exponent) if threads else [])
+    user_picks = iter(zipf_choices(rng, users, requests, exponent) if users else [])
+
+    for name in names:
+        if name == 'forumapp:thread' and channels:
+            path = reverse(name, kwargs={'channel': next(channel_picks)})
+
+        elif name == 'forumapp:comment' and threads:
+            channel, thread_id = next(thread_picks)
+            path = reverse(name, kwargs={'channel': channel, 'thread': thread_id})
+
+        elif name == 'forumapp:user' and users:
+            path = reverse(name, kwargs={'username': next(user_picks)})
+
+        elif name == 'forumapp:search':
+            path = '%s?q=%s' % (reverse(name), rng.choice(WORDS))
+
+        else:
+            name, path = 'forumapp:channel', reverse('forumapp:channel')
+
+        planned.append((name, path))
+
+    return planned
+
+## Makes requests in this process through the test client, logged in as user if given
+class ClientTransport(object):
+
+    def __init__(self, user=None):
+        self.user = user
+
+    def open(self):
+        client = Client()
+
+        if self.user is not None:
+            client.force_login(self.user)
+
+        return client
+
+    # return the status code; the test client raises what a server would answer with a 500
+    def get(self, client, path):
+        try:
+            return client.get(path).status_code
+        except Exception:
+            return 500
+
+    def close(self, client):
+        connection.close()
+
+## Makes requests to a running server at base_url
+class HTTPTransport(object):
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def open(self):
+        return None
+
+    def get(self, client, path):
+        try:
+            with urlopen(self.base_url + path, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+
+        except HTTPError as e:
+            return e.code
+
+        # failed connections, and timeouts or resets while reading the body, which come
+        # as a bare socket.timeout or ConnectionResetError rather than a URLError
+        except (OSError, HTTPException):
+            return 0
+
+    def close(self, client):
+        pass
+
+## Make the planned requests with concurrency workers, returning {url name: [(seconds, status)]}
+## and the total time taken
+def run(requests, transport, concurrency=1):
+    results = {}
+    lock = threading.Lock()
+    pending = iter(requests)
+
+    # workers on their own threads close the connections they opened
+    def work(close):
+        client = transport.open()
+
+        try:
+            while True:
+                with lock:
+                    request = next(pending, None)
+
+                if request is None:
+                    return
+
+                name, path = request
+                start = time.time()
+                status = transport.get(client, path)
+                elapsed = time.time() - start
+
+                with lock:
+                    results.setdefault(name, []).append((elapsed, status))
+
+        finally:
+            if close:
+                transport.close(client)
+
+    start = time.time()
+
+    # a single worker runs on this thread, sharing its database connection
+    if concurrency <= 1:
+        work(False)
+
+    else:
+        workers = [threading.Thread(target=work, args=(True,)) for i in range(concurrency)]
+
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join()
+
+    return results, time.time() - start
+
+## Return {url name: {'requests', 'errors', 'p50', 'p95', 'p99', 'max'}}, times in milliseconds
+def summarize(results):
+    summary = {}
+
+    for name, timings in results.items():
+        durations = sorted(elapsed * 1000 for elapsed, status in timings)
+
+        summary[name] = {
+            'requests': len(timings),
+            'errors': len([status for elapsed, status in timings if not 200 <= status < 400]),
+            'p50': percentile(durations, 50),
+            'p95': percentile(durations, 95),
+            'p99': percentile(durations, 99),
+            'max': durations[-1],
+        }
+
+    return summary
@@ -0,0 +1,51 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from forumapp import loadtest
+
+# Measure the forum's latency under load
+class Command(BaseCommand):
+    help = 'Request the forum pages at a set concurrency and report p50/p95/p99 latency per page'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, \
+                help='Total requests to make')
+        parser.add_argument('--concurrency', type=int, default=10, \
+                help='Requests in flight at once')
+        parser.add_argument('--url', default=None, \
+                help='Base URL of a running server (e.g. http://localhost:8000); by default requests '
+                     'go through the test client in this process')
+        parser.add_argument('--user', default=None, \
+                help='Username to browse as (test client only)')
+        parser.add_argument('--seed', type=int, default=None, \
+                help='Random seed, for a repeatable request mix')
+
+    def handle(self, *args, **options):
+        if options['url']:
+            if options['user']:
+                raise CommandError('--user only works with the test client.')
+
+            transport = loadtest.HTTPTransport(options['url'])
+
+        else:
+            user = None
+
+            if options['user']:
+                user = User.objects.filter(username=options['user']).first()
+
+                if user is None:
+                    raise CommandError("No user named '%s'." % options['user'])
+
+            transport = loadtest.ClientTransport(user)
+
+        requests = loadtest.plan(options['requests'], seed=options['seed'])
+        results, elapsed = loadtest.run(requests, transport, options['concurrency'])
+        summary = loadtest.summarize(results)
+
+        self.stdout.write('%-22s %8s %6s %9s %9s %9s %9s' % ('page', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+
+        for name in sorted(summary):
+            row = summary[name]
+            self.stdout.write('%-22s %8d %6d %9.1f %9.1f %9.1f %9.1f' % (name, row['requests'], row['errors'], \
+                    row['p50'], row['p95'], row['p99'], row['max']))
+
+        self.stdout.write('%d request(s) in %.1fs (%.1f per second).' % (len(requests), elapsed, len(requests) / max(elapsed, 1e-6)))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from forumapp.models import Channel, Thread, Comment
+from forumapp.counters import count_drift, reconcile
+
+# Rebuild the thread/comment counters and last posters from the rows themselves
+class Command(BaseCommand):
+    help = 'Recount threads, comments and last posters for every channel and thread'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', \
+                help='Only report how many counters have drifted')
+
+    def handle(self, *args, **options):
+        threads, channels = count_drift(Channel, Thread, Comment)
+        self.stdout.write('%d thread(s) and %d channel(s) have drifted.' % (threads, channels))
+
+        if options['check']:
+            return
+
+        with transaction.atomic():
+            reconcile(Channel, Thread, Comment)
+
+        self.stdout.write(self.style.SUCCESS('Counters reconciled.'))
@@ -0,0 +1,83 @@
+import json, os, tempfile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from forumapp.models import Thread, Comment
+from forumapp import search
+
+# (kind, queryset, function turning a chunk of it into index rows), in the order they run
+def get_phases():
+    return [
+        ('thread', Thread._base_manager.all(), search.thread_rows),
+        ('comment', Comment._base_manager.all(), search.comment_rows),
+    ]
+
+# Rebuild the search index from the threads and comments themselves
+class Command(BaseCommand):
+    help = 'Rewrite every thread and comment into the search index, resuming an interrupted run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, \
+                help='Rows read and written per transaction')
+        parser.add_argument('--checkpoint', default=os.path.join(tempfile.gettempdir(), 'forumapp_reindex.json'), \
+                help='File recording progress, so an interrupted run can pick up where it stopped')
+        parser.add_argument('--restart', action='store_true', \
+                help='Ignore any saved progress and start from the beginning')
+
+    def handle(self, *args, **options):
+        if not search.is_indexed():
+            raise CommandError('The search index is only kept on SQLite.')
+
+        checkpoint = options['checkpoint']
+        progress = {} if options['restart'] else self.load(checkpoint)
+
+        if progress:
+            self.stdout.write('Resuming from %s %s.' % (progress['kind'], progress['last']))
+
+        phases = get_phases()
+        kinds = [kind for kind, queryset, rows in phases]
+        start = kinds.index(progress['kind']) if progress else 0
+
+        for kind, queryset, rows in phases[start:]:
+            last = progress.get('last', 0) if progress.get('kind') == kind else 0
+            count = 0
+
+            # walk the table by primary key, so memory stays bounded by one chunk and
+            # every chunk is a cheap indexed range read however far in it is
+            while True:
+                chunk = queryset.filter(pk__gt=last).order_by('pk')[:options['chunk_size']]
+
+                with transaction.atomic():
+                    index_rows = rows(chunk)
+                    search.write_rows(index_rows)
+
+                if not index_rows:
+                    break
+
+                # rowids are derived from primary keys (see search.thread_rowid)
+                last = index_rows[-1][0] // 2
+                count += len(index_rows)
+                self.save(checkpoint, {'kind': kind, 'last': last})
+
+            self.stdout.write('Indexed %d %s(s).' % (count, kind))
+
+        # rows for threads and comments deleted while the index wasn't listening
+        search.prune_rows()
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt.'))
+
+    def load(self, checkpoint):
+        if not os.path.exists(checkpoint):
+            return {}
+
+        with open(checkpoint) as f:
+            return json.load(f)
+
+    # write to a temporary file first so an interruption never leaves a torn checkpoint
+    def save(self, checkpoint, progress):
+        with open(checkpoint + '.tmp', 'w') as f:
+            json.dump(progress, f)
+
+        os.replace(checkpoint + '.tmp', checkpoint)
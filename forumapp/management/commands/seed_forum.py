@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from forumapp.seeding import Seeder
+
+# Fill the database with a synthetic forum for profiling and load tests
+class Command(BaseCommand):
+    help = 'Bulk-create users, channels, threads and comments with realistic, Zipf-like activity'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='seed', \
+                help='Start of every seeded username and channel name')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--channels', type=int, default=100)
+        parser.add_argument('--threads', type=int, default=10000)
+        parser.add_argument('--comments', type=int, default=100000)
+        parser.add_argument('--moderators', type=int, default=3, \
+                help='Most moderators per channel')
+        parser.add_argument('--bans', type=int, default=5, \
+                help='Most bans per channel')
+        parser.add_argument('--favorites', type=int, default=5, \
+                help='Most favorites per user')
+        parser.add_argument('--days', type=int, default=90, \
+                help='How far back posts go')
+        parser.add_argument('--exponent', type=float, default=1.1, \
+                help='Zipf exponent; higher piles more activity onto the most popular rows')
+        parser.add_argument('--password', default=None, \
+                help='Password for every seeded user (by default they cannot log in)')
+        parser.add_argument('--seed', type=int, default=None, \
+                help='Random seed, for repeatable data')
+
+    def handle(self, *args, **options):
+        seeder = Seeder(prefix=options['prefix'], users=options['users'], channels=options['channels'], \
+                threads=options['threads'], comments=options['comments'], moderators=options['moderators'], \
+                bans=options['bans'], favorites=options['favorites'], days=options['days'], \
+                exponent=options['exponent'], password=options['password'], seed=options['seed'])
+
+        if options['users'] < 1:
+            raise CommandError('At least one user is needed to own the channels.')
+
+        if seeder.exists():
+            raise CommandError("Rows prefixed '%s' already exist; pick another --prefix." % options['prefix'])
+
+        counts = seeder.seed()
+
+        self.stdout.write('Created %(users)d user(s), %(channels)d channel(s), %(threads)d thread(s) and ' \
+                '%(comments)d comment(s), with %(moderators)d moderator(s), %(bans)d ban(s) and ' \
+                '%(favorites)d favorite(s).' % counts)
+        self.stdout.write(self.style.SUCCESS('Run manage.py reindex_forum to make them searchable.'))
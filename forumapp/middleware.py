@@ -0,0 +1,41 @@
+from django.conf import settings
+from . import instrumentation
+
+## Measures each request (see instrumentation.py). Put it first so the time it reports
+## covers the other middleware too.
+class InstrumentationMiddleware(object):
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not instrumentation.is_enabled():
+            return self.get_response(request)
+
+        with instrumentation.measure() as stats:
+            request._instrumentation = stats
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        url_name = match.view_name if match is not None else 'unresolved'
+
+        if settings.DEBUG:
+            response['X-Forum-View'] = url_name
+            response['X-Forum-Queries'] = str(stats.queries)
+            response['X-Forum-Cache'] = '%d hit(s), %d miss(es)' % (stats.cache_hits, stats.cache_misses)
+            response['Server-Timing'] = 'db;dur=%.1f, render;dur=%.1f, total;dur=%.1f' \
+                    % (stats.db_time * 1000, stats.render_time * 1000, stats.total_time * 1000)
+
+        instrumentation.record(url_name, stats)
+
+        return response
+
+    # render here rather than in the handler, so the time (and queries) count
+    def process_template_response(self, request, response):
+        stats = getattr(request, '_instrumentation', None)
+
+        if stats is not None:
+            with instrumentation.measure_render(stats):
+                response.render()
+
+        return response
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('forumapp', '0001_initial'),
+    ]
+
+    operations = [
+        # keep the JSON columns around under new names until their data is copied
+        migrations.RenameField(
+            model_name='channel',
+            old_name='banned_users',
+            new_name='banned_users_json',
+        ),
+        migrations.RenameField(
+            model_name='channel',
+            old_name='moderators',
+            new_name='moderators_json',
+        ),
+        migrations.RenameField(
+            model_name='usersettings',
+            old_name='favorites',
+            new_name='favorites_json',
+        ),
+        migrations.CreateModel(
+            name='Ban',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='forumapp.Channel')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, to_field='username')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Favorite',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='forumapp.Channel')),
+                ('settings', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='forumapp.UserSettings')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Moderator',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='forumapp.Channel')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, to_field='username')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='channel',
+            name='banned_users',
+            field=models.ManyToManyField(related_name='banned_channels', through='forumapp.Ban', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='channel',
+            name='moderators',
+            field=models.ManyToManyField(related_name='moderated_channels', through='forumapp.Moderator', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='usersettings',
+            name='favorites',
+            field=models.ManyToManyField(related_name='favorited_by', through='forumapp.Favorite', to='forumapp.Channel'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ban',
+            unique_together=set([('channel', 'user')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='favorite',
+            unique_together=set([('settings', 'channel')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='moderator',
+            unique_together=set([('channel', 'user')]),
+        ),
+        migrations.AddIndex(
+            model_name='ban',
+            index=models.Index(fields=['user', 'channel'], name='forumapp_ban_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['channel', 'settings'], name='forumapp_fav_channel_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='moderator',
+            index=models.Index(fields=['user', 'channel'], name='forumapp_mod_user_idx'),
+        ),
+    ]
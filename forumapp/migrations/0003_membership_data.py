@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+from django.db import migrations
+
+## Copy the JSON username/channel lists into the membership tables,
+## skipping names that no longer exist (the lists were never cleaned up)
+def json_to_rows(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    Channel = apps.get_model('forumapp', 'Channel')
+    UserSettings = apps.get_model('forumapp', 'UserSettings')
+    Moderator = apps.get_model('forumapp', 'Moderator')
+    Ban = apps.get_model('forumapp', 'Ban')
+    Favorite = apps.get_model('forumapp', 'Favorite')
+
+    usernames = set(User.objects.values_list('username', flat=True))
+    channel_names = set(Channel.objects.values_list('channel_name', flat=True))
+
+    moderators, bans = [], []
+    for channel in Channel.objects.order_by('channel_name').iterator():
+        seen = set()
+        # keep promotion order, it decides who inherits an orphaned channel
+        for username in json.loads(channel.moderators_json or '[]'):
+            if username in usernames and username not in seen:
+                seen.add(username)
+                moderators.append(Moderator(channel_id=channel.channel_name, user_id=username))
+
+        for username in set(json.loads(channel.banned_users_json or '[]')):
+            if username in usernames:
+                bans.append(Ban(channel_id=channel.channel_name, user_id=username))
+
+    favorites = []
+    for settings in UserSettings.objects.iterator():
+        for channel_name in set(json.loads(settings.favorites_json or '[]')):
+            if channel_name in channel_names:
+                favorites.append(Favorite(settings_id=settings.pk, channel_id=channel_name))
+
+    Moderator.objects.bulk_create(moderators, batch_size=500)
+    Ban.objects.bulk_create(bans, batch_size=500)
+    Favorite.objects.bulk_create(favorites, batch_size=500)
+
+## Rebuild the JSON lists from the membership tables
+def rows_to_json(apps, schema_editor):
+    Channel = apps.get_model('forumapp', 'Channel')
+    UserSettings = apps.get_model('forumapp', 'UserSettings')
+    Moderator = apps.get_model('forumapp', 'Moderator')
+    Ban = apps.get_model('forumapp', 'Ban')
+    Favorite = apps.get_model('forumapp', 'Favorite')
+
+    moderators, bans, favorites = {}, {}, {}
+    for channel_id, user_id in Moderator.objects.order_by('pk').values_list('channel_id', 'user_id'):
+        moderators.setdefault(channel_id, []).append(user_id)
+
+    for channel_id, user_id in Ban.objects.order_by('pk').values_list('channel_id', 'user_id'):
+        bans.setdefault(channel_id, []).append(user_id)
+
+    for settings_id, channel_id in Favorite.objects.order_by('pk').values_list('settings_id', 'channel_id'):
+        favorites.setdefault(settings_id, []).append(channel_id)
+
+    for channel_name in set(moderators) | set(bans):
+        Channel.objects.filter(channel_name=channel_name).update(
+                moderators_json=json.dumps(moderators.get(channel_name, [])),
+                banned_users_json=json.dumps(bans.get(channel_name, [])))
+
+    for settings_id, channel_names in favorites.items():
+        UserSettings.objects.filter(pk=settings_id).update(favorites_json=json.dumps(channel_names))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forumapp', '0002_membership'),
+    ]
+
+    operations = [
+        migrations.RunPython(json_to_rows, rows_to_json),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forumapp', '0003_membership_data'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='channel',
+            name='banned_users_json',
+        ),
+        migrations.RemoveField(
+            model_name='channel',
+            name='moderators_json',
+        ),
+        migrations.RemoveField(
+            model_name='usersettings',
+            name='favorites_json',
+        ),
+    ]
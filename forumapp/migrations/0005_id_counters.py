@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+## Start each counter one past the largest id already handed out
+def init_counters(apps, schema_editor):
+    Channel = apps.get_model('forumapp', 'Channel')
+    Thread = apps.get_model('forumapp', 'Thread')
+    Comment = apps.get_model('forumapp', 'Comment')
+
+    largest_thread = Thread.objects.filter(channel=models.OuterRef('pk')).order_by('-thread_id').values('thread_id')[:1]
+    Channel.objects.update(next_thread_id=Coalesce(models.Subquery(largest_thread), -1) + 1)
+
+    largest_comment = Comment.objects.filter(thread=models.OuterRef('pk')).order_by('-comment_id').values('comment_id')[:1]
+    Thread.objects.update(next_comment_id=Coalesce(models.Subquery(largest_comment), -1) + 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forumapp', '0004_remove_membership_json'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='next_thread_id',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='next_comment_id',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(init_counters, migrations.RunPython.noop),
+    ]
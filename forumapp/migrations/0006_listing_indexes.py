@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.25 on 2026-10-18 02:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forumapp', '0005_id_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='channel',
+            index=models.Index(fields=['pin_date', '-recent_date', '-channel_name'], name='forumapp_channel_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['thread', '-pub_date', '-comment_id'], name='forumapp_comment_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(fields=['channel', 'pin_date', '-recent_date', '-thread_id'], name='forumapp_thread_order_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+## The FTS5 index behind search.py; other databases search with icontains instead
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE forumapp_search USING fts5("
+        "title, body, kind UNINDEXED, channel UNINDEXED, thread UNINDEXED, "
+        "tokenize = 'porter unicode61', prefix = '3')")
+
+    # threads take even rowids and comments odd ones (see search.thread_rowid)
+    schema_editor.execute(
+        "INSERT INTO forumapp_search (rowid, title, body, kind, channel, thread) "
+        "SELECT id * 2, thread_name, description, 'thread', channel_id, thread_id FROM forumapp_thread")
+    schema_editor.execute(
+        "INSERT INTO forumapp_search (rowid, title, body, kind, channel, thread) "
+        "SELECT c.id * 2 + 1, '', c.text, 'comment', t.channel_id, t.thread_id "
+        "FROM forumapp_comment c JOIN forumapp_thread t ON c.thread_id = t.id")
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS forumapp_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forumapp', '0007_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -1,6 +1,6 @@
 import datetime
 from django.utils import timezone
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 
@@ -8,12 +8,20 @@ from django.core.exceptions import ValidationError
 class NullsLastManager(models.Manager):
 
     def get_queryset(self):
-        return models.QuerySet(self.model, using=self._db).order_by(models.F('pin_date').asc(nulls_last=True), models.F('recent_date').desc())
+        return self._queryset_class(self.model, using=self._db).order_by(models.F('pin_date').asc(nulls_last=True), models.F('recent_date').desc())
+
+## Reserve the next value of a counter column on a parent row. The UPDATE locks the
+## row until the caller's transaction ends, so concurrent writers can't get the same id.
+## Any other parent columns to change (e.g. recent_date) ride along in the same UPDATE.
+def allocate_id(model, pk, field, **updates):
+    updates[field] = models.F(field) + 1
+    model._base_manager.filter(pk=pk).update(**updates)
+    return model._base_manager.filter(pk=pk).values_list(field, flat=True).get() - 1
 
 # One-to-one with User
 class UserSettings(models.Model):
     user = models.OneToOneField(User, primary_key=True)
-    favorites = models.TextField(default='[]')
+    favorites = models.ManyToManyField('Channel', through='Favorite', related_name='favorited_by')
     bio = models.TextField(max_length=250, default='Hello world')
 
     class Meta:
@@ -22,24 +30,45 @@ class UserSettings(models.Model):
     def __str__(self):
         return self.user.get_username()
 
+class ChannelQuerySet(models.QuerySet):
+
+    # exclude channels the user is banned from (a single NOT IN over the ban index)
+    def minus_bans(self, user):
+        if not user.is_authenticated:
+            return self
+
+        return self.exclude(ban__user=user.get_username())
+
 # Store channel_name as primary_key
 class Channel(models.Model):
-    objects = NullsLastManager()
+    objects = NullsLastManager.from_queryset(ChannelQuerySet)()
 
     channel_name = models.SlugField(max_length=30, primary_key=True)
     description = models.CharField(max_length=250, default='')
 
-    banned_users = models.TextField(default='[]')
-    moderators = models.TextField(default='[]')
+    banned_users = models.ManyToManyField(User, through='Ban', related_name='banned_channels')
+    moderators = models.ManyToManyField(User, through='Moderator', related_name='moderated_channels')
     pin_date = models.DateTimeField('date pinned', null=True)
     
     owner = models.ForeignKey(User, to_field="username", null=True, on_delete=models.SET_NULL)
     pub_date = models.DateTimeField('date published', default=timezone.now)
     recent_date = models.DateTimeField('date used', default=timezone.now)
 
+    # thread_id given to the next thread created in this channel
+    next_thread_id = models.IntegerField(default=0, editable=False)
+
+    # kept up to date by services.py and signals.py, see counters.py to rebuild them
+    thread_count = models.IntegerField(default=0, editable=False)
+    comment_count = models.IntegerField(default=0, editable=False)
+    last_poster = models.ForeignKey(User, to_field="username", null=True, editable=False, \
+            on_delete=models.SET_NULL, related_name='+')
+
     class Meta:
         ordering = ['-recent_date']
 
+        # matches NullsLastManager's ordering (plus the pagination tie breaker)
+        indexes = [models.Index(fields=['pin_date', '-recent_date', '-channel_name'], name='forumapp_channel_order_idx')]
+
     def __str__(self):
         return self.channel_name.replace('-', ' ')
 
@@ -51,6 +80,42 @@ class Channel(models.Model):
     is_recent.boolean = True
     is_recent.short_description = 'Published recently?'
 
+# Users allowed to moderate a channel, in the order they were promoted
+class Moderator(models.Model):
+    channel = models.ForeignKey(Channel, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, to_field="username", on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = (('channel', 'user'))
+        indexes = [models.Index(fields=['user', 'channel'], name='forumapp_mod_user_idx')]
+
+    def __str__(self):
+        return '%s moderates %s' % (self.user_id, self.channel_id)
+
+# Users banned from a channel
+class Ban(models.Model):
+    channel = models.ForeignKey(Channel, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, to_field="username", on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = (('channel', 'user'))
+        indexes = [models.Index(fields=['user', 'channel'], name='forumapp_ban_user_idx')]
+
+    def __str__(self):
+        return '%s banned from %s' % (self.user_id, self.channel_id)
+
+# Channels a user has favorited
+class Favorite(models.Model):
+    settings = models.ForeignKey(UserSettings, on_delete=models.CASCADE)
+    channel = models.ForeignKey(Channel, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = (('settings', 'channel'))
+        indexes = [models.Index(fields=['channel', 'settings'], name='forumapp_fav_channel_idx')]
+
+    def __str__(self):
+        return '%s favorited %s' % (self.settings, self.channel_id)
+
 # Store channel and thread_id as primary keys
 class Thread(models.Model):
     objects = NullsLastManager()
@@ -66,31 +131,46 @@ class Thread(models.Model):
     pub_date = models.DateTimeField('date published', default=timezone.now)
     recent_date = models.DateTimeField('date used', default=timezone.now)
 
+    # comment_id given to the next comment posted in this thread
+    next_comment_id = models.IntegerField(default=0, editable=False)
+
+    # kept up to date by services.py and signals.py, see counters.py to rebuild them
+    comment_count = models.IntegerField(default=0, editable=False)
+    last_poster = models.ForeignKey(User, to_field="username", null=True, editable=False, \
+            on_delete=models.SET_NULL, related_name='+')
+
     class Meta:
         unique_together = (('channel', 'thread_id'))
         ordering = ['pin_date', '-recent_date']
 
+        # threads are always listed per channel in NullsLastManager's ordering
+        indexes = [models.Index(fields=['channel', 'pin_date', '-recent_date', '-thread_id'], name='forumapp_thread_order_idx')]
+
     def __str__(self):
         return self.thread_name
 
     # validate uniqueness on channel and thread_id
     def validate_unique(self, exclude=None):
+        # forms leave out thread_id since save() assigns it
+        if exclude and set(exclude) & set(self._meta.unique_together[0]):
+            return
+
         threads = Thread.objects.filter(channel=self.channel)
         if self._state.adding and threads.filter(thread_id=self.thread_id).exists():
             raise ValidationError({field:'' for field in self._meta.unique_together[0]})
 
-    # override to auto set thread_id
+    # override to auto set thread_id from the channel's counter
+    # parent_updates: other channel columns to set while reserving the id
     def save(self, *args, **kwargs):
+        parent_updates = kwargs.pop('parent_updates', {})
 
         if self._state.adding:
-            threads = Thread.objects.filter(channel=self.channel)
-
-            last_id = threads.aggregate(largest=models.Max('thread_id'))['largest']
-
-            if last_id is not None:
-                self.thread_id = last_id + 1
+            with transaction.atomic(savepoint=False):
+                self.thread_id = allocate_id(Channel, self.channel_id, 'next_thread_id', **parent_updates)
+                super(Thread, self).save(*args, **kwargs)
 
-        super(Thread, self).save(*args, **kwargs)
+        else:
+            super(Thread, self).save(*args, **kwargs)
 
     def is_recent(self):
         now = timezone.now()
@@ -114,29 +194,34 @@ class Comment(models.Model):
         unique_together = (('thread', 'comment_id'))
         ordering = ['-pub_date']
 
+        # comments are listed per thread, newest first
+        indexes = [models.Index(fields=['thread', '-pub_date', '-comment_id'], name='forumapp_comment_order_idx')]
+
     def __str__(self):
         return self.text
 
     # validate uniqueness on thread and comment_id
     def validate_unique(self, exclude=None):
+        # forms leave out comment_id since save() assigns it
+        if exclude and set(exclude) & set(self._meta.unique_together[0]):
+            return
+
         not_unique = Comment.objects.filter(thread=self.thread, comment_id=self.comment_id).exists()
         if self._state.adding and not_unique:
             raise ValidationError({field:'' for field in self._meta.unique_together[0]})
 
-    # override to auto set comment_id
+    # override to auto set comment_id from the thread's counter
+    # parent_updates: other thread columns to set while reserving the id
     def save(self, *args, **kwargs):
+        parent_updates = kwargs.pop('parent_updates', {})
 
         if self._state.adding:
-            comments = Comment.objects.filter(thread=self.thread)
-
-            last_id = comments.aggregate(largest=models.Max('comment_id'))['largest']
-            
-            if last_id is not None:
-                self.comment_id = last_id + 1
-
-        #self.validate_unique()
+            with transaction.atomic(savepoint=False):
+                self.comment_id = allocate_id(Thread, self.thread_id, 'next_comment_id', **parent_updates)
+                super(Comment, self).save(*args, **kwargs)
 
-        super(Comment, self).save(*args, **kwargs)
+        else:
+            super(Comment, self).save(*args, **kwargs)
 
     # see if a comment was posted in the last day
     def is_recent(self):
@@ -0,0 +1,174 @@
+from functools import reduce
+from django.db import transaction
+from django.db.models import Q
+from django.contrib.auth.models import User
+from .models import Channel, Thread, Comment, Moderator, Ban
+from .signals import deleting_in_bulk, reassign_channels
+from . import counters, fragments, conditional, channelcache
+
+## Moderation over many rows at once, for cleaning up after spam waves. Rows are picked
+## with a filter (see select_comments/select_threads) and removed with one set-based
+## delete in a single transaction. The counters and caches of every thread and channel
+## they touched are then fixed once for the batch, instead of per row by the signals.
+
+ACTIONS = ('delete_comments', 'delete_threads', 'ban', 'purge')
+
+## Comments matching every filter given: channel name, owner's username, posted at or
+## after since, in one of the thread_ids (of the given channel)
+def select_comments(channel=None, owner=None, since=None, threads=None):
+    comments = Comment._base_manager.all()
+
+    if channel:
+        comments = comments.filter(thread__channel_id=channel)
+
+    if owner:
+        comments = comments.filter(owner_id=owner)
+
+    if since is not None:
+        comments = comments.filter(pub_date__gte=since)
+
+    if threads is not None:
+        comments = comments.filter(thread__thread_id__in=threads)
+
+    return comments
+
+## Threads matching every filter given, as for select_comments
+def select_threads(channel=None, owner=None, since=None, threads=None):
+    rows = Thread._base_manager.all()
+
+    if channel:
+        rows = rows.filter(channel_id=channel)
+
+    if owner:
+        rows = rows.filter(owner_id=owner)
+
+    if since is not None:
+        rows = rows.filter(pub_date__gte=since)
+
+    if threads is not None:
+        rows = rows.filter(thread_id__in=threads)
+
+    return rows
+
+## Delete the comments, returning how many went
+def delete_comments(comments):
+    parents = set(comments.order_by().values_list('thread_id', 'thread__channel_id'))
+    return _delete(comments, parents)['comments']
+
+## Delete the threads with their comments, returning how many of each went
+def delete_threads(threads):
+    parents = set((None, channel) for channel in threads.order_by().values_list('channel_id', flat=True))
+    deleted = _delete(threads, parents)
+
+    return deleted['threads'], deleted['comments']
+
+# parents: (thread pk, channel name) pairs whose counters the delete changes
+def _delete(queryset, parents):
+    threads = set(thread for thread, channel in parents if thread is not None)
+    channels = set(channel for thread, channel in parents)
+
+    with transaction.atomic():
+        with deleting_in_bulk():
+            total, deleted = queryset.delete()
+
+        if deleted:
+            counters.reconcile(Channel, Thread, Comment, threads=threads, channels=channels)
+
+    if deleted:
+        forget_parents(threads, channels)
+
+    return {
+        'threads': deleted.get(Thread._meta.label, 0),
+        'comments': deleted.get(Comment._meta.label, 0),
+    }
+
+# stand in for the per-row signal work skipped during the delete
+def forget_parents(threads, channels):
+    for channel in channels:
+        fragments.forget('channel', channel)
+        fragments.bump(fragments.channel_scope(channel))
+
+    conditional.touch(conditional.CHANNELS_SCOPE, *[conditional.channel_scope(channel) for channel in channels] \
+            + [conditional.thread_scope(thread) for thread in threads])
+
+## Ban each (channel name, username) pair, dropping their moderator status as UserView
+## does, and return how many bans are new
+def ban_users(pairs):
+    pairs = set(pairs)
+
+    # bans point at users, so unknown names can't be banned
+    users = set(User.objects.filter(username__in=set(user for channel, user in pairs)).values_list('username', flat=True))
+    pairs = set((channel, user) for channel, user in pairs if user in users)
+
+    if not pairs:
+        return 0
+
+    channels = set(channel for channel, user in pairs)
+
+    existing = set(Ban.objects.filter(channel_id__in=channels, user_id__in=users).values_list('channel_id', 'user_id'))
+    bans = [Ban(channel_id=channel, user_id=user) for channel, user in pairs - existing]
+
+    with transaction.atomic():
+        Ban.objects.bulk_create(bans)
+
+        Moderator.objects.filter(reduce(lambda a, b: a | b, [Q(channel_id=channel, user_id=user) \
+                for channel, user in pairs])).delete()
+
+    # bulk_create skips the save signals
+    for channel in channels:
+        fragments.bump(fragments.channel_scope(channel))
+
+    channelcache.forget(*channels)
+
+    conditional.touch(conditional.CHANNELS_SCOPE)
+
+    return len(bans)
+
+## Delete many users at once, returning how many went. Their channels are looked up
+## and handed on for the whole batch rather than once per user by the signals.
+def delete_users(users):
+    channels = list(Channel._base_manager.filter(owner__in=users.order_by()).values_list('pk', flat=True))
+
+    with transaction.atomic():
+        with deleting_in_bulk():
+            total, deleted = users.delete()
+
+        if channels:
+            reassign_channels(channels)
+
+    # owner names show in every fragment
+    fragments.bump(fragments.GLOBAL_SCOPE)
+    conditional.touch(conditional.GLOBAL_SCOPE)
+
+    return deleted.get(User._meta.label, 0)
+
+## Names of the channels a user has posted threads or comments in
+def posted_channels(username):
+    return set(Thread._base_manager.filter(owner_id=username).values_list('channel_id', flat=True)) \
+            | set(Comment._base_manager.filter(owner_id=username).values_list('thread__channel_id', flat=True))
+
+## Apply one of ACTIONS and return how many threads, comments and bans it affected.
+## channel limits it to one channel (otherwise every channel), user to what that user
+## posted, since to rows posted from then on and threads to those thread_ids.
+##   - delete_comments/delete_threads delete the matching rows
+##   - ban bans the user from the channel, or from every channel they posted in
+##   - purge deletes the user's matching threads and comments and bans them
+def moderate(action, channel=None, user=None, since=None, threads=None):
+    counts = {'threads': 0, 'comments': 0, 'bans': 0}
+
+    with transaction.atomic():
+
+        # the channels to ban from have to be looked up before the posts are gone
+        if action in ('ban', 'purge'):
+            banned = [channel] if channel else posted_channels(user)
+
+        if action in ('delete_threads', 'purge'):
+            counts['threads'], counts['comments'] = delete_threads(select_threads(channel, user, since, threads))
+
+        if action in ('delete_comments', 'purge'):
+            counts['comments'] += delete_comments(select_comments(channel, user, since, threads))
+
+        if action in ('ban', 'purge'):
+            counts['bans'] = ban_users((name, user) for name in banned)
+
+    return counts
@@ -0,0 +1,90 @@
+import hashlib, time
+from django.conf import settings
+from django.core.cache import caches
+from django.middleware.csrf import get_token
+from django.utils.html import escape
+from . import instrumentation, singleflight
+
+## Whole rendered pages shared between readers (see ConditionalGetMixin). A page is
+## rendered once the way a logged-out reader sees it and stored under its URL with its
+## content version, the same last change time the page's ETag is built from. Any post,
+## pin or deletion under the page's scopes changes the version, and the stored copy
+## goes stale. Rebuilds go through singleflight.py, so while one request renders the
+## new version the others are served the stale copy.
+##
+## Nothing in a shared page may belong to one reader, so it goes out with holes:
+##   - csrf tokens are stored as CSRF_PLACEHOLDER and filled in with the reader's own
+##     token on every response
+##   - controls that depend on who is reading (moderation and favorite buttons, the
+##     ban notice) are all rendered, marked with the personal tag in cache_helpers.py.
+##     For logged-in readers, base.html asks ReaderView who they are and shows the
+##     ones that apply.
+##
+## Logged-out readers always get shared pages. Logged-in readers get them too with
+## FORUM_PAGE_CACHE_USERS on, at the cost of their controls needing javascript.
+
+CSRF_PLACEHOLDER = 'forumapp-csrf-token'
+READER_PLACEHOLDER = 'forumapp-reader-url'
+
+def get_cache():
+    return caches[getattr(settings, 'FORUM_PAGE_CACHE', 'default')]
+
+# how long a page is served before it is rendered again, even if nothing changed
+def get_timeout():
+    return getattr(settings, 'FORUM_PAGE_TIMEOUT', 5 * 60)
+
+# how long a page is kept to stand in while a newer version is rendered
+def get_stale_timeout():
+    return getattr(settings, 'FORUM_PAGE_STALE_TIMEOUT', 60 * 60)
+
+## Return whether pages are shared with this user
+def is_shared_with(user):
+    return not user.is_authenticated or getattr(settings, 'FORUM_PAGE_CACHE_USERS', False)
+
+def page_key(path):
+    return 'forumapp:page:%s' % hashlib.md5(path.encode('utf-8')).hexdigest()
+
+# state: what the page's content depends on besides its URL
+def page_version(state):
+    return hashlib.md5('|'.join(state).encode('utf-8')).hexdigest()
+
+## Return the page stored for path and whether it is still the given version
+def get_page(path, version):
+    entry = get_cache().get(page_key(path))
+    if entry is None:
+        return None, False
+
+    stored_version, stored_at, content = entry
+    return content, stored_version == version and time.time() - stored_at < get_timeout()
+
+def set_page(path, version, content):
+    get_cache().set(page_key(path), (version, time.time(), content), get_stale_timeout())
+
+## Return the given version of the page at path (or a stale one while another request
+## renders it) and whether it is that version, calling render() for its content if it
+## isn't stored yet
+def get_shared_page(path, version, render):
+    content, fresh = get_page(path, version)
+    instrumentation.count_cache(fresh)
+
+    if fresh:
+        return content, True
+
+    def fetch():
+        content, fresh = get_page(path, version)
+        return content if fresh else None
+
+    def build():
+        content = render()
+        set_page(path, version, content)
+        return content
+
+    return singleflight.run(page_key(path), fetch, build, stale=content)
+
+## Fill a shared page's holes in for the request. reader_url is where the page's
+## javascript looks up a logged-in reader's standing.
+def personalize(content, request, reader_url):
+    content = content.replace(CSRF_PLACEHOLDER.encode('utf-8'), get_token(request).encode('utf-8'))
+    reader_url = escape(reader_url) if request.user.is_authenticated else ''
+
+    return content.replace(READER_PLACEHOLDER.encode('utf-8'), reader_url.encode('utf-8'))
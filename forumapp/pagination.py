@@ -0,0 +1,205 @@
+import base64, json
+from functools import reduce
+from django.conf import settings
+from django.db import models
+from django.db.models import Q
+from django.db.models.expressions import OrderBy
+
+DEFAULT_PAGE_SIZE = 25
+
+## Sort keys used to page through listings: (field, descending, nulls_last)
+# threads follow NullsLastManager's ordering with thread_id as the tie breaker
+THREAD_KEYS = (('pin_date', False, True), ('recent_date', True, False), ('thread_id', True, False))
+
+# channels follow the same ordering, with channel_name as the tie breaker
+CHANNEL_KEYS = (('pin_date', False, True), ('recent_date', True, False), ('channel_name', True, False))
+
+# comments are shown newest first
+COMMENT_KEYS = (('pub_date', True, False), ('comment_id', True, False))
+
+def get_page_size():
+    return getattr(settings, 'FORUM_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+
+## One page of a keyset-paginated listing
+class KeysetPage(object):
+
+    def __init__(self, paginator, object_list, has_next, has_previous):
+        self.paginator = paginator
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    # token pointing past the last row of this page
+    @property
+    def next_token(self):
+        if self.has_next and self.object_list:
+            return self.paginator.encode(self.object_list[-1])
+        return ''
+
+    # token pointing before the first row of this page
+    @property
+    def previous_token(self):
+        if self.has_previous and self.object_list:
+            return self.paginator.encode(self.object_list[0])
+        return ''
+
+# OrderBy that, reversed with nulls first on SQLite, sorts on "x IS NULL DESC, x DESC":
+# the exact mirror of Django's "x IS NULL, x ASC" for nulls last, so the expression
+# indexes built for the forward order serve it read backwards
+class MirroredOrderBy(OrderBy):
+
+    def as_sqlite(self, compiler, connection):
+        if self.nulls_first:
+            template = '%(expression)s IS NULL DESC, %(expression)s %(ordering)s'
+            return self.as_sql(compiler, connection, template=template)
+
+        return super(MirroredOrderBy, self).as_sqlite(compiler, connection)
+
+## Paginate a queryset by seeking on its sort keys instead of using OFFSET,
+## so every page costs the same no matter how deep into the listing it is.
+##
+## A nulls_last key may only lead the keys. It splits the listing in two partitions
+## (rows with a value, then rows without one), and pages past a cursor are read one
+## partition at a time: within a partition that key is plain or constant, so each
+## query bounds the leading key it sorts on and reads its index from the cursor on.
+class KeysetPaginator(object):
+
+    def __init__(self, queryset, keys, per_page=None):
+        self.queryset = queryset
+        self.keys = keys
+        self.per_page = per_page or get_page_size()
+
+    ## The whole listing's ordering, used for the first page
+    def ordering(self, reverse=False):
+        ordering = []
+        for name, descending, nulls_last in self.keys:
+            descending = descending != reverse
+
+            if nulls_last:
+                # the reversed listing has to put nulls first
+                nulls = {'nulls_first': True} if reverse else {'nulls_last': True}
+            else:
+                nulls = {}
+
+            ordering.append(MirroredOrderBy(models.F(name), descending=descending, **nulls))
+
+        return ordering
+
+    # ordering of a partition, where no key has nulls left to place
+    def _partition_ordering(self, keys, reverse):
+        return [models.F(name).desc() if descending != reverse else models.F(name).asc() \
+                for name, descending, nulls_last in keys]
+
+    ## Serialize the sort key of a row into an opaque url-safe token
+    def encode(self, obj):
+        values = []
+        for name, descending, nulls_last in self.keys:
+            value = getattr(obj, name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+
+        token = base64.urlsafe_b64encode(json.dumps(values).encode('utf-8'))
+        return token.decode('ascii').rstrip('=')
+
+    ## Parse a token back into key values, returning None if it was tampered with
+    def decode(self, token):
+        if not token:
+            return None
+
+        try:
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            values = json.loads(raw.decode('utf-8'))
+        except (ValueError, TypeError):
+            return None
+
+        if not isinstance(values, list) or len(values) != len(self.keys):
+            return None
+
+        # only a nulls_last key can hold a null
+        if any(value is None and not nulls_last for (name, descending, nulls_last), value in zip(self.keys, values)):
+            return None
+
+        model = self.queryset.model
+        try:
+            return [None if value is None else model._meta.get_field(name).to_python(value) \
+                    for (name, descending, nulls_last), value in zip(self.keys, values)]
+        except Exception:
+            return None
+
+    ## Build the (a > x) OR (a = x AND b > y) ... condition for a cursor within a partition
+    def seek(self, keys, values, reverse=False):
+        terms = []
+        equal = Q()
+
+        for (name, descending, nulls_last), value in zip(keys, values):
+            lookup = 'gt' if descending == reverse else 'lt'
+            terms.append(equal & Q(**{'%s__%s' % (name, lookup): value}))
+            equal &= Q(**{name: value})
+
+        return reduce(lambda a, b: a | b, terms)
+
+    # rows of a partition past the cursor, in order. The plain range on the leading key
+    # lets the database seek to the cursor, which it can't do from the OR-chain alone.
+    def _past(self, queryset, keys, values, reverse):
+        name, descending, nulls_last = keys[0]
+        bound = 'lte' if descending != reverse else 'gte'
+
+        return queryset.filter(**{'%s__%s' % (name, bound): values[0]}) \
+                .filter(self.seek(keys, values, reverse)).order_by(*self._partition_ordering(keys, reverse))
+
+    ## The querysets a page is read from, in order, until it is full: the first page reads
+    ## the whole listing, other pages the rest of the cursor's partition and then the next
+    ## partition from its edge
+    def segments(self, cursor, reverse=False):
+        if cursor is None:
+            return [self.queryset.order_by(*self.ordering(reverse))]
+
+        name, descending, nulls_last = self.keys[0]
+
+        if not nulls_last:
+            return [self._past(self.queryset, self.keys, cursor, reverse)]
+
+        nulls = self.queryset.filter(**{name + '__isnull': True})
+        values = self.queryset.filter(**{name + '__isnull': False})
+
+        # rows without a value come last
+        if cursor[0] is None:
+            segments = [self._past(nulls, self.keys[1:], cursor[1:], reverse)]
+
+            if reverse:
+                segments.append(values.order_by(*self._partition_ordering(self.keys, reverse)))
+        else:
+            segments = [self._past(values, self.keys, cursor, reverse)]
+
+            if not reverse:
+                segments.append(nulls.order_by(*self._partition_ordering(self.keys[1:], reverse)))
+
+        return segments
+
+    def page(self, after=None, before=None):
+        before = self.decode(before)
+        after = None if before is not None else self.decode(after)
+        reverse = before is not None
+        cursor = before if reverse else after
+
+        # fetch one extra row to find out whether there is another page
+        rows = []
+        for queryset in self.segments(cursor, reverse):
+            rows.extend(queryset[:self.per_page + 1 - len(rows)])
+
+            if len(rows) > self.per_page:
+                break
+
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if reverse:
+            rows.reverse()
+            return KeysetPage(self, rows, has_next=True, has_previous=has_more)
+
+        return KeysetPage(self, rows, has_next=has_more, has_previous=cursor is not None)
@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.db.models.query import ValuesListIterable
+from .models import Channel, Thread, Comment
+
+## The columns listing pages read, so list views fetch a page of rows in one query.
+## Owners come joined in with the rows (user_listing.html shows their username) and
+## everything the listing templates don't show, like ids handed out by save(), is
+## left out. Many-to-many fields (moderators, banned users) are never part of a row.
+##
+## With FORUM_LIGHT_ROWS on, thread and comment listings skip model instances
+## altogether: the columns come back as plain tuples wrapped in the small row classes
+## below, which carry just what thread_listing.html and comment_listing.html read.
+
+# columns each listing template reads, besides the owner's username
+LISTING_FIELDS = {
+    Channel: ('channel_name', 'description', 'pin_date', 'recent_date', 'thread_count', 'comment_count', 'last_poster'),
+    Thread: ('channel', 'thread_id', 'thread_name', 'description', 'pin_date', 'recent_date', 'comment_count', 'last_poster'),
+    Comment: ('thread', 'comment_id', 'text', 'pub_date'),
+}
+
+def use_light_rows():
+    return getattr(settings, 'FORUM_LIGHT_ROWS', False)
+
+# owners are keyed by username, so a row's owner_id is the name to show
+class OwnerRow(object):
+    __slots__ = ('username',)
+
+    def __init__(self, username):
+        self.username = username
+
+    def __str__(self):
+        return self.username
+
+## A listing row read straight from its columns. _meta is the model's, so the fragment
+## cache files the row's fragment under the same key a model instance would get.
+class ListingRow(object):
+    __slots__ = ()
+    columns = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.columns, values):
+            setattr(self, name, value)
+
+    @property
+    def owner(self):
+        return OwnerRow(self.owner_id) if self.owner_id is not None else None
+
+class ThreadRow(ListingRow):
+    columns = ('pk', 'channel_id', 'thread_id', 'thread_name', 'description', 'pin_date', 'recent_date', \
+            'comment_count', 'last_poster_id', 'owner_id')
+    __slots__ = columns
+    _meta = Thread._meta
+
+class CommentRow(ListingRow):
+    columns = ('pk', 'thread_id', 'comment_id', 'text', 'pub_date', 'owner_id')
+    __slots__ = columns
+    _meta = Comment._meta
+
+ROW_CLASSES = {Thread: ThreadRow, Comment: CommentRow}
+
+# values_list() results handed out as row objects; querysets keep their iterable class
+# through filter(), order_by() and slicing, so pagination works on them unchanged
+class RowIterable(ValuesListIterable):
+
+    def __iter__(self):
+        row_class = ROW_CLASSES[self.queryset.model]
+
+        for values in super(RowIterable, self).__iter__():
+            yield row_class(*values)
+
+## Return a queryset of the model's row objects rather than model instances
+def rows(queryset):
+    queryset = queryset.values_list(*ROW_CLASSES[queryset.model].columns)
+    queryset._iterable_class = RowIterable
+
+    return queryset
+
+## Narrow a queryset of channels, threads or comments down to what its listing shows
+def listing(queryset):
+    if use_light_rows() and queryset.model in ROW_CLASSES:
+        return rows(queryset)
+
+    fields = LISTING_FIELDS[queryset.model] + ('owner__username',)
+    return queryset.select_related('owner').only(*fields)
@@ -0,0 +1,295 @@
+import re, threading
+from functools import reduce
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from .models import Thread, Comment, Ban
+
+## Full-text search over thread names/descriptions and comment text.
+## On SQLite the rows are mirrored into the forumapp_search FTS5 table (created by
+## migration 0008) and ranked with bm25; other databases fall back to icontains scans.
+## Each thread and comment owns one row of the index, addressed by a rowid derived
+## from its primary key, so keeping it in sync is a single indexed write per row.
+
+TABLE = 'forumapp_search'
+
+# bm25 weights for the title and body columns
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+
+# snippet() markers, swapped for <mark> tags once the text has been escaped
+HIT_START, HIT_END = '\x02', '\x03'
+
+DEFAULT_RESULTS_PER_PAGE = 20
+
+# how many of the newest matches get ranked
+DEFAULT_CANDIDATES = 1000
+
+# shorter words aren't matched as prefixes, they expand to too many terms
+MIN_PREFIX_LENGTH = 3
+
+def get_results_per_page():
+    return getattr(settings, 'FORUM_SEARCH_RESULTS', DEFAULT_RESULTS_PER_PAGE)
+
+def get_candidates():
+    return getattr(settings, 'FORUM_SEARCH_CANDIDATES', DEFAULT_CANDIDATES)
+
+# queued changes written to the index at once
+DEFAULT_BATCH_SIZE = 200
+
+def get_batch_size():
+    return getattr(settings, 'FORUM_SEARCH_BATCH', DEFAULT_BATCH_SIZE)
+
+def is_indexed():
+    return connection.vendor == 'sqlite'
+
+def thread_rowid(pk):
+    return pk * 2
+
+def comment_rowid(pk):
+    return pk * 2 + 1
+
+## Index maintenance is batched: the signals only queue the ids of changed threads and
+## comments (see queue), and flush() later writes the queued rows as they are in the
+## database at that point, so deleted rows simply drop out. Flushing happens when the
+## request has finished, before a search runs, and whenever a batch fills up; anything
+## lost in between is repaired by manage.py reindex_forum.
+
+# ids queued on this thread of execution, which flushes them on its own connection
+_pending = threading.local()
+
+def get_pending():
+    if not hasattr(_pending, 'changes'):
+        _pending.changes = {'thread': set(), 'comment': set()}
+
+    return _pending.changes
+
+## Queue a thread or comment that was saved or deleted
+def queue(kind, pk):
+    if not is_indexed():
+        return
+
+    pending = get_pending()
+    pending[kind].add(pk)
+
+    if sum(len(ids) for ids in pending.values()) >= get_batch_size():
+        flush()
+
+## Write every queued row to the index, in one transaction
+def flush():
+    pending = get_pending()
+    threads, comments = pending['thread'], pending['comment']
+
+    if not (threads or comments):
+        return
+
+    pending['thread'], pending['comment'] = set(), set()
+
+    try:
+        with transaction.atomic():
+            rows = thread_rows(Thread._base_manager.filter(pk__in=threads)) \
+                    + comment_rows(Comment._base_manager.filter(pk__in=comments))
+
+            found = set(row[0] for row in rows)
+            removed = [thread_rowid(pk) for pk in threads] + [comment_rowid(pk) for pk in comments]
+
+            write_rows(rows)
+            delete_rows([rowid for rowid in removed if rowid not in found])
+
+    # put the ids back for the next flush
+    except Exception:
+        pending['thread'] |= threads
+        pending['comment'] |= comments
+        raise
+
+## Index rows for threads/comments: (rowid, title, body, kind, channel, thread)
+def thread_rows(threads):
+    return [(thread_rowid(pk), name, description, 'thread', channel, thread_id) for pk, name, description, channel, thread_id \
+            in threads.values_list('pk', 'thread_name', 'description', 'channel_id', 'thread_id')]
+
+def comment_rows(comments):
+    return [(comment_rowid(pk), '', text, 'comment', channel, thread_id) for pk, text, channel, thread_id \
+            in comments.values_list('pk', 'text', 'thread__channel_id', 'thread__thread_id')]
+
+def write_rows(rows):
+    with connection.cursor() as cursor:
+        cursor.executemany('INSERT OR REPLACE INTO %s (rowid, title, body, kind, channel, thread) ' \
+                'VALUES (%%s, %%s, %%s, %%s, %%s, %%s)' % TABLE, rows)
+
+def delete_rows(rowids):
+    with connection.cursor() as cursor:
+        cursor.executemany('DELETE FROM %s WHERE rowid = %%s' % TABLE, [(rowid,) for rowid in rowids])
+
+## Remove index rows whose thread or comment no longer exists
+def prune_rows():
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM %s WHERE kind = 'thread' AND rowid / 2 NOT IN (SELECT id FROM %s)" \
+                % (TABLE, Thread._meta.db_table))
+        cursor.execute("DELETE FROM %s WHERE kind = 'comment' AND rowid / 2 NOT IN (SELECT id FROM %s)" \
+                % (TABLE, Comment._meta.db_table))
+
+## Turn user input into an FTS5 query: every word must match, the last one as a prefix
+## (so results show up while typing). Words are quoted so operators and punctuation in
+## the input are never interpreted.
+def to_match(query):
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+
+    terms = ['"%s"' % word for word in words]
+    if len(words[-1]) >= MIN_PREFIX_LENGTH:
+        terms[-1] += '*'
+
+    return ' '.join(terms)
+
+## One search result, pointing at a thread (for comments, the thread they're in)
+class SearchHit(object):
+
+    def __init__(self, kind, channel, thread, title, snippet):
+        self.kind = kind
+        self.channel = channel
+        self.thread = thread
+        self.title = title
+        self.snippet = snippet
+
+## One page of results, numbered from 1
+class SearchPage(object):
+
+    def __init__(self, hits, number, has_next):
+        self.hits = hits
+        self.number = number
+        self.has_next = has_next
+        self.has_previous = number > 1
+
+    def __iter__(self):
+        return iter(self.hits)
+
+    def __len__(self):
+        return len(self.hits)
+
+    @property
+    def next_number(self):
+        return self.number + 1
+
+    @property
+    def previous_number(self):
+        return self.number - 1
+
+def highlight(snippet):
+    return mark_safe(escape(snippet).replace(HIT_START, '<mark>').replace(HIT_END, '</mark>'))
+
+## Search the forum. channel limits results to one channel and user hides the channels
+## they're banned from.
+def search(query, channel=None, user=None, page=1):
+    per_page = get_results_per_page()
+    page = max(page, 1)
+
+    # searches see this thread's own changes
+    flush()
+
+    banned = []
+    if user is not None and user.is_authenticated:
+        banned = list(Ban.objects.filter(user_id=user.get_username()).values_list('channel_id', flat=True))
+
+    if is_indexed():
+        hits = _search_index(query, channel, banned, per_page + 1, (page - 1) * per_page)
+    else:
+        hits = _search_scan(query, channel, banned, per_page + 1, (page - 1) * per_page)
+
+    has_next = len(hits) > per_page
+    hits = hits[:per_page]
+    _attach_thread_names(hits)
+
+    return SearchPage(hits, page, has_next)
+
+def _search_index(query, channel, banned, limit, offset):
+    match = to_match(query)
+    if match is None:
+        return []
+
+    where = ['%s MATCH %%s' % TABLE]
+    params = [match]
+
+    if channel:
+        where.append('channel = %s')
+        params.append(channel)
+
+    if banned:
+        where.append('channel NOT IN (%s)' % ', '.join(['%s'] * len(banned)))
+        params += banned
+
+    where = ' AND '.join(where)
+
+    with connection.cursor() as cursor:
+
+        # bm25 has to score every match, so only rank the newest candidates; walking the
+        # index backwards by rowid to find where they start is cheap even for common words.
+        # Threads and comments number their rowids from separate primary keys, so each
+        # kind gets its own window (or a common word in comments would push out every thread).
+        windows, window_params = [], []
+
+        for kind in ('thread', 'comment'):
+            cursor.execute('SELECT rowid FROM %s WHERE %s AND kind = %%s ORDER BY rowid DESC LIMIT 1 OFFSET %%s' \
+                    % (TABLE, where), params + [kind, get_candidates() - 1])
+            oldest = cursor.fetchone()
+
+            if oldest is None:
+                windows.append('kind = %s')
+                window_params.append(kind)
+            else:
+                windows.append('(kind = %s AND rowid >= %s)')
+                window_params += [kind, oldest[0]]
+
+        where += ' AND (%s)' % ' OR '.join(windows)
+        params += window_params
+
+        cursor.execute('SELECT kind, channel, thread, title, snippet(%s, 1, %%s, %%s, %%s, 16) FROM %s WHERE %s ' \
+                'ORDER BY bm25(%s, %s, %s) LIMIT %%s OFFSET %%s' % (TABLE, TABLE, where, TABLE, TITLE_WEIGHT, BODY_WEIGHT), \
+                [HIT_START, HIT_END, '...'] + params + [limit, offset])
+        rows = cursor.fetchall()
+
+    return [SearchHit(kind, chan, thread, title, highlight(snippet)) for kind, chan, thread, title, snippet in rows]
+
+# threads matching every word come first, then comments, newest first
+def _search_scan(query, channel, banned, limit, offset):
+    words = re.findall(r'\w+', query)
+    if not words:
+        return []
+
+    threads = Thread._base_manager.all()
+    comments = Comment._base_manager.select_related('thread')
+
+    for word in words:
+        threads = threads.filter(Q(thread_name__icontains=word) | Q(description__icontains=word))
+        comments = comments.filter(text__icontains=word)
+
+    if channel:
+        threads = threads.filter(channel_id=channel)
+        comments = comments.filter(thread__channel_id=channel)
+
+    if banned:
+        threads = threads.exclude(channel_id__in=banned)
+        comments = comments.exclude(thread__channel_id__in=banned)
+
+    hits = [SearchHit('thread', t.channel_id, t.thread_id, t.thread_name, t.description) \
+            for t in threads.order_by('-recent_date')[:offset + limit]]
+    hits += [SearchHit('comment', c.thread.channel_id, c.thread.thread_id, '', c.text) \
+            for c in comments.order_by('-pub_date')[:offset + limit]]
+
+    return hits[offset:offset + limit]
+
+# comment hits show the name of their thread, looked up in one query
+def _attach_thread_names(hits):
+    keys = set((hit.channel, hit.thread) for hit in hits if hit.kind == 'comment')
+    if not keys:
+        return
+
+    condition = reduce(lambda a, b: a | b, [Q(channel_id=chan, thread_id=thread) for chan, thread in keys])
+    names = {(chan, thread): name for chan, thread, name in \
+            Thread._base_manager.filter(condition).values_list('channel_id', 'thread_id', 'thread_name')}
+
+    for hit in hits:
+        if hit.kind == 'comment':
+            hit.title = names.get((hit.channel, hit.thread), '')
@@ -0,0 +1,199 @@
+import datetime, itertools, random
+from collections import Counter
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from .models import UserSettings, Channel, Thread, Comment, Moderator, Ban, Favorite
+from . import counters
+
+## Synthetic forum data shaped like a real forum (see manage.py seed_forum). Activity
+## follows Zipf-like distributions: a few channels get most of the threads, a few
+## threads most of the comments and a few users write most of both. Rows go in with
+## bulk_create, a chunk at a time, and the counters are rebuilt once at the end.
+
+# objects handed to each bulk_create (which splits them further to suit the database)
+CHUNK_SIZE = 5000
+
+WORDS = ('forum', 'thread', 'reply', 'garden', 'python', 'django', 'music', 'travel', 'recipe', 'photo', \
+        'question', 'answer', 'weekend', 'project', 'update', 'review', 'game', 'movie', 'book', 'idea')
+
+## Cumulative weights for n ranks under Zipf's law with exponent s
+def zipf_weights(n, s):
+    return list(itertools.accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+
+## Pick k items, the earlier ones far more often
+def zipf_choices(rng, items, k, s):
+    return rng.choices(items, cum_weights=zipf_weights(len(items), s), k=k)
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for i in range(words))
+
+def bulk_create(model, objects):
+    for start in range(0, len(objects), CHUNK_SIZE):
+        model.objects.bulk_create(objects[start:start + CHUNK_SIZE])
+
+class Seeder(object):
+
+    def __init__(self, prefix='seed', users=1000, channels=100, threads=10000, comments=100000, \
+            moderators=3, bans=5, favorites=5, days=90, exponent=1.1, password=None, seed=None):
+        self.prefix = prefix
+        self.users = users
+        self.channels = channels
+        self.threads = threads
+        self.comments = comments
+        self.moderators = moderators
+        self.bans = bans
+        self.favorites = favorites
+        self.days = days
+        self.exponent = exponent
+        self.password = password
+        self.rng = random.Random(seed)
+        self.now = timezone.now()
+
+    def username(self, i):
+        return '%s-user%s' % (self.prefix, i)
+
+    def channel_name(self, i):
+        return '%s-channel-%s' % (self.prefix, i)
+
+    # a time within the seeded period, no earlier than after
+    def date(self, after=None):
+        start = after or self.now - datetime.timedelta(days=self.days)
+        return start + (self.now - start) * self.rng.random()
+
+    ## Return whether rows with this prefix are already in the database
+    def exists(self):
+        return User.objects.filter(username__startswith=self.username('')).exists() \
+                or Channel.objects.filter(channel_name__startswith=self.channel_name('')).exists()
+
+    ## Create everything and return how many rows of each kind went in
+    def seed(self):
+        with transaction.atomic():
+            usernames = self.seed_users()
+            channels = [(self.channel_name(i), self.rng.choice(usernames)) for i in range(self.channels)]
+
+            threads = self.plan_threads(usernames, channels)
+            self.seed_channels(channels, threads)
+            threads = self.seed_threads(threads)
+
+            comments = self.seed_comments(usernames, threads)
+            moderators, bans, favorites = self.seed_memberships(usernames, channels)
+
+            counters.reconcile(Channel, Thread, Comment)
+
+        return {'users': len(usernames), 'channels': len(channels), 'threads': len(threads), 'comments': comments, \
+                'moderators': moderators, 'bans': bans, 'favorites': favorites}
+
+    def seed_users(self):
+        # hashing is slow, so every seeded user shares one hash
+        password = make_password(self.password)
+        usernames = [self.username(i) for i in range(self.users)]
+
+        bulk_create(User, [User(username=name, password=password) for name in usernames])
+        pks = User.objects.filter(username__startswith=self.username('')).values_list('pk', flat=True)
+        bulk_create(UserSettings, [UserSettings(user_id=pk) for pk in pks])
+
+        # the most active users come first
+        self.rng.shuffle(usernames)
+        return usernames
+
+    # unsaved threads, with the number of comments each will get as next_comment_id
+    def plan_threads(self, usernames, channels):
+        homes = zipf_choices(self.rng, [name for name, owner in channels], self.threads, self.exponent)
+        owners = zipf_choices(self.rng, usernames, self.threads, self.exponent)
+        next_ids = Counter()
+        threads = []
+
+        for channel, owner in zip(homes, owners):
+            pub_date = self.date()
+            threads.append(Thread(channel_id=channel, thread_id=next_ids[channel], owner_id=owner, \
+                    thread_name=sentence(self.rng, 4), description=sentence(self.rng, 10), \
+                    pub_date=pub_date, recent_date=pub_date))
+            next_ids[channel] += 1
+
+        # popular threads get most of the comments; rank them in a random order
+        ranked = list(range(len(threads)))
+        self.rng.shuffle(ranked)
+        comment_counts = Counter(zipf_choices(self.rng, ranked, self.comments, self.exponent)) if threads else Counter()
+
+        for i, thread in enumerate(threads):
+            thread.next_comment_id = comment_counts[i]
+
+            if thread.next_comment_id:
+                thread.recent_date = self.date(thread.pub_date)
+
+        return threads
+
+    def seed_channels(self, channels, threads):
+        next_ids = Counter(thread.channel_id for thread in threads)
+        recent = {}
+
+        for thread in threads:
+            recent[thread.channel_id] = max(recent.get(thread.channel_id, thread.recent_date), thread.recent_date)
+
+        start = self.now - datetime.timedelta(days=self.days)
+        bulk_create(Channel, [Channel(channel_name=name, owner_id=owner, description=sentence(self.rng, 8), \
+                pub_date=start, recent_date=recent.get(name, start), next_thread_id=next_ids[name]) \
+                for name, owner in channels])
+
+    # save the threads, returning (pk, pub_date, recent_date, comments) for each
+    def seed_threads(self, threads):
+        bulk_create(Thread, threads)
+
+        pks = dict(((channel, thread_id), pk) for pk, channel, thread_id in \
+                Thread.objects.filter(channel__channel_name__startswith=self.channel_name('')) \
+                .values_list('pk', 'channel_id', 'thread_id'))
+
+        return [(pks[(thread.channel_id, thread.thread_id)], thread.pub_date, thread.recent_date, thread.next_comment_id) \
+                for thread in threads]
+
+    def seed_comments(self, usernames, threads):
+        posters = iter(zipf_choices(self.rng, usernames, self.comments, self.exponent))
+        batch = []
+        created = 0
+
+        for pk, pub_date, recent_date, count in threads:
+            if not count:
+                continue
+
+            # spread the comments out, the last one landing on the thread's recent_date
+            dates = sorted(pub_date + (recent_date - pub_date) * self.rng.random() for i in range(count - 1))
+            dates.append(recent_date)
+
+            for comment_id, date in enumerate(dates):
+                batch.append(Comment(thread_id=pk, comment_id=comment_id, owner_id=next(posters), \
+                        text=sentence(self.rng, 12), pub_date=date))
+
+            if len(batch) >= CHUNK_SIZE:
+                bulk_create(Comment, batch)
+                created += len(batch)
+                batch = []
+
+        bulk_create(Comment, batch)
+        return created + len(batch)
+
+    # moderators, bans and favorites, weighted towards the popular channels
+    def seed_memberships(self, usernames, channels):
+        names = [name for name, owner in channels]
+        moderators, bans = set(), set()
+
+        for name, owner in channels:
+            staff = self.rng.sample(usernames, min(len(usernames), self.rng.randint(0, self.moderators)))
+            moderators.update((name, user) for user in staff if user != owner)
+
+            banned = self.rng.sample(usernames, min(len(usernames), self.rng.randint(0, self.bans)))
+            bans.update((name, user) for user in banned if user != owner and (name, user) not in moderators)
+
+        pks = dict(User.objects.filter(username__startswith=self.username('')).values_list('username', 'pk'))
+        favorites = set()
+
+        for user in usernames:
+            count = self.rng.randint(0, self.favorites)
+            favorites.update((pks[user], name) for name in zipf_choices(self.rng, names, count, self.exponent))
+
+        bulk_create(Moderator, [Moderator(channel_id=name, user_id=user) for name, user in moderators])
+        bulk_create(Ban, [Ban(channel_id=name, user_id=user) for name, user in bans])
+        bulk_create(Favorite, [Favorite(settings_id=pk, channel_id=name) for pk, name in favorites])
+
+        return len(moderators), len(bans), len(favorites)
@@ -0,0 +1,38 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Channel
+
+## Posting paths shared by the views. Callers validate first (see forms.py) and hand
+## over an unsaved instance; each post is then a single transaction that inserts once
+## and bumps recent_date and the counters on the parents with plain UPDATEs.
+
+## Save a new thread; the channel's recent_date and counters are set by the same
+## UPDATE that reserves the thread_id
+def post_thread(thread):
+    date = timezone.now()
+    thread.pub_date = thread.recent_date = date
+    thread.last_poster_id = thread.owner_id
+
+    with transaction.atomic():
+        thread.save(parent_updates={'recent_date': date, 'last_poster': thread.owner_id, \
+                'thread_count': F('thread_count') + 1})
+
+    return thread
+
+## Save a new comment and mark its thread and channel as recently used
+def post_comment(comment):
+    date = timezone.now()
+    comment.pub_date = date
+
+    updates = {'recent_date': date, 'last_poster': comment.owner_id, 'comment_count': F('comment_count') + 1}
+
+    with transaction.atomic():
+        comment.save(parent_updates=dict(updates))
+        Channel.objects.filter(pk=comment.thread.channel_id).update(**updates)
+
+    # keep the caller's thread instance in step with the row
+    comment.thread.recent_date = date
+    comment.thread.last_poster_id = comment.owner_id
+
+    return comment
@@ -1,25 +1,203 @@
-import json
+import threading
+from contextlib import contextmanager
 from django.dispatch import receiver
-from django.db.models.signals import post_delete 
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.signals import pre_delete, post_save, post_delete
+from django.core.signals import request_finished
 from django.contrib.auth.models import User
-from .models import Channel, Thread, Comment
+from .models import Channel, Thread, Comment, Moderator, Ban, Favorite
+from . import fragments, conditional, search, channelcache, counters
 
-#When we delete a user, reassign or delete channels without owners
+# threads being deleted on this thread of execution, whose comments go with them, by
+# pk with their comment counts
+_deleting = threading.local()
+
+def deleting_threads():
+    if not hasattr(_deleting, 'threads'):
+        _deleting.threads = {}
+
+    return _deleting.threads
+
+## Rows deleted inside this block leave the counters and caches alone; the caller
+## (see moderation.py) fixes them up once for the whole batch
+@contextmanager
+def deleting_in_bulk():
+    previous, _deleting.bulk = is_bulk_deleting(), True
+
+    try:
+        yield
+    finally:
+        _deleting.bulk = previous
+
+def is_bulk_deleting():
+    return getattr(_deleting, 'bulk', False)
+
+# channels owned by users being deleted on this thread of execution, by username
+def orphaned_channels():
+    if not hasattr(_deleting, 'channels'):
+        _deleting.channels = {}
+
+    return _deleting.channels
+
+#Note a user's channels before the delete sets their owner to NULL
+@receiver(pre_delete, sender=User)
+def capture_channels(sender, instance, **kwargs):
+    if is_bulk_deleting():
+        return
+
+    orphaned_channels()[instance.username] = list(Channel._base_manager.filter(owner_id=instance.username) \
+            .order_by().values_list('pk', flat=True))
+
+#When we delete a user, reassign or delete the channels they owned
 @receiver(post_delete, sender=User)
 def delete_repo(sender, instance, **kwargs):
+    channels = orphaned_channels().pop(instance.username, None)
+
+    if channels:
+        reassign_channels(channels)
+
+## Hand each of the channels that lost their owner to its earliest moderator, and
+## delete the ones nobody moderates. Moderator rows are removed along with their user,
+## so a deleted user never inherits a channel.
+def reassign_channels(channels):
+    successor = Moderator.objects.filter(channel=OuterRef('pk')).order_by('pk').values('user')[:1]
+
+    orphans = Channel._base_manager.filter(pk__in=channels, owner=None)
+    orphans.update(owner=Subquery(successor))
+    orphans.delete()
+
+    # the owner went with an UPDATE, which sends no signals
+    channelcache.forget(*channels)
+
+#Take a deleted comment off its thread's and channel's counters
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+
+    #the thread's own post_delete handles comments removed along with it
+    if instance.thread_id in deleting_threads() or is_bulk_deleting():
+        return
+
+    #the comment may have been the newest one, so the last posters are looked up again
+    #(the thread's first, as the channel takes its from its threads)
+    Thread._base_manager.filter(pk=instance.thread_id).update(comment_count=F('comment_count') - 1, \
+            last_poster=counters.thread_last_poster(Comment))
+    Channel._base_manager.filter(thread=instance.thread_id).update(comment_count=F('comment_count') - 1, \
+            last_poster=counters.channel_last_poster(Thread))
+
+    #the parents' counters changed without touching their dates
+    fragments.forget('thread', instance.thread_id)
+    fragments.forget('channel', instance.thread.channel_id)
+
+#Deletes cascade to the comments first, so note the thread before they go. Its comment
+#count is read from the row, since comments may have been posted since the instance
+#was loaded.
+@receiver(pre_delete, sender=Thread)
+def mark_thread_deleting(sender, instance, **kwargs):
+    comment_count = None
+
+    if not is_bulk_deleting():
+        comment_count = Thread._base_manager.filter(pk=instance.pk).values_list('comment_count', flat=True).first()
+
+    deleting_threads()[instance.pk] = comment_count
+
+#Take a deleted thread and all of its comments off the channel's counters (and maybe its
+#last poster) in one update
+@receiver(post_delete, sender=Thread)
+def uncount_thread(sender, instance, **kwargs):
+    comment_count = deleting_threads().pop(instance.pk, None)
+
+    if is_bulk_deleting():
+        return
+
+    if comment_count is None:
+        comment_count = instance.comment_count
+
+    Channel._base_manager.filter(pk=instance.channel_id).update(thread_count=F('thread_count') - 1, \
+            comment_count=F('comment_count') - comment_count, last_poster=counters.channel_last_poster(Thread))
+
+    fragments.forget('channel', instance.channel_id)
+
+#Drop a listing row's cached fragment whenever the row changes (new rows clear out
+#anything left under a reused primary key)
+@receiver(post_save, sender=Channel)
+@receiver(post_save, sender=Thread)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Channel)
+@receiver(post_delete, sender=Thread)
+@receiver(post_delete, sender=Comment)
+def forget_fragment(sender, instance, **kwargs):
+    if is_bulk_deleting():
+        return
+
+    fragments.forget_instance(instance)
+
+#Fragments show owner names, so a deleted user invalidates all of them
+@receiver(post_delete, sender=User)
+def forget_user_fragments(sender, instance, **kwargs):
+    if is_bulk_deleting():
+        return
+
+    fragments.bump(fragments.GLOBAL_SCOPE)
+    conditional.touch(conditional.GLOBAL_SCOPE)
+
+#Mark the pages showing a row as changed (the channel index shows every channel's counters)
+@receiver(post_save, sender=Channel)
+@receiver(post_save, sender=Thread)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Channel)
+@receiver(post_delete, sender=Thread)
+@receiver(post_delete, sender=Comment)
+def touch_pages(sender, instance, **kwargs):
+
+    if is_bulk_deleting():
+        return
+
+    elif sender is Channel:
+        conditional.touch(conditional.CHANNELS_SCOPE, conditional.channel_scope(instance.pk))
+
+    elif sender is Thread:
+        conditional.touch(conditional.CHANNELS_SCOPE, conditional.channel_scope(instance.channel_id), \
+                conditional.thread_scope(instance.pk))
+
+    #comments deleted along with their thread are covered by the thread
+    elif instance.thread_id not in deleting_threads():
+        conditional.touch(conditional.CHANNELS_SCOPE, conditional.channel_scope(instance.thread.channel_id), \
+                conditional.thread_scope(instance.thread_id))
+
+#Queue changed threads and comments for the search index, which is written after the
+#response has gone out
+@receiver(post_save, sender=Thread)
+@receiver(post_delete, sender=Thread)
+def queue_thread(sender, instance, **kwargs):
+    search.queue('thread', instance.pk)
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def queue_comment(sender, instance, **kwargs):
+    search.queue('comment', instance.pk)
 
-    channels = Channel.objects.filter(owner=None)
-    for chan in channels:
+@receiver(request_finished)
+def flush_search_index(sender, **kwargs):
+    search.flush()
 
-        moderators = json.loads(chan.moderators)
-        for username in moderators:
+#Forget a channel's cached owner, moderators and bans when any of them change (this
+#includes the ban and promote buttons on user pages and rows deleted along with a user)
+@receiver(post_save, sender=Channel)
+@receiver(post_delete, sender=Channel)
+def forget_channel_info(sender, instance, **kwargs):
+    channelcache.forget(instance.pk)
 
-            #user might not exist (we dont update moderator list on user deletion)
-            if User.objects.filter(username=username).exists():
+@receiver(post_save, sender=Moderator)
+@receiver(post_save, sender=Ban)
+@receiver(post_delete, sender=Moderator)
+@receiver(post_delete, sender=Ban)
+def forget_channel_members(sender, instance, **kwargs):
+    channelcache.forget(instance.channel_id)
 
-                #reassign the owner
-                chan.owner = User.objects.get(username=username)
-                chan.save()
-                break
-        else:
-            chan.delete()
+#Bans and favorites change which channels (and buttons) the index shows a user
+@receiver(post_save, sender=Ban)
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Ban)
+@receiver(post_delete, sender=Favorite)
+def touch_channel_index(sender, instance, **kwargs):
+    conditional.touch(conditional.CHANNELS_SCOPE)
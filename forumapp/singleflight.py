@@ -0,0 +1,121 @@
+import hashlib, os, tempfile, threading, time, uuid, weakref
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+# FileLock needs flock(), which Windows lacks
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+## Coalesces rebuilds of the same cached value (see pagecache.py), so when a hot page
+## expires or is invalidated only one request renders it again. The others are served
+## the stale copy if there is one, or wait a little for the new one. The lock each key
+## is rebuilt under is chosen with FORUM_SINGLE_FLIGHT_LOCK:
+##   - LocalLock coordinates the threads of one process
+##   - FileLock locks a file per key, so worker processes on one host share it
+##   - CacheLock claims the key in FORUM_SINGLE_FLIGHT_CACHE with an atomic add, for
+##     workers on several hosts sharing a cache (the database cache stands in for a
+##     lock service)
+
+DEFAULT_LOCK = 'forumapp.singleflight.LocalLock'
+
+# seconds between looks for the value while waiting on another request's rebuild
+POLL_INTERVAL = 0.05
+
+def get_lock_class():
+    return import_string(getattr(settings, 'FORUM_SINGLE_FLIGHT_LOCK', DEFAULT_LOCK))
+
+# how long to wait for another request's rebuild before doing it too
+def get_wait():
+    return getattr(settings, 'FORUM_SINGLE_FLIGHT_WAIT', 2)
+
+def lock_name(key):
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+class LocalLock(object):
+    _locks = weakref.WeakValueDictionary()
+    _mutex = threading.Lock()
+
+    def __init__(self, key):
+        with self._mutex:
+            self.lock = self._locks.setdefault(key, threading.Lock())
+
+    def acquire(self):
+        return self.lock.acquire(blocking=False)
+
+    def release(self):
+        self.lock.release()
+
+# the operating system drops the lock if its process dies mid-rebuild
+class FileLock(object):
+
+    def __init__(self, key):
+        directory = getattr(settings, 'FORUM_SINGLE_FLIGHT_DIR', os.path.join(tempfile.gettempdir(), 'forumapp-locks'))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = os.path.join(directory, lock_name(key))
+        self.file = None
+
+    def acquire(self):
+        self.file = open(self.path, 'a')
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+
+        except OSError:
+            self.file.close()
+            self.file = None
+            return False
+
+    def release(self):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        self.file = None
+
+# the claim expires after FORUM_SINGLE_FLIGHT_TIMEOUT in case its holder dies
+class CacheLock(object):
+
+    def __init__(self, key):
+        self.cache = caches[getattr(settings, 'FORUM_SINGLE_FLIGHT_CACHE', 'default')]
+        self.key = 'forumapp:lock:%s' % lock_name(key)
+        self.token = uuid.uuid4().hex
+
+    def acquire(self):
+        return self.cache.add(self.key, self.token, getattr(settings, 'FORUM_SINGLE_FLIGHT_TIMEOUT', 30))
+
+    def release(self):
+        if self.cache.get(self.key) == self.token:
+            self.cache.delete(self.key)
+
+## Return the value for key and whether it is current, calling build() for it only if
+## no other request is already
+##   - fetch() returns the value once stored, or None
+##   - build() computes the value and stores it
+##   - stale is served (as not current) instead of waiting on another request's rebuild
+def run(key, fetch, build, stale=None):
+    lock = get_lock_class()(key)
+
+    if lock.acquire():
+        try:
+            # the value may have been stored between the caller's miss and the lock
+            value = fetch()
+            return (build() if value is None else value), True
+
+        finally:
+            lock.release()
+
+    if stale is not None:
+        return stale, False
+
+    deadline = time.time() + get_wait()
+    while time.time() < deadline:
+        time.sleep(POLL_INTERVAL)
+
+        value = fetch()
+        if value is not None:
+            return value, True
+
+    # the rebuild is taking too long; don't keep the reader waiting on it
+    return build(), True
@@ -0,0 +1,72 @@
+from django import template
+from django.utils.html import format_html
+from forumapp import fragments
+
+register = template.Library()
+
+#Cache the user-independent part of a listing row:
+#   {% fragment listing %} ... {% endfragment %}
+#   {% fragment listing channel_name %} ... {% endfragment %}
+#The optional channel ties the fragment to that channel's version stamp as well.
+#Anything that depends on the viewer (forms, csrf tokens, permissions) must stay outside.
+@register.tag
+def fragment(parser, token):
+    bits = token.split_contents()
+
+    if len(bits) not in (2, 3):
+        raise template.TemplateSyntaxError("'%s' takes a row and an optional channel" % bits[0])
+
+    nodelist = parser.parse(('endfragment',))
+    parser.delete_first_token()
+
+    channel = parser.compile_filter(bits[2]) if len(bits) == 3 else None
+    return FragmentNode(nodelist, parser.compile_filter(bits[1]), channel)
+
+class FragmentNode(template.Node):
+
+    def __init__(self, nodelist, row, channel):
+        self.nodelist = nodelist
+        self.row = row
+        self.channel = channel
+
+    # look up each scope's stamp once per request rather than once per row
+    def get_versions(self, context, scopes):
+        request = context.get('request')
+        if request is None:
+            return fragments.get_versions(scopes)
+
+        resolved = request.__dict__.setdefault('_fragment_versions', {})
+        if scopes not in resolved:
+            resolved[scopes] = fragments.get_versions(scopes)
+
+        return resolved[scopes]
+
+    def render(self, context):
+        row = self.row.resolve(context)
+
+        scopes = (fragments.GLOBAL_SCOPE,)
+        if self.channel is not None:
+            scopes += (fragments.channel_scope(self.channel.resolve(context)),)
+
+        versions = self.get_versions(context, scopes)
+        content, current = fragments.get_fragment(row, versions)
+
+        if content is None:
+            content = self.nodelist.render(context)
+            fragments.set_fragment(row, current, content)
+
+        return content
+
+#Mark an element as depending on who reads a shared page (see pagecache.py):
+#   <form{% personal 'can_moderate' %}>
+#   <input{% personal 'authenticated' '!favorite' %}>
+#The page's javascript shows it to readers with every flag given ('!' for those without).
+#Elements start out the way a logged-out reader sees them. Outside shared pages this
+#renders nothing.
+@register.simple_tag(takes_context=True)
+def personal(context, *flags):
+    if not context.get('shared'):
+        return ''
+
+    hidden = ' hidden' if any(not flag.startswith('!') for flag in flags) else ''
+    return format_html(' data-personal="{}"{}', ' '.join(flags), hidden)
@@ -1,5 +1,4 @@
-import json
-from forumapp.models import Channel, UserSettings
+from forumapp.models import Channel, Favorite
 from django import template
 
 register = template.Library()
@@ -7,13 +6,12 @@ register = template.Library()
 #Cyustom filter for Channels to make sure the current user isn't banned
 @register.filter
 def minus_bans(channel_list, username):
-    channels = [c.channel_name for c in channel_list if str(username) not in json.loads(c.banned_users)]
-    return Channel.objects.filter(channel_name__in=channels)
+    return channel_list.exclude(ban__user=str(username))
 
+# favorites is either the set of names a view already looked up or a user
 @register.filter
-def is_favorite(channel_name, user):
-    u = UserSettings.objects.filter(user=user)
-    if u.exists():
-        favs = u.get().favorites
-        return str(channel_name) in json.loads(favs)
-    return False
+def is_favorite(channel_name, favorites):
+    if isinstance(favorites, (set, frozenset)):
+        return str(channel_name) in favorites
+
+    return Favorite.objects.filter(settings_id=favorites.pk, channel_id=str(channel_name)).exists()
@@ -1,7 +1,7 @@
 import json, datetime
 from django import template
 from django.utils import timezone
-from forumapp.models import Channel, Thread, Comment
+from forumapp.access import get_access
 
 register = template.Library()
 
@@ -35,35 +35,15 @@ def format_date(date):
 
 #Create filter for comments to see if they are owned by the user passed in
 @register.filter
-def is_owned_by(kwargs, username):
-    channel_name = kwargs['channel']
-    thread_id = kwargs['thread']
-
-    thread = Thread.objects.filter(channel__channel_name=channel_name, thread_id=thread_id)
-    if thread.exists():
-        return thread.get().owner == user
-    else:
-        return ''
+def is_owned_by(access, user):
+    thread = get_access(access).thread
+    return thread is not None and thread.owner_id == user.get_username()
 
 @register.filter
-def get_thread_name(kwargs):
-    channel_name = kwargs['channel']
-    thread_id = kwargs['thread']
-
-    thread = Thread.objects.filter(channel__channel_name=channel_name, thread_id=thread_id)
-    if thread.exists():
-        return thread.get().thread_name
-    else:
-        return ''
+def get_thread_name(access):
+    return get_access(access).thread_name
 
 #Custom filter for comments to return the thread they belong to's description
 @register.filter
-def description(kwargs):
-    channel_name = kwargs['channel']
-    thread_id = kwargs['thread']
-
-    thread = Thread.objects.filter(channel__channel_name=channel_name, thread_id=thread_id)
-    if thread.exists():
-        return thread.get().description
-    else:
-        return ''
+def description(access):
+    return get_access(access).thread_description
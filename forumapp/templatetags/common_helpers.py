@@ -1,41 +1,18 @@
-import json
 from django import template
-from forumapp.models import Channel, Thread, Comment
+from forumapp.access import get_access
 
 register = template.Library()
 
 #Create filter for threads to see if they are owned by the user passed in
 @register.filter
-def is_owner(kwargs, user):
-    channel = Channel.objects.filter(channel_name=kwargs.get('channel'))
-
-    if channel.exists():
-        return channel.get().owner == user
-
-    return False
+def is_owner(access, user):
+    return get_access(access).is_owner(user)
 
 @register.filter
-def is_moderator(kwargs, user):
-    channel = Channel.objects.filter(channel_name=kwargs.get('channel'))
-
-    if channel.exists():
-        channel = channel.get()
-
-        if user == channel.owner:
-            return True
-        else:
-            return user.get_username() in json.loads(channel.moderators)
-
-    return False
+def is_moderator(access, user):
+    return get_access(access).is_moderator(user)
 
 @register.filter
-def is_banned_from(user, channel_name):
-    channel = Channel.objects.filter(channel_name=channel_name)
-
+def is_banned_from(user, access):
     # see if user is in list of banned users
-    if channel.exists():
-        channel = channel.get()
-        return user.get_username() in json.loads(channel.banned_users)
-
-    else:
-        return False
+    return get_access(access).is_banned(user)
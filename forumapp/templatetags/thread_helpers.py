@@ -1,15 +1,9 @@
-import json
 from django import template
-from forumapp.models import Channel, Thread, Comment
+from forumapp.access import get_access
 
 register = template.Library()
 
 #Custom filter for threads to return the channel they belong to's description
 @register.filter
-def description(channel_name):
-    channel = Channel.objects.filter(channel_name=channel_name)
-
-    if channel.exists():
-        return channel.get().description
-    else:
-        return ''
+def description(access):
+    return get_access(access).description
@@ -0,0 +1,56 @@
+import os, shutil, tempfile
+from unittest import TextTestResult
+from django.conf import settings
+from django.core.cache import caches
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+from . import channelcache
+
+## Starts every test with empty caches, as on a fresh deployment, so pages and stamps
+## cached for one test's rolled back rows can't be served to the next
+class CacheClearingResult(object):
+
+    def startTest(self, test):
+        for cache in caches.all():
+            cache.clear()
+
+        channelcache.cache.clear()
+
+        super(CacheClearingResult, self).startTest(test)
+
+## Runs the tests with the query budgets enforced, so a view that goes over its
+## FORUM_QUERY_BUDGETS entry fails whichever test requested it
+class ForumTestRunner(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super(ForumTestRunner, self).setup_test_environment(**kwargs)
+
+        # file based caches and lock files move into a directory of the run's own, so
+        # clearing them between tests can't wipe what a dev server on this host keeps
+        self.files = tempfile.mkdtemp(prefix='forumapp-tests-')
+
+        self.overrides = override_settings(CACHES=self.private_caches(), \
+                FORUM_SINGLE_FLIGHT_DIR=os.path.join(self.files, 'locks'), \
+                FORUM_QUERY_BUDGETS_STRICT=True, FORUM_INSTRUMENTATION=True)
+        self.overrides.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.overrides.disable()
+        shutil.rmtree(self.files, ignore_errors=True)
+
+        super(ForumTestRunner, self).teardown_test_environment(**kwargs)
+
+    def private_caches(self):
+        aliases = {}
+
+        for alias, options in settings.CACHES.items():
+            if options['BACKEND'].endswith('FileBasedCache'):
+                options = dict(options, LOCATION=os.path.join(self.files, alias))
+
+            aliases[alias] = options
+
+        return aliases
+
+    def get_resultclass(self):
+        result_class = super(ForumTestRunner, self).get_resultclass() or TextTestResult
+        return type('ForumTestResult', (CacheClearingResult, result_class), {})
@@ -1,6 +1,15 @@
-import datetime, json
+import asyncio, datetime, json, os, re, tempfile, threading, time
 from contextlib import contextmanager
-from django.test import TestCase, Client
+from django.conf import settings as django_settings
+from django.db import connection, transaction
+from django.core.cache import caches
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock, skipUnless
 from django.core.exceptions import ValidationError
 
 from django.utils import timezone
@@ -8,7 +17,11 @@ from django.urls import reverse
 
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from .models import Channel, Thread, Comment, UserSettings
+from .models import Channel, Thread, Comment, UserSettings, Moderator, Ban, Favorite
+from .pagination import KeysetPaginator, CHANNEL_KEYS, THREAD_KEYS, COMMENT_KEYS
+from .services import post_comment
+from . import search, live, moderation, instrumentation, counters, loadtest, projections, pagecache, singleflight, \
+        channelcache, views, conditional, checks
 
 #Allow easy testing for validation errors
 class ValidationErrorTestMixin(object):
@@ -21,6 +34,21 @@ class ValidationErrorTestMixin(object):
         except ValidationError as e:
             self.assertEqual(set(fields), set(e.message_dict.keys()))
 
+## Return the statements from captured queries that write to forum tables (leaving
+## out the search index, which search.py maintains separately)
+def forum_writes(queries):
+    return [q['sql'] for q in queries.captured_queries \
+            if q['sql'].split(' ', 1)[0] in ('INSERT', 'UPDATE', 'DELETE') and 'forumapp_' in q['sql'] \
+            and 'forumapp_search' not in q['sql']]
+
+## Return SQLite's query plan for a queryset as one string
+def query_plan(queryset):
+    sql, params = queryset.query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return ' '.join(str(row) for row in cursor.fetchall())
+
 ## Helper functions
 def create_channel(name, owner, desc="testdesc", days=0):
     time = timezone.now() + datetime.timedelta(days=days)
@@ -107,8 +135,7 @@ class ChannelTests(ValidationErrorTestMixin, TestCase):
         subthread = create_thread(channel, owner)
 
         # set moderator
-        channel.moderators = json.dumps([otheruser.username])
-        channel.save()
+        Moderator.objects.create(channel=channel, user=otheruser)
 
         #delete channel and see if the owner was changed to to the otheruser
         owner.delete()
@@ -130,6 +157,132 @@ class ChannelTests(ValidationErrorTestMixin, TestCase):
         with self.assertValidationErrors(['channel_name']):
             c4.validate_unique()
 
+    # Channels can't take the names of the forum's own pages, which would hide them
+    def testReservedChannelName(self):
+        self.client.force_login(User.objects.create(username=self.username))
+
+        response = self.client.post(reverse('forumapp:channel'), {'create': '', 'channel_name': 'Search', \
+                'description': self.channel_desc}, follow=True)
+        self.assertContains(response, "That channel name is reserved.")
+        self.assertFalse(Channel.objects.exists())
+        self.assertEqual(reverse('forumapp:search'), reverse('forumapp:thread', kwargs={'channel': 'search'}))
+
+    # The index hides banned channels in the same query that orders and pages them
+    @override_settings(FORUM_PAGE_SIZE=2)
+    def testChannelIndexMinusBans(self):
+        owner = User.objects.create(username=self.username)
+        user = User.objects.create(username=self.username2)
+        names = ['channel-%d' % i for i in range(4)]
+        channels = [create_channel(name, owner) for name in names]
+
+        channels[0].pin_date = timezone.now()
+        channels[0].save()
+        Ban.objects.create(channel=channels[2], user=user)
+
+        self.client.force_login(user)
+        url = reverse('forumapp:channel')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        channel_queries = [q for q in queries.captured_queries if 'FROM "forumapp_channel"' in q['sql']]
+        self.assertEqual(1, len(channel_queries))
+        self.assertEqual([names[0], names[3]], [c.channel_name for c in response.context['channel_list']])
+
+        response = self.client.get(url, {'after': response.context['page'].next_token})
+        self.assertEqual([names[1]], [c.channel_name for c in response.context['channel_list']])
+
+    # The channel index is read in index order, forwards and backwards
+    @skipUnless(connection.vendor == 'sqlite', "checks SQLite's query plan")
+    def testChannelListingUsesIndex(self):
+        paginator = KeysetPaginator(Channel.objects.all(), CHANNEL_KEYS)
+
+        for reverse in (False, True):
+            plan = query_plan(paginator.segments(None, reverse)[0])
+            self.assertIn('forumapp_channel_nulls_idx', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    # Favorite buttons for the whole index come from a single favorites query
+    def testChannelIndexFavoritesResolvedOnce(self):
+        user = User.objects.create(username=self.username)
+        settings = UserSettings.objects.create(user=user)
+        channels = [create_channel('channel-%d' % i, user) for i in range(5)]
+
+        for channel in channels[:2]:
+            Favorite.objects.create(settings=settings, channel=channel)
+
+        self.client.force_login(user)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('forumapp:channel'))
+
+        favorite_queries = [q for q in queries.captured_queries if 'forumapp_favorite' in q['sql']]
+        self.assertEqual(1, len(favorite_queries))
+        self.assertContains(response, 'name="remove_favorite"', count=2)
+        self.assertContains(response, 'name="add_favorite"', count=3)
+
+        response = self.client.get(reverse('forumapp:favorites'))
+        self.assertContains(response, 'name="remove_favorite"', count=2)
+        self.assertNotContains(response, 'name="add_favorite"')
+
+    # Channel metadata is kept between requests until something about the channel changes
+    def testChannelCache(self):
+        owner = User.objects.create(username=self.username)
+        user = User.objects.create(username=self.username2)
+        channel = create_channel(self.channel_name, owner, self.channel_desc)
+        channelcache.cache.reset_stats()
+
+        self.assertEqual((self.username, self.channel_desc), \
+                (channelcache.get(self.channel_name).owner_name, channelcache.get(self.channel_name).description))
+        with self.assertNumQueries(0):
+            channelcache.get(self.channel_name)
+        self.assertEqual((2, 1), (channelcache.cache.stats()['hits'], channelcache.cache.stats()['misses']))
+
+        # the buttons on user pages change it
+        url = reverse('forumapp:user', kwargs={'username': user.username})
+        self.client.force_login(owner)
+        self.client.post(url, {'promote_mod': '', 'channel_name': self.channel_name})
+        self.assertEqual(frozenset([self.username2]), channelcache.get(self.channel_name).moderators)
+
+        self.client.post(url, {'channel_ban': '', 'channel_name': self.channel_name})
+        info = channelcache.get(self.channel_name)
+        self.assertEqual((frozenset(), frozenset([self.username2])), (info.moderators, info.banned_users))
+
+        channel.description = self.channel_desc[::-1]
+        channel.save()
+        self.assertEqual(self.channel_desc[::-1], channelcache.get(self.channel_name).description)
+
+        # changes made through other processes show once the entry is old enough, but
+        # permission checks that authorize changes don't wait for them
+        Channel.objects.filter(pk=self.channel_name).update(owner=user)
+        self.assertEqual(self.username, channelcache.get(self.channel_name).owner_name)
+        self.assertTrue(views.is_owner(Channel.objects.get(pk=self.channel_name), user))
+        Channel.objects.filter(pk=self.channel_name).update(owner=owner, description=self.channel_desc)
+
+        with override_settings(FORUM_CHANNEL_CACHE_LOCAL_TIMEOUT=0):
+            self.assertEqual(self.channel_desc, channelcache.get(self.channel_name).description)
+
+        # a deleted owner's channel goes to its moderator
+        Moderator.objects.create(channel=channel, user=User.objects.create(username=self.username[::-1]))
+        owner.delete()
+        self.assertEqual(self.username[::-1], channelcache.get(self.channel_name).owner_name)
+
+        # the least recently used channel makes room
+        create_channel(self.channel_name2, user)
+        with override_settings(FORUM_CHANNEL_CACHE_SIZE=1):
+            channelcache.get(self.channel_name2)
+        self.assertEqual((1, 1), (channelcache.cache.stats()['size'], channelcache.cache.stats()['evictions']))
+
+        # other processes fill the shared cache too
+        with override_settings(FORUM_CHANNEL_CACHE='default'):
+            channelcache.get(self.channel_name)
+            channelcache.cache.clear()
+
+            with self.assertNumQueries(0):
+                self.assertEqual(self.username[::-1], channelcache.get(self.channel_name).owner_name)
+
+        self.assertIsNone(channelcache.get('missing'))
+
     def testAdminRemoveChannel(self):
         pass
 
@@ -228,6 +381,170 @@ class ThreadTests(ValidationErrorTestMixin, TestCase):
         self.assertContains(response, self.thread_name)
         self.assertContains(response, self.thread_name[::-1])
 
+    # Requests are measured per view, reported to staff and held to their query budget
+    @override_settings(DEBUG=True)
+    def testInstrumentation(self):
+        owner = User.objects.create(username=self.username, is_staff=True)
+        channel = create_channel(self.channel_name, owner)
+        create_thread(channel, owner)
+        url = reverse('forumapp:thread', kwargs={'channel': self.channel_name})
+        instrumentation.table.reset()
+
+        self.client.get(url)
+        response = self.client.get(url)
+
+        self.assertEqual('forumapp:thread', response['X-Forum-View'])
+        self.assertGreater(int(response['X-Forum-Queries']), 0)
+        self.assertEqual('1 hit(s), 0 miss(es)', response['X-Forum-Cache'])
+        self.assertIn('render;dur=', response['Server-Timing'])
+
+        # only staff see the totals
+        self.assertEqual(404, self.client.get(reverse('forumapp:stats')).status_code)
+        self.client.force_login(owner)
+        stats = json.loads(self.client.get(reverse('forumapp:stats')).content.decode('utf-8'))
+
+        # the first request missed the page and fragment caches, the second hit the page
+        self.assertEqual(2, stats['forumapp:thread']['requests'])
+        self.assertEqual((1, 2), (stats['forumapp:thread']['cache_hits'], stats['forumapp:thread']['cache_misses']))
+
+        with override_settings(FORUM_QUERY_BUDGETS={'forumapp:thread': 1}), self.assertLogs('django.request'):
+            with self.assertRaises(instrumentation.QueryBudgetExceeded):
+                self.client.get(url)
+
+    # Change stamps kept in one process's memory are reported, since other workers can't see them
+    def testChangeCacheCheck(self):
+        self.assertEqual([], checks.check_change_cache(None))
+
+        with override_settings(FORUM_CHANGE_CACHE='default'):
+            self.assertEqual(['forumapp.E001'], [error.id for error in checks.check_change_cache(None)])
+
+        # pages changed through another process aren't answered with 304
+        owner = User.objects.create(username=self.username)
+        create_thread(create_channel(self.channel_name, owner), owner)
+        url = reverse('forumapp:thread', kwargs={'channel': self.channel_name})
+        etag = self.client.get(url)['ETag']
+
+        caches['shared'].set(conditional.stamp_key(conditional.channel_scope(self.channel_name)), time.time() + 1, None)
+        self.assertEqual(200, self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code)
+
+    # The test run keeps its file based cache apart from the one a dev server on this host
+    # uses, since every test clears it
+    def testPrivateSharedCache(self):
+        host = os.path.join(tempfile.gettempdir(), 'django-forum-cache')
+        self.assertNotEqual(os.path.abspath(host), os.path.abspath(caches['shared']._dir))
+
+    # Unchanged thread pages are answered with 304 until the user's standing changes
+    def testThreadConditionalGet(self):
+        owner = User.objects.create(username=self.username)
+        user = User.objects.create(username=self.username2)
+        c = create_channel(self.channel_name, owner)
+        create_thread(c, owner, self.thread_name, self.thread_desc)
+        url = reverse('forumapp:thread', kwargs={'channel': self.channel_name})
+        self.client.force_login(user)
+
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(304, response.status_code)
+        self.assertFalse([q for q in queries.captured_queries if 'FROM "forumapp_thread"' in q['sql']])
+
+        self.assertEqual(304, self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code)
+
+        Ban.objects.create(channel=c, user=user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "Sorry, this channel is unavailable.")
+
+        # other users get their own validators
+        self.client.force_login(owner)
+        self.assertEqual(200, self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code)
+
+    # Cached thread rows are re-rendered as soon as the thread changes
+    def testThreadFragmentInvalidated(self):
+        owner = User.objects.create(username=self.username)
+        c = create_channel(self.channel_name, owner)
+        t = create_thread(c, owner, self.thread_name, self.thread_desc)
+        url = reverse('forumapp:thread', kwargs={'channel': self.channel_name})
+
+        self.assertContains(self.client.get(url), self.thread_desc)
+
+        t.description = self.thread_desc[::-1]
+        t.save()
+        self.assertContains(self.client.get(url), self.thread_desc[::-1])
+
+        # counters change through UPDATEs, which the delete path invalidates itself
+        Thread.objects.filter(pk=t.pk).update(comment_count=1)
+        create_comment(t, owner).delete()
+        self.assertContains(self.client.get(url), "0 comments")
+
+    # Logged-out readers share one cached page per version, with their own csrf token
+    def testSharedPages(self):
+        owner = User.objects.create(username=self.username)
+        moderator = User.objects.create(username=self.username2)
+        c = create_channel(self.channel_name, owner)
+        Moderator.objects.create(channel=c, user=moderator)
+        create_thread(c, owner, self.thread_name, self.thread_desc)
+        url = reverse('forumapp:thread', kwargs={'channel': self.channel_name})
+
+        response = self.client.get(url)
+        self.assertContains(response, 'data-personal="can_moderate" hidden')
+        self.assertContains(response, 'data-personal-url=""')
+        self.assertContains(response, "name='csrfmiddlewaretoken'")
+        self.assertNotContains(response, pagecache.CSRF_PLACEHOLDER)
+
+        # the listing isn't queried again until something under the page changes
+        with CaptureQueriesContext(connection) as queries:
+            self.assertContains(Client().get(url), self.thread_name)
+        self.assertFalse([q for q in queries.captured_queries if 'FROM "forumapp_thread"' in q['sql']])
+
+        create_thread(c, owner, self.thread_name[::-1], self.thread_desc)
+        self.assertContains(self.client.get(url), self.thread_name[::-1])
+
+        # logged-in readers get their own page unless they share too
+        self.client.force_login(moderator)
+        self.assertNotContains(self.client.get(url), 'data-personal')
+
+        with override_settings(FORUM_PAGE_CACHE_USERS=True):
+            response = self.client.get(url)
+            self.assertContains(response, 'data-personal="can_moderate" hidden')
+            self.assertContains(response, 'data-personal-url="%s?channel=%s"' % (reverse('forumapp:reader'), self.channel_name))
+
+        reader = json.loads(self.client.get(reverse('forumapp:reader'), {'channel': self.channel_name}).content.decode('utf-8'))
+        self.assertEqual((True, self.username2, True, False, []), \
+                (reader['authenticated'], reader['username'], reader['can_moderate'], reader['can_manage'], reader['banned']))
+
+        Ban.objects.create(channel=c, user=owner)
+        self.client.force_login(owner)
+        reader = json.loads(self.client.get(reverse('forumapp:reader'), {'channel': self.channel_name}).content.decode('utf-8'))
+        self.assertEqual((True, True, [self.channel_name]), (reader['can_moderate'], reader['can_manage'], reader['banned']))
+
+    ## Test whether readers are served the outdated page while another request renders it
+    def testStalePagesDuringRebuild(self):
+        owner = User.objects.create(username=self.username)
+        c = create_channel(self.channel_name, owner)
+        create_thread(c, owner, self.thread_name, self.thread_desc)
+        url = reverse('forumapp:thread', kwargs={'channel': self.channel_name})
+        self.client.get(url)
+
+        create_thread(c, owner, self.thread_name[::-1], self.thread_desc)
+        lock = singleflight.get_lock_class()(pagecache.page_key(url))
+        self.assertTrue(lock.acquire())
+
+        try:
+            response = self.client.get(url)
+            self.assertNotContains(response, self.thread_name[::-1])
+            self.assertFalse(response.has_header('ETag'))
+
+        finally:
+            lock.release()
+
+        response = self.client.get(url)
+        self.assertContains(response, self.thread_name[::-1])
+        self.assertTrue(response.has_header('ETag'))
+
     ## Test whether deleting a thread preserves its channel and deletes its comments
     def testThreadDelete(self):
         owner = User.objects.create(username=self.username)
@@ -268,6 +585,189 @@ class ThreadTests(ValidationErrorTestMixin, TestCase):
         with self.assertValidationErrors(['channel', 'thread_id']):
             t5.validate_unique()
 
+    # Ids come from the channel's counter, so deleted ids are never handed out again
+    def testThreadIdsNotReused(self):
+        owner = User.objects.create(username=self.username)
+        c = create_channel(self.channel_name, owner)
+        t1 = create_thread(c, owner)
+        t2 = create_thread(c, owner)
+        t2.delete()
+
+        t3 = create_thread(c, owner)
+
+        self.assertEqual([0, 2], [t1.thread_id, t3.thread_id])
+        self.assertEqual(3, Channel.objects.get(channel_name=self.channel_name).next_thread_id)
+
+        # saving an existing thread keeps its id
+        t3.thread_name = self.thread_name
+        t3.save()
+        self.assertEqual(2, Thread.objects.get(pk=t3.pk).thread_id)
+
+    # Posting validates first and never leaves placeholder threads behind
+    def testPostThread(self):
+        password = "P@ssw0rd1"
+        user = User.objects.create_user(username=self.username, password=password)
+        c = create_channel(self.channel_name, user, days=-1)
+        Channel.objects.filter(pk=c.pk).update(recent_date=c.pub_date)
+        url = reverse('forumapp:thread', kwargs={'channel': self.channel_name})
+        self.client.login(username=self.username, password=password)
+
+        response = self.client.post(url, {'create': '', 'thread_name': 'short', 'description': self.thread_desc}, follow=True)
+        self.assertContains(response, "Thread name must be at least 6 characters.")
+        self.assertFalse(Thread.objects.exists())
+        self.assertEqual(0, Channel.objects.get(pk=c.pk).next_thread_id)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'create': '', 'thread_name': self.thread_name, 'description': self.thread_desc})
+
+        writes = forum_writes(queries)
+        thread = Thread.objects.get(channel=c)
+        self.assertRedirects(response, reverse('forumapp:comment', kwargs={'channel': self.channel_name, 'thread': thread.thread_id}))
+        self.assertEqual(thread.recent_date, Channel.objects.get(pk=c.pk).recent_date)
+
+        # one UPDATE on the channel and one INSERT
+        self.assertEqual(2, len(writes))
+
+    # Posting and deleting threads keeps the channel's counters in step
+    def testThreadCounters(self):
+        password = "P@ssw0rd1"
+        user = User.objects.create_user(username=self.username, password=password)
+        c = create_channel(self.channel_name, user)
+        url = reverse('forumapp:thread', kwargs={'channel': self.channel_name})
+        self.client.login(username=self.username, password=password)
+
+        self.client.post(url, {'create': '', 'thread_name': self.thread_name, 'description': self.thread_desc})
+        self.client.post(url, {'create': '', 'thread_name': self.thread_name, 'description': self.thread_desc})
+
+        c = Channel.objects.get(pk=c.pk)
+        self.assertEqual(2, c.thread_count)
+        self.assertEqual(self.username, c.last_poster_id)
+        self.assertContains(self.client.get(reverse('forumapp:channel')), "2 threads / 0 comments")
+
+        thread = Thread.objects.filter(channel=c).first()
+        create_comment(thread, user)
+        Thread.objects.filter(pk=thread.pk).update(comment_count=1)
+        Channel.objects.filter(pk=c.pk).update(comment_count=1)
+
+        # the comment goes with its thread in the same single channel update
+        self.client.post(url, {'delete_thread': '', 'thread_id': thread.thread_id})
+
+        c = Channel.objects.get(pk=c.pk)
+        self.assertEqual((1, 0), (c.thread_count, c.comment_count))
+
+        # comments posted after the thread was loaded are taken off too
+        thread = Thread.objects.get(channel=c)
+        post_comment(Comment(thread=Thread.objects.get(pk=thread.pk), owner=user, text=self.thread_desc))
+        thread.delete()
+
+        c = Channel.objects.get(pk=c.pk)
+        self.assertEqual((0, 0), (c.thread_count, c.comment_count))
+
+    # Thread pages are read in index order, and pages past a cursor seek to it rather than
+    # reading the listing from its top, in either direction and either partition
+    @skipUnless(connection.vendor == 'sqlite', "checks SQLite's query plan")
+    def testThreadListingUsesIndex(self):
+        paginator = KeysetPaginator(Thread.objects.filter(channel__channel_name=self.channel_name), THREAD_KEYS)
+        now = timezone.now()
+
+        # the reversed listing walks the same index backwards
+        for reverse in (False, True):
+            plan = query_plan(paginator.segments(None, reverse)[0])
+            self.assertIn('forumapp_thread_nulls_idx', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+        for cursor, bound in (([None, now, 3], r'recent_date[<>]'), ([now, now, 3], r'pin_date[<>]')):
+            for reverse in (False, True):
+                segments = paginator.segments(cursor, reverse)
+                self.assertRegex(query_plan(segments[0]), bound)
+
+                for queryset in segments:
+                    self.assertNotIn('TEMP B-TREE', query_plan(queryset))
+
+    # A change made through another worker retires this worker's cached rows, even one
+    # that leaves the row's date alone
+    def testFragmentsForgottenAcrossWorkers(self):
+        owner = User.objects.create(username=self.username)
+        c = create_channel(self.channel_name, owner)
+        comment = Comment(thread=create_thread(c, owner), owner=owner, text='text')
+        post_comment(comment)
+        url = reverse('forumapp:thread', kwargs={'channel': self.channel_name})
+
+        self.assertContains(self.client.get(url), '1 comment')
+
+        # the other worker keeps its rows in a local cache of its own
+        worker = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'worker'}
+        with override_settings(CACHES=dict(django_settings.CACHES, worker=worker), FORUM_FRAGMENT_CACHE='worker'):
+            comment.delete()
+
+        self.assertContains(self.client.get(url), '0 comments')
+
+    # Listings fetch their rows with the owners in one query, however many owners there are
+    def testThreadListingJoinsOwners(self):
+        owner = User.objects.create(username=self.username)
+        c = create_channel(self.channel_name, owner)
+        url = reverse('forumapp:thread', kwargs={'channel': self.channel_name})
+        counts = []
+
+        for i in range(2):
+            for j in range(3):
+                create_thread(c, User.objects.create(username='poster%d-%d' % (i, j)))
+
+            caches['default'].clear()
+            channelcache.cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(200, self.client.get(url).status_code)
+
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+        with self.assertNumQueries(1):
+            rows = list(projections.listing(Thread.objects.filter(channel=c)))
+            self.assertEqual(6, len(set(row.owner.username for row in rows)))
+
+        self.assertEqual({'pub_date', 'next_comment_id'}, rows[0].get_deferred_fields())
+
+    # Page through threads with the next/previous tokens
+    @override_settings(FORUM_PAGE_SIZE=2)
+    def testThreadPagination(self):
+        owner = User.objects.create(username=self.username)
+        c = create_channel(self.channel_name, owner)
+        threads = [create_thread(c, owner, self.thread_name + str(i)) for i in range(5)]
+
+        # pin the first thread so it comes before the more recent ones
+        threads[4].pin_date = timezone.now()
+        threads[4].save()
+
+        url = reverse('forumapp:thread', kwargs={'channel': self.channel_name})
+        seen = []
+
+        response = self.client.get(url)
+        page = response.context['page']
+        self.assertFalse(page.has_previous)
+        seen += [t.thread_id for t in response.context['thread_list']]
+
+        while page.has_next:
+            response = self.client.get(url, {'after': page.next_token})
+            self.assertEqual(response.status_code, 200)
+            page = response.context['page']
+            seen += [t.thread_id for t in response.context['thread_list']]
+
+        self.assertEqual([4, 3, 2, 1, 0], seen)
+
+        # walk back to the first page
+        response = self.client.get(url, {'before': page.previous_token})
+        self.assertEqual([2, 1], [t.thread_id for t in response.context['thread_list']])
+        self.assertTrue(response.context['page'].has_previous)
+
+        response = self.client.get(url, {'before': response.context['page'].previous_token})
+        self.assertEqual([4, 3], [t.thread_id for t in response.context['thread_list']])
+        self.assertFalse(response.context['page'].has_previous)
+
+        # garbage tokens fall back to the first page
+        response = self.client.get(url, {'after': 'not-a-token'})
+        self.assertEqual([4, 3], [t.thread_id for t in response.context['thread_list']])
+
     def testAdminRemoveThread(self):
         pass
 
@@ -428,6 +928,360 @@ class CommentTests(ValidationErrorTestMixin, TestCase):
         with self.assertValidationErrors(['thread', 'comment_id']):
             co7.validate_unique()
 
+    # Posting a comment inserts once and bumps recent_date on its parents
+    def testPostComment(self):
+        password = "P@ssw0rd1"
+        user = User.objects.create_user(username=self.username, password=password)
+        channel = create_channel(self.channel_name, user)
+        thread = create_thread(channel, user)
+        url = reverse('forumapp:comment', kwargs={'channel': self.channel_name, 'thread': thread.thread_id})
+        self.client.login(username=self.username, password=password)
+
+        response = self.client.post(url, {'create': '', 'text': 'short'}, follow=True)
+        self.assertContains(response, "Comments must be at least 6 characters.")
+        self.assertFalse(Comment.objects.exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'create': '', 'text': self.text})
+
+        writes = forum_writes(queries)
+        self.assertRedirects(response, url)
+        comment = Comment.objects.get(thread=thread)
+        self.assertEqual(self.text, comment.text)
+        self.assertEqual(0, comment.comment_id)
+        self.assertEqual(comment.pub_date, Thread.objects.get(pk=thread.pk).recent_date)
+        self.assertEqual(comment.pub_date, Channel.objects.get(pk=channel.pk).recent_date)
+
+        # thread UPDATE (id counter, counters and recent_date), comment INSERT, channel UPDATE
+        self.assertEqual(3, len(writes))
+
+    # Posting and deleting comments keeps the thread's and channel's counters in step
+    def testCommentCounters(self):
+        password = "P@ssw0rd1"
+        user = User.objects.create_user(username=self.username, password=password)
+        User.objects.create_user(username=self.username2, password=password)
+        channel = create_channel(self.channel_name, user)
+        thread = create_thread(channel, user)
+        url = reverse('forumapp:comment', kwargs={'channel': self.channel_name, 'thread': thread.thread_id})
+
+        self.client.login(username=self.username, password=password)
+        self.client.post(url, {'create': '', 'text': self.text})
+        self.client.login(username=self.username2, password=password)
+        self.client.post(url, {'create': '', 'text': self.text})
+
+        thread = Thread.objects.get(pk=thread.pk)
+        channel = Channel.objects.get(pk=channel.pk)
+        self.assertEqual((2, self.username2), (thread.comment_count, thread.last_poster_id))
+        self.assertEqual((2, self.username2), (channel.comment_count, channel.last_poster_id))
+
+        # deleting the newest comment hands the last activity back to the one before it
+        self.client.login(username=self.username, password=password)
+        self.client.post(url, {'delete_comment': '', 'comment_id': 1})
+
+        thread = Thread.objects.get(pk=thread.pk)
+        channel = Channel.objects.get(pk=channel.pk)
+        self.assertEqual((1, self.username), (thread.comment_count, thread.last_poster_id))
+        self.assertEqual((1, self.username), (channel.comment_count, channel.last_poster_id))
+
+    # The reconcile command rebuilds counters that drifted from the rows
+    def testReconcileCounters(self):
+        user = User.objects.create(username=self.username)
+        other = User.objects.create(username=self.username2)
+        channel = create_channel(self.channel_name, user)
+        t1 = create_thread(channel, user)
+        t2 = create_thread(channel, other)
+        create_comment(t1, user)
+        create_comment(t1, other, days=1)
+        Thread.objects.filter(pk=t1.pk).update(recent_date=timezone.now() + datetime.timedelta(days=1))
+
+        out = StringIO()
+        call_command('reconcile_counters', '--check', stdout=out)
+        # t2 never recorded its author as its last poster
+        self.assertIn("2 thread(s) and 1 channel(s) have drifted.", out.getvalue())
+        self.assertEqual(0, Channel.objects.get(pk=channel.pk).thread_count)
+
+        call_command('reconcile_counters', stdout=StringIO())
+
+        channel = Channel.objects.get(pk=channel.pk)
+        self.assertEqual((2, 2, self.username2), (channel.thread_count, channel.comment_count, channel.last_poster_id))
+        self.assertEqual((2, self.username2), (Thread.objects.get(pk=t1.pk).comment_count, Thread.objects.get(pk=t1.pk).last_poster_id))
+        self.assertEqual((0, self.username2), (Thread.objects.get(pk=t2.pk).comment_count, Thread.objects.get(pk=t2.pk).last_poster_id))
+
+        out = StringIO()
+        call_command('reconcile_counters', '--check', stdout=out)
+        self.assertIn("0 thread(s) and 0 channel(s) have drifted.", out.getvalue())
+
+        # a wrong last poster alone is drift too (t2 isn't the channel's newest thread)
+        Thread.objects.filter(pk=t2.pk).update(last_poster=user)
+        out = StringIO()
+        call_command('reconcile_counters', '--check', stdout=out)
+        self.assertIn("1 thread(s) and 0 channel(s) have drifted.", out.getvalue())
+
+    # Moderators purge what a user posted in their channel in one request
+    def testBulkModeration(self):
+        owner = User.objects.create(username=self.username)
+        spammer = User.objects.create(username=self.username2)
+        channel = create_channel(self.channel_name, owner)
+        other_channel = create_channel(self.channel_name2, spammer)
+        thread = create_thread(channel, owner)
+        spam_thread = create_thread(channel, spammer)
+        kept = create_comment(thread, spammer, days=-1)
+        create_comment(spam_thread, owner)
+        create_comment(create_thread(other_channel, spammer), spammer)
+
+        for i in range(10):
+            create_comment(thread, spammer)
+
+        # the helpers skip the counters, so start from accurate ones
+        call_command('reconcile_counters', stdout=StringIO())
+        url = reverse('forumapp:moderate')
+        self.client.force_login(owner)
+
+        # counters are recounted once per delete instead of updated per row
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'action': 'purge', 'channel': self.channel_name, \
+                    'user': self.username2, 'hours': 1})
+
+        updates = [sql for sql in forum_writes(queries) if sql.startswith('UPDATE')]
+        self.assertEqual({'threads': 1, 'comments': 11, 'bans': 1}, json.loads(response.content.decode('utf-8')))
+        self.assertEqual(3, len(updates))
+
+        # older posts and other channels are left alone
+        self.assertEqual([kept.pk], list(Comment.objects.filter(thread__channel=channel).values_list('pk', flat=True)))
+        self.assertEqual(1, Comment.objects.filter(thread__channel=other_channel).count())
+        self.assertTrue(Ban.objects.filter(channel=channel, user=spammer).exists())
+
+        channel = Channel.objects.get(pk=channel.pk)
+        self.assertEqual((1, 1), (channel.thread_count, channel.comment_count))
+        self.assertEqual(1, Thread.objects.get(pk=thread.pk).comment_count)
+
+        out = StringIO()
+        call_command('reconcile_counters', '--check', stdout=out)
+        self.assertIn("0 thread(s) and 0 channel(s) have drifted.", out.getvalue())
+
+        # a filter is required, and moderators can't reach other channels
+        response = self.client.post(url, {'action': 'delete_comments', 'channel': self.channel_name})
+        self.assertEqual(400, response.status_code)
+
+        # purges and bans name the user they act on
+        response = self.client.post(url, {'action': 'purge', 'channel': self.channel_name, 'threads': str(thread.thread_id)})
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(["Choose a user to purge."], json.loads(response.content.decode('utf-8'))['errors']['__all__'])
+
+        # only existing users can be banned
+        response = self.client.post(url, {'action': 'ban', 'channel': self.channel_name, 'user': 'ghost'})
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(0, moderation.ban_users([(self.channel_name, 'ghost')]))
+        self.assertFalse(Ban.objects.filter(user_id='ghost').exists())
+
+        response = self.client.post(url, {'action': 'delete_comments', 'channel': self.channel_name2, 'user': self.username2})
+        self.assertEqual(404, response.status_code)
+
+        response = self.client.post(url, {'action': 'delete_comments', 'user': self.username2})
+        self.assertEqual(404, response.status_code)
+
+    # Allocating a comment id is one counter update, not a scan of the thread
+    def testCommentIdAllocation(self):
+        owner = User.objects.create(username=self.username)
+        channel = create_channel(self.channel_name, owner)
+        thread = create_thread(channel, owner)
+        create_comment(thread, owner)
+        last = create_comment(thread, owner)
+        last.delete()
+
+        with CaptureQueriesContext(connection) as queries:
+            comment = create_comment(thread, owner)
+
+        self.assertEqual(2, comment.comment_id)
+        self.assertFalse([q for q in queries.captured_queries if 'MAX(' in q['sql']])
+
+    # Comments are listed newest first, one page at a time
+    @override_settings(FORUM_PAGE_SIZE=3)
+    def testCommentPagination(self):
+        owner = User.objects.create(username=self.username)
+        channel = create_channel(self.channel_name, owner)
+        thread = create_thread(channel, owner)
+        date = timezone.now()
+
+        # comments sharing a pub_date are ordered by comment_id
+        for i in range(7):
+            Comment.objects.create(thread=thread, owner=owner, text=self.text, pub_date=date if i < 4 else date + datetime.timedelta(seconds=i))
+
+        url = reverse('forumapp:comment', kwargs={'channel': self.channel_name, 'thread': thread.thread_id})
+
+        response = self.client.get(url)
+        page = response.context['page']
+        self.assertEqual([6, 5, 4], [c.comment_id for c in response.context['comment_list']])
+        self.assertTrue(page.has_next)
+        self.assertContains(response, '?after=' + page.next_token)
+
+        response = self.client.get(url, {'after': page.next_token})
+        page = response.context['page']
+        self.assertEqual([3, 2, 1], [c.comment_id for c in response.context['comment_list']])
+
+        response = self.client.get(url, {'after': page.next_token})
+        page = response.context['page']
+        self.assertEqual([0], [c.comment_id for c in response.context['comment_list']])
+        self.assertFalse(page.has_next)
+
+        response = self.client.get(url, {'before': page.previous_token})
+        self.assertEqual([3, 2, 1], [c.comment_id for c in response.context['comment_list']])
+
+    # Comment pages past a cursor seek to it in the thread's index in either direction
+    @skipUnless(connection.vendor == 'sqlite', "checks SQLite's query plan")
+    def testCommentListingUsesIndex(self):
+        paginator = KeysetPaginator(Comment.objects.filter(thread__thread_id=0, thread__channel__channel_name=self.channel_name), COMMENT_KEYS)
+
+        for reverse in (False, True):
+            plan = query_plan(paginator.segments([timezone.now(), 3], reverse)[0])
+            self.assertIn('forumapp_comment_order_idx', plan)
+            self.assertRegex(plan, r'pub_date[<>]')
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    # Thread and comment pages can list plain row objects and still render the same
+    @override_settings(FORUM_PAGE_SIZE=3)
+    def testLightRows(self):
+        owner = User.objects.create(username=self.username)
+        other = User.objects.create(username=self.username2)
+        channel = create_channel(self.channel_name, owner)
+        thread = create_thread(channel, owner)
+        create_thread(channel, other)
+
+        for i in range(5):
+            create_comment(thread, other if i % 2 else owner, self.text, days=-i)
+
+        self.client.force_login(owner)
+        urls = (reverse('forumapp:thread', kwargs={'channel': self.channel_name}), \
+                reverse('forumapp:comment', kwargs={'channel': self.channel_name, 'thread': thread.thread_id}))
+
+        # the csrf tokens in the forms differ on every render
+        def render(url, **params):
+            caches['default'].clear()
+            response = self.client.get(url, params)
+            return response, re.sub(r"name='csrfmiddlewaretoken' value='[^']*'", '', response.content.decode('utf-8'))
+
+        for url in urls:
+            response, models = render(url)
+            next_page = render(url, after=response.context['page'].next_token)[1]
+
+            with override_settings(FORUM_LIGHT_ROWS=True):
+                rows, light = render(url)
+                self.assertEqual(models, light)
+                self.assertEqual(next_page, render(url, after=rows.context['page'].next_token)[1])
+
+            row = rows.context['page'].object_list[0]
+            self.assertIsInstance(row, (projections.ThreadRow, projections.CommentRow))
+            self.assertFalse(hasattr(row, '__dict__'))
+
+    # Permission filters on every row should share one channel lookup per request
+    def testCommentPermissionsResolvedOnce(self):
+        owner = User.objects.create(username=self.username)
+        moderator = User.objects.create(username=self.username2)
+        channel = create_channel(self.channel_name, owner)
+        Moderator.objects.create(channel=channel, user=moderator)
+        thread = create_thread(channel, owner)
+
+        url = reverse('forumapp:comment', kwargs={'channel': self.channel_name, 'thread': thread.thread_id})
+        self.client.force_login(moderator)
+
+        def channel_queries(count):
+            for i in range(count):
+                create_comment(thread, owner, self.text)
+
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+
+            self.assertContains(response, 'delete_comment', count=Comment.objects.count())
+            return [q for q in queries.captured_queries if 'FROM "forumapp_channel"' in q['sql']]
+
+        self.assertEqual(len(channel_queries(1)), len(channel_queries(10)))
+        self.assertEqual(1, len(channel_queries(0)))
+
+    # New and deleted comments change the thread page's validators
+    def testCommentConditionalGet(self):
+        owner = User.objects.create(username=self.username)
+        channel = create_channel(self.channel_name, owner)
+        thread = create_thread(channel, owner)
+        url = reverse('forumapp:comment', kwargs={'channel': self.channel_name, 'thread': thread.thread_id})
+
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(304, self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code)
+
+        comment = create_comment(thread, owner, self.text)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, self.text)
+
+        etag = response['ETag']
+        comment.delete()
+        self.assertNotContains(self.client.get(url, HTTP_IF_NONE_MATCH=etag), self.text)
+
+    # Open streams receive new comments rendered for their reader
+    @override_settings(FORUM_LIVE_KEEPALIVE=0.1, FORUM_LIVE_COMMENTS=True)
+    def testLiveComments(self):
+        owner = User.objects.create(username=self.username)
+        channel = create_channel(self.channel_name, owner)
+        thread = create_thread(channel, owner)
+        url = reverse('forumapp:comment_live', kwargs={'channel': self.channel_name, 'thread': thread.thread_id})
+        self.client.force_login(owner)
+
+        self.assertContains(self.client.get(reverse('forumapp:comment', kwargs={'channel': self.channel_name, \
+                'thread': thread.thread_id})), 'EventSource')
+
+        response = self.client.get(url)
+        events = iter(response.streaming_content)
+        self.assertEqual('text/event-stream', response['Content-Type'])
+
+        comment = create_comment(thread, owner, self.text)
+        live.publish_comment(self.channel_name, comment)
+
+        self.assertEqual(b'retry: 3000\n\n', next(events))
+        event = next(events).decode('utf-8')
+        self.assertTrue(event.startswith('id: 0\nevent: comment\n'))
+        self.assertIn(self.text, event)
+
+        # the owner sees the moderator controls on the streamed row too
+        self.assertIn('delete_comment', event)
+        self.assertEqual(b': keepalive\n\n', next(events))
+        response.close()
+
+        # a reconnecting browser gets what it missed first
+        create_comment(thread, owner, self.text[::-1])
+        response = self.client.get(url, HTTP_LAST_EVENT_ID='0')
+        events = iter(response.streaming_content)
+        next(events)
+        self.assertIn(self.text[::-1], next(events).decode('utf-8'))
+        response.close()
+
+        # banned readers can't follow the thread
+        user = User.objects.create(username=self.username2)
+        Ban.objects.create(channel=channel, user=user)
+        self.client.force_login(user)
+        self.assertEqual(404, self.client.get(url).status_code)
+
+    # Streams hold a worker thread each under WSGI, so they're off unless turned on
+    @override_settings(FORUM_LIVE_COMMENTS=False)
+    def testLiveCommentsOff(self):
+        owner = User.objects.create(username=self.username)
+        thread = create_thread(create_channel(self.channel_name, owner), owner)
+        kwargs = {'channel': self.channel_name, 'thread': thread.thread_id}
+
+        self.assertNotContains(self.client.get(reverse('forumapp:comment', kwargs=kwargs)), 'EventSource')
+        self.assertEqual(404, self.client.get(reverse('forumapp:comment_live', kwargs=kwargs)).status_code)
+
+    # The cache backed hub carries events between hubs sharing a cache, like separate processes
+    @override_settings(FORUM_LIVE_POLL_INTERVAL=0.01)
+    def testLiveCacheHub(self):
+        reader, writer = live.CacheHub(), live.CacheHub()
+        subscription = reader.subscribe('topic')
+
+        self.assertIsNone(subscription.get(0.05))
+
+        writer.publish('topic', {'n': 1})
+        writer.publish('other', {'n': 2})
+        writer.publish('topic', {'n': 3})
+
+        self.assertEqual([{'n': 1}, {'n': 3}, None], [subscription.get(0.05) for i in range(3)])
+
     def testAdminRemoveComment(self):
         pass
 
@@ -452,6 +1306,279 @@ class CommentTests(ValidationErrorTestMixin, TestCase):
         self.assertContains(response, self.text)
 '''
 
+## Comments posted through the view are published once their transaction commits
+@override_settings(FORUM_LIVE_COMMENTS=True)
+class LiveCommentTests(TransactionTestCase):
+    username = "live-user"
+    channel_name = "live-channel"
+    text = "live comment text"
+
+    def tearDown(self):
+        # the search index isn't a model, so flushing the database leaves it behind
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM forumapp_search')
+
+    def testPostPublishes(self):
+        user = User.objects.create(username=self.username)
+        channel = create_channel(self.channel_name, user)
+        thread = create_thread(channel, user)
+        subscription = live.get_hub().subscribe(live.thread_topic(self.channel_name, thread.thread_id))
+        self.client.force_login(user)
+
+        try:
+            self.client.post(reverse('forumapp:comment', kwargs={'channel': self.channel_name, 'thread': thread.thread_id}), \
+                    {'create': '', 'text': self.text})
+
+            event = subscription.get(1)
+            self.assertEqual((0, self.text, self.username), (event['comment_id'], event['text'], event['owner_id']))
+
+        finally:
+            subscription.close()
+
+    # Open streams don't hold a database connection while they wait
+    @override_settings(FORUM_LIVE_KEEPALIVE=0.05)
+    def testStreamReleasesConnection(self):
+        user = User.objects.create(username=self.username)
+        thread = create_thread(create_channel(self.channel_name, user), user)
+
+        response = self.client.get(reverse('forumapp:comment_live', \
+                kwargs={'channel': self.channel_name, 'thread': thread.thread_id}), HTTP_LAST_EVENT_ID='0')
+        events = iter(response.streaming_content)
+        next(events)
+
+        # SQLite's in-memory test database ignores close(), so watch for the call instead
+        with mock.patch.object(connection, 'close') as close:
+            self.assertEqual(b': keepalive\n\n', next(events))
+            self.assertTrue(close.called)
+
+        response.close()
+
+    # Pages are served through the ASGI entry point, and live streams are pushed from its event
+    # loop, running their queries and renders on its worker threads
+    @override_settings(FORUM_LIVE_KEEPALIVE=0.05)
+    def testAsgiApplication(self):
+        from django_forum.asgi import application
+
+        owner = User.objects.create(username=self.username)
+        channel = create_channel(self.channel_name, owner)
+        thread = create_thread(channel, owner)
+        loop = asyncio.new_event_loop()
+
+        # start a GET on the application, returning its task and the client's two ends
+        def get(path):
+            incoming, sent = asyncio.Queue(loop=loop), asyncio.Queue(loop=loop)
+            incoming.put_nowait({'type': 'http.request'})
+            scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'headers': []}
+
+            async def send(message):
+                sent.put_nowait(message)
+
+            return loop.create_task(application(scope, incoming.get, send)), incoming, sent
+
+        async def thread_page():
+            task, incoming, sent = get(reverse('forumapp:thread', kwargs={'channel': self.channel_name}))
+            await asyncio.wait_for(task, 5)
+            return sent.get_nowait(), sent.get_nowait()
+
+        start, body = loop.run_until_complete(thread_page())
+        self.assertEqual(200, start['status'])
+        self.assertIn(thread.thread_name.encode('utf-8'), body['body'])
+
+        async def live_stream():
+            task, incoming, sent = get(reverse('forumapp:comment_live', \
+                    kwargs={'channel': self.channel_name, 'thread': thread.thread_id}))
+
+            async def receive():
+                return (await asyncio.wait_for(sent.get(), 5))['body']
+
+            start = await asyncio.wait_for(sent.get(), 5)
+
+            # the stream idles on the loop, then picks up a new comment
+            chunks = [await receive(), await receive()]
+            comment = await loop.run_in_executor(None, create_comment, thread, owner, self.text)
+            live.publish_comment(self.channel_name, comment)
+
+            while self.text.encode('utf-8') not in chunks[-1]:
+                chunks.append(await receive())
+
+            # and ends when the client goes away
+            incoming.put_nowait({'type': 'http.disconnect'})
+            await asyncio.wait_for(task, 5)
+            return start, chunks
+
+        # note which threads rendered the stream's events
+        threads = []
+        render_event = views.LiveCommentView.render_event
+
+        def recording(view, access, comment):
+            threads.append(threading.current_thread().name)
+            return render_event(view, access, comment)
+
+        try:
+            with mock.patch.object(views.LiveCommentView, 'render_event', recording):
+                start, chunks = loop.run_until_complete(live_stream())
+        finally:
+            loop.close()
+
+        self.assertEqual(200, start['status'])
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+        self.assertEqual([b'retry: 3000\n\n', b': keepalive\n\n'], chunks[:2])
+        self.assertTrue(chunks[-1].startswith(b'id: 0\nevent: comment\n'))
+
+        # streams borrow the server's bounded pool rather than the loop's default one
+        self.assertIs(application.executor, live.get_executor())
+        self.assertTrue(threads)
+        self.assertTrue(all(name.startswith('forum-asgi') for name in threads), threads)
+
+        # nobody is left subscribed to the thread
+        self.assertFalse(live.get_hub().subscribers)
+
+## Search tests
+class SearchTests(TestCase):
+    username = 'searcher'
+    channel_name = 'search-channel'
+    channel_name2 = 'other-channel'
+
+    def setUp(self):
+        self.owner = User.objects.create(username=self.username)
+        self.channel = create_channel(self.channel_name, self.owner)
+        self.channel2 = create_channel(self.channel_name2, self.owner)
+
+    def results(self, query, **params):
+        params['q'] = query
+        response = self.client.get(reverse('forumapp:search'), params)
+
+        self.assertEqual(response.status_code, 200)
+        return response.context.get('results')
+
+    # Threads and comments are found by any of their words, best matches first
+    def testSearchRanking(self):
+        mention = create_thread(self.channel, self.owner, "General chat", "talk about gardening here")
+        title = create_thread(self.channel2, self.owner, "Gardening tips", "share what works")
+        create_comment(mention, self.owner, "my gardening went well")
+
+        hits = list(self.results('garden'))
+
+        self.assertEqual(3, len(hits))
+        self.assertEqual(("Gardening tips", 'thread'), (hits[0].title, hits[0].kind))
+
+        # comments link to their thread and show its name
+        comment = [hit for hit in hits if hit.kind == 'comment'][0]
+        self.assertEqual(("General chat", mention.thread_id), (comment.title, comment.thread))
+        self.assertIn('<mark>gardening</mark>', comment.snippet)
+
+    # Results can be limited to a channel and never show channels the user is banned from
+    def testSearchFilters(self):
+        create_thread(self.channel, self.owner, "Python questions")
+        create_thread(self.channel2, self.owner, "Python answers")
+
+        self.assertEqual([self.channel_name], [hit.channel for hit in self.results('python', channel=self.channel_name)])
+
+        user = User.objects.create(username='banned')
+        Ban.objects.create(channel=self.channel2, user=user)
+        self.client.force_login(user)
+
+        self.assertEqual([self.channel_name], [hit.channel for hit in self.results('python')])
+
+    # Edits and deletions are reflected straight away
+    def testSearchIndexSync(self):
+        thread = create_thread(self.channel, self.owner, "Original title")
+        comment = create_comment(thread, self.owner, "unique words")
+
+        thread.thread_name = "Renamed title"
+        thread.save()
+        self.assertFalse(list(self.results('original')))
+        self.assertEqual(1, len(self.results('renamed')))
+
+        comment.delete()
+        self.assertFalse(list(self.results('unique')))
+
+        thread.delete()
+        self.assertFalse(list(self.results('renamed')))
+
+    # Search syntax in the input is treated as plain words
+    def testSearchInputEscaped(self):
+        create_thread(self.channel, self.owner, "Quotes and stars")
+
+        self.assertEqual(1, len(self.results('"quotes" AND stars* -(')))
+        self.assertIsNone(self.results(''))
+        self.assertFalse(list(self.results('!!!')))
+
+    @override_settings(FORUM_SEARCH_RESULTS=2)
+    def testSearchPagination(self):
+        thread = create_thread(self.channel, self.owner, "Paging thread")
+        for i in range(4):
+            create_comment(thread, self.owner, "paging comment %d" % i)
+
+        first = self.results('paging')
+        last = self.results('paging', page=3)
+
+        self.assertTrue(first.has_next)
+        self.assertFalse(first.has_previous)
+        self.assertEqual(1, len(last))
+        self.assertFalse(last.has_next)
+
+    # Only the newest matches of each kind are ranked, however common the word is
+    @skipUnless(connection.vendor == 'sqlite', "ranks with SQLite's FTS5")
+    @override_settings(FORUM_SEARCH_CANDIDATES=3)
+    def testSearchCandidates(self):
+        thread = create_thread(self.channel, self.owner, "Candidate thread")
+        for i in range(5):
+            create_comment(thread, self.owner, "candidate %d" % i)
+
+        # the thread's title match outranks the comments, the two oldest of which aren't ranked
+        hits = self.results('candidate')
+        self.assertEqual(['thread'] + ['comment'] * 3, [hit.kind for hit in hits])
+        self.assertNotIn('candidate 0', ' '.join(hit.snippet for hit in hits))
+
+    def indexed_rowids(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT rowid FROM forumapp_search ORDER BY rowid')
+            return [row[0] for row in cursor.fetchall()]
+
+    # Saving only queues the change; the index is written in batches later
+    @skipUnless(connection.vendor == 'sqlite', "maintains SQLite's FTS5 index")
+    @override_settings(FORUM_SEARCH_BATCH=3)
+    def testSearchIndexBatched(self):
+        search.flush()
+        thread = create_thread(self.channel, self.owner, "Batched thread")
+        first = create_comment(thread, self.owner, "batched comment")
+
+        self.assertEqual([], self.indexed_rowids())
+
+        # the third change fills the batch
+        second = create_comment(thread, self.owner, "batched comment")
+        self.assertEqual([search.thread_rowid(thread.pk), search.comment_rowid(first.pk), search.comment_rowid(second.pk)], \
+                self.indexed_rowids())
+
+    # The rebuild walks the tables in chunks and picks up where an interrupted run stopped
+    @skipUnless(connection.vendor == 'sqlite', "maintains SQLite's FTS5 index")
+    def testReindexForum(self):
+        threads = [create_thread(self.channel, self.owner, "Reindexed %d" % i) for i in range(3)]
+        comments = [create_comment(threads[0], self.owner, "reindexed comment") for i in range(3)]
+        search.flush()
+
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM forumapp_search')
+            cursor.execute("INSERT INTO forumapp_search (rowid, title, body, kind) VALUES (999, 'gone', 'gone', 'comment')")
+
+        checkpoint = os.path.join(tempfile.mkdtemp(), 'reindex.json')
+        with open(checkpoint, 'w') as f:
+            json.dump({'kind': 'comment', 'last': comments[0].pk}, f)
+
+        out = StringIO()
+        call_command('reindex_forum', chunk_size=2, checkpoint=checkpoint, stdout=out)
+
+        # the threads were already done and the first comment with them
+        self.assertIn("Resuming from comment", out.getvalue())
+        self.assertEqual([search.comment_rowid(c.pk) for c in comments[1:]], self.indexed_rowids())
+        self.assertFalse(os.path.exists(checkpoint))
+
+        call_command('reindex_forum', chunk_size=2, checkpoint=checkpoint, stdout=StringIO())
+        self.assertEqual(6, len(self.indexed_rowids()))
+        self.assertEqual(6, len(self.results('reindexed')))
+
 class UserTests(ValidationErrorTestMixin, TestCase):
     username = "randomuser91387245"
     username2 = "asfghjguser"
@@ -498,6 +1625,46 @@ class UserTests(ValidationErrorTestMixin, TestCase):
         self.assertTrue(Thread.objects.filter(channel__channel_name=self.channel_name2, thread_id=thread_id2).exists())
         self.assertTrue(Comment.objects.filter(thread__channel__channel_name=self.channel_name2, thread__thread_id=otherthread_id, comment_id=comment_id2).exists())
 
+    ## Only the deleted user's channels are handed on, in a fixed number of queries
+    def testUserDeleteReassigns(self):
+        owner = User.objects.create(username=self.username)
+        mod = User.objects.create(username=self.username2)
+        channel = create_channel(self.channel_name, owner)
+        Moderator.objects.create(channel=channel, user=mod)
+
+        # an ownerless channel that has nothing to do with the deleted user
+        unrelated = create_channel(self.channel_name2, mod)
+        Channel.objects.filter(pk=unrelated.pk).update(owner=None)
+
+        for i in range(5):
+            Moderator.objects.create(channel=create_channel('other%d' % i, owner), user=mod)
+
+        with CaptureQueriesContext(connection) as queries:
+            owner.delete()
+
+        channel_queries = [q for q in queries.captured_queries if '"forumapp_channel"' in q['sql']]
+        self.assertEqual(self.username2, Channel.objects.get(pk=channel.pk).owner_id)
+        self.assertTrue(Channel.objects.filter(pk=unrelated.pk).exists())
+        # the delete itself reads the channels twice (for owner and last_poster) and nulls the
+        # owner; they're then captured, handed on and the leftovers collected, however many
+        self.assertEqual(6, len(channel_queries))
+
+    ## Deleting many users hands on all of their channels at once
+    def testBulkUserDelete(self):
+        users = [User.objects.create(username='bulk%d' % i) for i in range(3)]
+        heir = User.objects.create(username=self.username2)
+
+        inherited = create_channel(self.channel_name, users[0])
+        Moderator.objects.create(channel=inherited, user=heir)
+
+        # moderated only by users deleted alongside its owner
+        orphaned = create_channel(self.channel_name2, users[1])
+        Moderator.objects.create(channel=orphaned, user=users[2])
+
+        self.assertEqual(3, moderation.delete_users(User.objects.filter(username__startswith='bulk')))
+        self.assertEqual(self.username2, Channel.objects.get(pk=inherited.pk).owner_id)
+        self.assertFalse(Channel.objects.filter(pk=orphaned.pk).exists())
+
     def testUniqueUser(self):
         user1 = User.objects.create(username=self.username)
         user2 = User.objects.create(username=self.username2)
@@ -514,4 +1681,301 @@ class UserTests(ValidationErrorTestMixin, TestCase):
         pass
 
     def testChannelBanUser(self):
-        pass
+        owner = User.objects.create(username=self.username)
+        user = User.objects.create(username=self.username2)
+        channel = create_channel(self.channel_name, owner)
+        url = reverse('forumapp:user', kwargs={'username': user.username})
+
+        self.client.force_login(owner)
+        self.client.post(url, {'promote_mod': '', 'channel_name': channel.channel_name})
+        self.assertTrue(channel.moderators.filter(username=user.username).exists())
+
+        # banning a moderator also demotes them
+        self.client.post(url, {'channel_ban': '', 'channel_name': channel.channel_name})
+        self.assertTrue(Ban.objects.filter(channel=channel, user=user).exists())
+        self.assertFalse(Moderator.objects.filter(channel=channel, user=user).exists())
+        self.assertEqual([self.channel_name], [c.channel_name for c in user.banned_channels.all()])
+
+        # banned users can't be promoted
+        response = self.client.post(url, {'promote_mod': '', 'channel_name': channel.channel_name}, follow=True)
+        self.assertContains(response, "Channel-banned users cannot be promoted.")
+        self.assertFalse(Moderator.objects.filter(channel=channel, user=user).exists())
+
+        self.client.post(url, {'channel_unban': '', 'channel_name': channel.channel_name})
+        self.assertFalse(Ban.objects.filter(channel=channel, user=user).exists())
+
+        # banned channels are hidden from the channel listing
+        Ban.objects.create(channel=channel, user=user)
+        self.client.force_login(user)
+        response = self.client.get(reverse('forumapp:channel'))
+        self.assertContains(response, "No channels are available.")
+
+    def testFavorites(self):
+        owner = User.objects.create(username=self.username)
+        channel = create_channel(self.channel_name, owner)
+        create_channel(self.channel_name2, owner)
+        url = reverse('forumapp:favorites')
+
+        self.client.force_login(owner)
+        self.client.post(url, {'add_favorite': '', 'channel_name': channel.channel_name})
+
+        response = self.client.post(url, {'add_favorite': '', 'channel_name': channel.channel_name}, follow=True)
+        self.assertIn("Channel already in favorites", [str(m) for m in response.context['messages']])
+        self.assertEqual(1, Favorite.objects.filter(channel=channel).count())
+        self.assertEqual([channel], list(response.context['favorites_list']))
+
+        self.client.post(url, {'remove_favorite': '', 'channel_name': channel.channel_name})
+        self.assertFalse(Favorite.objects.exists())
+
+        response = self.client.post(url, {'remove_favorite': '', 'channel_name': channel.channel_name}, follow=True)
+        self.assertIn("Channel not found in favorites", [str(m) for m in response.context['messages']])
+
+## Query budget tests: every page runs the same number of queries however big the forum
+## is, and stays within its FORUM_QUERY_BUDGETS entry once the caches are warm. Set
+## FORUM_PERF_REPORT to a file name to also get each page's query count and time at
+## every size, as JSON.
+class QueryBudgetTests(TestCase):
+    sizes = (10, 1000, 10000)
+    channel_name = 'budget-channel'
+    owner_name = 'budget-owner'
+    reader_name = 'budget-reader'
+    word = 'budgetword'
+
+    ## Seed a forum of roughly size rows: size comments in one thread, size / 10 threads
+    ## in its channel and size / 100 other channels and users around it
+    def seed(self, size):
+        owner = User.objects.create(username=self.owner_name, is_staff=True)
+        reader = User.objects.create(username=self.reader_name)
+        posters = User.objects.bulk_create([User(username='budget-poster%d' % i) for i in range(size // 100 + 1)])
+        now = timezone.now()
+
+        channels = [Channel(channel_name=self.channel_name, owner=owner, description=self.word)]
+        channels += [Channel(channel_name='budget-other%d' % i, owner=posters[i % len(posters)]) \
+                for i in range(size // 100 + 1)]
+        Channel.objects.bulk_create(channels)
+
+        Thread.objects.bulk_create([Thread(channel_id=self.channel_name, thread_id=i, owner=posters[i % len(posters)], \
+                thread_name='budget thread %d' % i, description=self.word, recent_date=now - datetime.timedelta(minutes=i)) \
+                for i in range(size // 10 + 1)])
+        thread = Thread.objects.get(channel_id=self.channel_name, thread_id=0)
+
+        Comment.objects.bulk_create([Comment(thread=thread, comment_id=i, owner=posters[i % len(posters)], \
+                text='%s %d' % (self.word, i), pub_date=now - datetime.timedelta(seconds=i)) for i in range(size)])
+
+        # the reader moderates the channel, favors every channel and is banned from one
+        Moderator.objects.create(channel_id=self.channel_name, user=reader)
+        user_settings = UserSettings.objects.create(user=reader)
+        Favorite.objects.bulk_create([Favorite(settings=user_settings, channel=channel) for channel in channels])
+        Ban.objects.create(channel=channels[-1], user=reader)
+
+        Channel.objects.update(next_thread_id=size // 10 + 1)
+        Thread.objects.filter(pk=thread.pk).update(next_comment_id=size)
+        counters.reconcile(Channel, Thread, Comment)
+
+        if search.is_indexed():
+            search.write_rows(search.thread_rows(Thread.objects.all()) + search.comment_rows(Comment.objects.all()))
+
+        return owner, reader, thread
+
+    # (url name, user to log in as, method, url, data) for every forum and registration view
+    def get_requests(self, thread):
+        channel = {'channel': self.channel_name}
+        thread_kwargs = {'channel': self.channel_name, 'thread': thread.thread_id}
+
+        return [
+            ('forumapp:channel', 'reader', 'get', reverse('forumapp:channel'), {}),
+            ('forumapp:thread', 'reader', 'get', reverse('forumapp:thread', kwargs=channel), {}),
+            ('forumapp:comment', 'reader', 'get', reverse('forumapp:comment', kwargs=thread_kwargs), {}),
+            ('forumapp:comment_live', 'reader', 'get', reverse('forumapp:comment_live', kwargs=thread_kwargs), {}),
+            ('forumapp:user', 'reader', 'get', reverse('forumapp:user', kwargs={'username': self.owner_name}), {}),
+            ('forumapp:favorites', 'reader', 'get', reverse('forumapp:favorites'), {}),
+            ('forumapp:settings', 'reader', 'get', reverse('forumapp:settings'), {}),
+            ('forumapp:channel_settings', 'reader', 'get', reverse('forumapp:channel_settings', kwargs=channel), {}),
+            ('forumapp:search', 'reader', 'get', reverse('forumapp:search'), {'q': self.word}),
+            ('forumapp:moderate', 'reader', 'post', reverse('forumapp:moderate'), \
+                    {'action': 'delete_comments', 'channel': self.channel_name, 'user': self.owner_name}),
+            ('forumapp:stats', 'owner', 'get', reverse('forumapp:stats'), {}),
+            ('forumapp:reader', 'reader', 'get', reverse('forumapp:reader'), channel),
+            ('registration:login', None, 'get', reverse('registration:login'), {}),
+            ('registration:signup', None, 'get', reverse('registration:signup'), {}),
+            ('registration:password_reset', 'reader', 'get', reverse('registration:password_reset'), {}),
+            ('registration:password_reset_success', None, 'get', reverse('registration:password_reset_success'), {}),
+            ('registration:logout', 'reader', 'get', reverse('registration:logout'), {}),
+        ]
+
+    # Return (queries, milliseconds) for one request, reading the first chunk of streams
+    def request(self, client, method, url, data):
+        start = time.time()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(url, data)
+
+            if response.streaming:
+                next(iter(response.streaming_content))
+                response.close()
+
+        self.assertLess(response.status_code, 400, url)
+        return len(queries), round((time.time() - start) * 1000, 1)
+
+    # Return {url name: {'cold': (queries, ms), 'warm': (queries, ms)}} for every page
+    def measure(self, size):
+        owner, reader, thread = self.seed(size)
+        users = {'owner': owner, 'reader': reader}
+
+        # index changes queued outside a request would otherwise land on the first page measured
+        search.flush()
+        results = {}
+
+        for name, user, method, url, data in self.get_requests(thread):
+            client = Client()
+            if user is not None:
+                client.force_login(users[user])
+
+            results[name] = {'cold': self.request(client, method, url, data), 'warm': self.request(client, method, url, data)}
+
+        return results
+
+    @override_settings(FORUM_LIVE_KEEPALIVE=0.01, FORUM_LIVE_COMMENTS=True)
+    def testQueriesIndependentOfSize(self):
+        report = {}
+
+        for size in self.sizes:
+            with transaction.atomic():
+                report[size] = self.measure(size)
+                transaction.set_rollback(True)
+
+            caches['default'].clear()
+            channelcache.cache.clear()
+
+        path = os.environ.get('FORUM_PERF_REPORT')
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+        for name in report[self.sizes[0]]:
+            for attempt in ('cold', 'warm'):
+                counts = [report[size][name][attempt][0] for size in self.sizes]
+                self.assertEqual(len(set(counts)), 1, '%s ran %s queries (%s) at sizes %s' % (name, counts, attempt, self.sizes))
+
+class SeedForumTests(TestCase):
+
+    # The generator fills in consistent rows, and the load harness can browse them
+    def testSeedAndLoad(self):
+        out = StringIO()
+        call_command('seed_forum', '--users', '20', '--channels', '5', '--threads', '50', '--comments', '300', \
+                '--seed', '1', stdout=out)
+        self.assertIn("Created 20 user(s), 5 channel(s), 50 thread(s) and 300 comment(s)", out.getvalue())
+
+        self.assertEqual(20, User.objects.filter(username__startswith='seed-user').count())
+        self.assertEqual(20, UserSettings.objects.filter(user__username__startswith='seed-user').count())
+        self.assertEqual(50, Thread.objects.filter(channel__channel_name__startswith='seed-channel').count())
+        self.assertEqual(300, Comment.objects.filter(thread__channel__channel_name__startswith='seed-channel').count())
+        self.assertEqual(300, sum(Channel.objects.values_list('comment_count', flat=True)))
+
+        out = StringIO()
+        call_command('reconcile_counters', '--check', stdout=out)
+        self.assertIn("0 thread(s) and 0 channel(s) have drifted.", out.getvalue())
+
+        # the same prefix twice would collide
+        with self.assertRaises(CommandError):
+            call_command('seed_forum', '--users', '1', '--channels', '0', '--threads', '0', '--comments', '0', stdout=StringIO())
+
+        out = StringIO()
+        call_command('load_forum', '--requests', '20', '--concurrency', '1', '--seed', '1', stdout=out)
+        self.assertIn('p95 ms', out.getvalue())
+        self.assertIn('20 request(s)', out.getvalue())
+
+    def testPercentile(self):
+        values = list(range(1, 101))
+        self.assertEqual((50, 95, 99, 100), tuple(loadtest.percentile(values, p) for p in (50, 95, 99, 100)))
+        self.assertEqual(7, loadtest.percentile([7], 99))
+        self.assertEqual(None, loadtest.percentile([], 50))
+
+    # A server that stops sending halfway through a body counts as a failed request
+    def testHTTPTransportTimeout(self):
+        class StallingHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Length', '100')
+                self.end_headers()
+                self.wfile.write(b'partial')
+                self.wfile.flush()
+                time.sleep(0.5)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), StallingHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        try:
+            transport = loadtest.HTTPTransport('http://127.0.0.1:%d' % server.server_port, timeout=0.1)
+            results, elapsed = loadtest.run([('page', '/')] * 2, transport, concurrency=2)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        summary = loadtest.summarize(results)['page']
+        self.assertEqual((2, 2), (summary['requests'], summary['errors']))
+
+class SingleFlightTests(TestCase):
+    key = 'forumapp:test'
+
+    ## Run builds of one key from several threads at once, returning how many happened
+    def race(self, threads=5):
+        stored = []
+        builds = []
+
+        def fetch():
+            return stored[0] if stored else None
+
+        def build():
+            builds.append(1)
+            time.sleep(0.2)
+            stored.append('page')
+            return 'page'
+
+        def work():
+            self.assertEqual(('page', True), singleflight.run(self.key, fetch, build))
+
+        workers = [threading.Thread(target=work) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        return len(builds)
+
+    def testLocalLock(self):
+        self.assertEqual(1, self.race())
+
+    @skipUnless(singleflight.fcntl, "needs flock()")
+    def testFileLock(self):
+        with override_settings(FORUM_SINGLE_FLIGHT_LOCK='forumapp.singleflight.FileLock', \
+                FORUM_SINGLE_FLIGHT_DIR=tempfile.mkdtemp()):
+            self.assertEqual(1, self.race())
+
+    @override_settings(FORUM_SINGLE_FLIGHT_LOCK='forumapp.singleflight.CacheLock')
+    def testCacheLock(self):
+        self.assertEqual(1, self.race())
+
+        # only the holder's release frees the key
+        lock = singleflight.CacheLock(self.key)
+        self.assertTrue(lock.acquire())
+        singleflight.CacheLock(self.key).release()
+        self.assertFalse(singleflight.CacheLock(self.key).acquire())
+        lock.release()
+        self.assertTrue(singleflight.CacheLock(self.key).acquire())
+
+    # requests that find the key being built serve the stale copy, or build after waiting
+    @override_settings(FORUM_SINGLE_FLIGHT_WAIT=0.1)
+    def testBusyKey(self):
+        lock = singleflight.get_lock_class()(self.key)
+        self.assertTrue(lock.acquire())
+
+        try:
+            self.assertEqual(('old', False), singleflight.run(self.key, lambda: None, self.fail, stale='old'))
+            self.assertEqual(('new', True), singleflight.run(self.key, lambda: None, lambda: 'new'))
+
+        finally:
+            lock.release()
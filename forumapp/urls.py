@@ -17,12 +17,18 @@ from django.conf.urls import url
 from . import views
 
 app_name = 'forumapp'
+# fixed routes shadow channels of the same name, see forms.RESERVED_CHANNEL_NAMES
 urlpatterns = [
     url(r'^settings/$', views.UserSettingsView.as_view(), name='settings'),
     url(r'^settings/(?P<channel>[-\w]+)/$', views.ChannelSettingsView.as_view(), name='channel_settings'),
     url(r'^favorites/$', views.FavoritesView.as_view(), name='favorites'),
     url(r'^user/(?P<username>[-\w]+)/$', views.UserView.as_view(), name='user'),
+    url(r'^search/$', views.SearchView.as_view(), name='search'),
+    url(r'^moderate/$', views.ModerationView.as_view(), name='moderate'),
+    url(r'^stats/$', views.StatsView.as_view(), name='stats'),
+    url(r'^me/$', views.ReaderView.as_view(), name='reader'),
     url(r'^(?P<channel>[-\w]+)/(?P<thread>[0-9]+)/$', views.CommentView.as_view(), name='comment'),
+    url(r'^(?P<channel>[-\w]+)/(?P<thread>[0-9]+)/live/$', views.LiveCommentView.as_view(), name='comment_live'),
     url(r'^(?P<channel>[-\w]+)/$', views.ThreadView.as_view(), name='thread'),
     url(r'^$', views.ChannelView.as_view(), name='channel'),
 ]
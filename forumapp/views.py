@@ -1,14 +1,22 @@
-import json
+import datetime, hashlib, time
 from django.contrib import messages
-from django.contrib.auth.models import User
-from django.http import Http404, HttpResponseRedirect
+from django.contrib.auth.models import User, AnonymousUser
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag, urlencode
+from django.db import connection, transaction
 from django.shortcuts import render
 from django.views import generic
 from django.utils import timezone
 from django.urls import reverse
 from django.forms.models import model_to_dict
-from .models import UserSettings, Channel, Thread, Comment
-from .forms import UserSettingsForm, ChannelForm, ThreadForm, CommentForm
+from .models import UserSettings, Channel, Thread, Comment, Moderator, Ban, Favorite
+from .forms import UserSettingsForm, ChannelForm, ThreadForm, CommentForm, SearchForm, ModerationForm
+from .access import ChannelAccess
+from .services import post_thread, post_comment
+from . import fragments, conditional, search, live, moderation, instrumentation, projections, pagecache, channelcache
+from .pagination import KeysetPaginator, CHANNEL_KEYS, THREAD_KEYS, COMMENT_KEYS
 
 ## Get or create the user's settings (because get_or_create returns an annoying tuple)
 def get_or_create_settings(user):
@@ -18,24 +26,44 @@ def get_or_create_settings(user):
     else:
         return UserSettings.objects.create(user=user)
 
+## Return the names of the user's favorite channels in one query
+def get_favorite_names(user):
+    if not user.is_authenticated:
+        return frozenset()
+
+    favorites = Favorite.objects.filter(settings_id=user.pk).values_list('channel_id', flat=True)
+    return frozenset(favorites)
+
 ## Return whether a user is an owner or moderator of the channel
 def is_mod(obj, user):
-    # retrieve channel regardless of if we have a channel, thread, or comment
-    channel = isinstance(obj, Comment) and obj.thread.channel \
-            or (isinstance(obj, Thread) and obj.channel or obj)
+    info = get_channel_info(obj)
 
     # check if user is owner or moderator
-    return user == channel.owner \
-            or user.get_username() in json.loads(channel.moderators)
+    return info is not None and info.is_moderator(user)
 
 ## Return whether a user is an owner of the channel
 def is_owner(obj, user):
-    # retrieve channel regardless of if we have a channel, thread, or comment
-    channel = isinstance(obj, Comment) and obj.thread.channel \
-            or (isinstance(obj, Thread) and obj.channel or obj)
+    info = get_channel_info(obj)
 
     # check if user is owner
-    return user == channel.owner
+    return info is not None and info.is_owner(user)
+
+## Return the metadata of a channel, or of a thread's or comment's channel. These checks
+## authorize changes, so they read the database rather than another process's stale copy.
+def get_channel_info(obj):
+    if isinstance(obj, Channel):
+        return channelcache.get(obj.pk, lambda: obj, fresh=True)
+
+    # retrieve channel name regardless of if we have a thread or comment
+    channel_name = isinstance(obj, Comment) and obj.thread.channel_id or obj.channel_id
+
+    return channelcache.get(channel_name, fresh=True)
+
+## Report each of a form's validation errors as a message
+def report_form_errors(request, form):
+    for errors in form.errors.values():
+        for error in errors:
+            messages.error(request, error)
 
 ## Automatically lets views attach form and context_objects to the context if defined
 class ViewMixin(generic.base.ContextMixin):
@@ -56,6 +84,163 @@ class ViewMixin(generic.base.ContextMixin):
         if hasattr(self, 'context_object_name'):
             context[self.context_object_name] = self.get_object()
 
+        # resolve channel permissions/metadata once for every template filter on the page
+        if 'channel' in self.kwargs:
+            context['access'] = ChannelAccess.for_request(self.request, \
+                    self.kwargs.get('channel'), self.kwargs.get('thread'))
+
+        return context
+
+## Lets list views page through their listing by key instead of loading every row
+class KeysetListingMixin(ViewMixin):
+    paginate_keys = None
+
+    # the listing is attached by get_context_data, so skip the generic object lookups
+    def get(self, request, *args, **kwargs):
+        self.object = self.object_list = None
+        return self.render_to_response(self.get_context_data())
+
+    def get_context_data(self, **kwargs):
+        context = super(KeysetListingMixin, self).get_context_data(**kwargs)
+
+        paginator = KeysetPaginator(context[self.context_object_name], self.paginate_keys)
+        page = paginator.page(after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+
+        context['page'] = page
+        context[self.context_object_name] = page.object_list
+
+        return context
+
+## Answers conditional GETs with 304 Not Modified when nothing on the page changed since
+## the client's copy, before any listing query runs. Views list the conditional.py scopes
+## their page depends on and the dates their rows already keep. Views that set
+## share_pages serve the same cached page to every reader (see pagecache.py).
+class ConditionalGetMixin(object):
+    share_pages = False
+
+    # set while the page is rendered for sharing
+    rendering_shared = False
+
+    def get_change_scopes(self):
+        return (conditional.GLOBAL_SCOPE,)
+
+    # timestamps of the rows the page is built from
+    def get_change_dates(self):
+        return []
+
+    # parts of the page that differ between users
+    def get_user_state(self):
+        user = self.request.user
+        return [user.get_username(), user.is_staff]
+
+    # when anything on the page last changed, as a unix timestamp
+    def get_last_modified(self):
+        last_modified = conditional.last_changed(self.get_change_scopes())
+        for date in self.get_change_dates():
+            if date is not None:
+                last_modified = max(last_modified, date.timestamp())
+
+        return last_modified
+
+    # what the page's content depends on, whoever reads it; rendered dates are relative to today
+    def get_page_state(self, last_modified):
+        return [repr(last_modified), self.request.get_full_path(), str(timezone.now().date())]
+
+    def get_validators(self, last_modified):
+        state = self.get_page_state(last_modified) + [str(bit) for bit in self.get_user_state()]
+
+        etag = hashlib.md5('|'.join(state).encode('utf-8')).hexdigest()
+        return quote_etag(etag), int(last_modified)
+
+    def get_context_data(self, **kwargs):
+        context = super(ConditionalGetMixin, self).get_context_data(**kwargs)
+
+        if self.rendering_shared:
+            context.update(shared=True, csrf_token=pagecache.CSRF_PLACEHOLDER, reader_url=pagecache.READER_PLACEHOLDER)
+
+        return context
+
+    # where the shared page's javascript looks up the reader
+    def get_reader_url(self):
+        channel = self.kwargs.get('channel')
+        return reverse('forumapp:reader') + ('?' + urlencode({'channel': channel}) if channel else '')
+
+    # the cached page, rendered first if no reader has asked for this version yet; also
+    # returns whether it is this version rather than a stale one
+    def get_shared_page(self, last_modified):
+        version = pagecache.page_version(self.get_page_state(last_modified))
+        content, current = pagecache.get_shared_page(self.request.get_full_path(), version, self.render_shared_page)
+
+        return HttpResponse(pagecache.personalize(content, self.request, self.get_reader_url())), current
+
+    # render the page the way a logged-out reader sees it, with its holes marked
+    def render_shared_page(self):
+        request = self.request
+        user, request.user = request.user, AnonymousUser()
+        self.rendering_shared = True
+
+        try:
+            response = super(ConditionalGetMixin, self).get(request, *self.args, **self.kwargs)
+            stats = getattr(request, '_instrumentation', None)
+
+            if stats is None:
+                response.render()
+            else:
+                with instrumentation.measure_render(stats):
+                    response.render()
+
+        finally:
+            request.user = user
+            self.rendering_shared = False
+
+        return response.content
+
+    def get(self, request, *args, **kwargs):
+
+        # pages carrying flash messages are always rendered
+        if len(messages.get_messages(request)):
+            return super(ConditionalGetMixin, self).get(request, *args, **kwargs)
+
+        last_modified = self.get_last_modified()
+        etag, modified = self.get_validators(last_modified)
+        response = get_conditional_response(request, etag=etag, last_modified=modified)
+        current = True
+
+        if response is None and self.share_pages and pagecache.is_shared_with(request.user):
+            response, current = self.get_shared_page(last_modified)
+
+        if response is None:
+            response = super(ConditionalGetMixin, self).get(request, *args, **kwargs)
+
+        # a stale copy can't be revalidated as this version later
+        if current:
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(modified)
+
+        # pages differ per user and must be revalidated before reuse
+        patch_cache_control(response, private=True, no_cache=True)
+
+        return response
+
+## Conditional GETs for pages inside a channel, which also depend on the user's standing there
+class ChannelConditionalMixin(ConditionalGetMixin):
+
+    # the channel row and permissions are resolved once and reused by the page itself
+    def get_access(self):
+        return ChannelAccess.for_request(self.request, self.kwargs.get('channel'), self.kwargs.get('thread'))
+
+    def get_user_state(self):
+        access = self.get_access()
+        user = self.request.user
+        return super(ChannelConditionalMixin, self).get_user_state() + [access.is_moderator(user), access.is_banned(user)]
+
+## Looks up the user's favorites once so channel listings don't query per row
+class FavoriteNamesMixin(object):
+
+    def get_context_data(self, **kwargs):
+        context = super(FavoriteNamesMixin, self).get_context_data(**kwargs)
+        context['favorite_names'] = get_favorite_names(self.request.user)
+
         return context
 
 # Show the settings menu
@@ -108,10 +293,10 @@ class ChannelSettingsView(ViewMixin, generic.DetailView):
     def get_object(self):
         if self.request.user.is_authenticated:
             channel_name = self.kwargs.get('channel')
-            channel = self.queryset.filter(channel_name=channel_name)
+            channel = self.queryset.filter(channel_name=channel_name).first()
 
-            if channel.exists():
-                return channel.get()
+            if channel is not None:
+                return channel
 
         return self.queryset.none()
 
@@ -147,7 +332,7 @@ class ChannelSettingsView(ViewMixin, generic.DetailView):
         return HttpResponseRedirect(self.request.path_info)
 
 # Create your views here.
-class ChannelView(ViewMixin, generic.ListView):
+class ChannelView(ConditionalGetMixin, FavoriteNamesMixin, KeysetListingMixin, generic.ListView):
     model = Channel
     template_name = 'forumapp/channel.html'
 
@@ -155,30 +340,31 @@ class ChannelView(ViewMixin, generic.ListView):
 
     queryset = Channel.objects
     context_object_name = 'channel_list'
+    paginate_keys = CHANNEL_KEYS
+    share_pages = True
+
+    def get_change_scopes(self):
+        return (conditional.GLOBAL_SCOPE, conditional.CHANNELS_SCOPE)
 
+    # Return channels the user isn't banned from
     def get_object(self, exclude=None):
-        return self.queryset.all()
+        return projections.listing(self.queryset.minus_bans(self.request.user))
 
 
     def post(self, request, *args, **kwargs):
 
         if 'add_favorite' in request.POST:
             settings = get_or_create_settings(self.request.user)
-            favs = json.loads(settings.favorites)
             channel_name = request.POST['channel_name']
 
-            favs.append(channel_name)
-            settings.favorites = json.dumps(favs)
-            settings.save()
+            if self.queryset.filter(channel_name=channel_name).exists():
+                Favorite.objects.get_or_create(settings=settings, channel_id=channel_name)
 
         elif 'remove_favorite' in request.POST:
             settings = get_or_create_settings(self.request.user)
-            favs = json.loads(settings.favorites)
             channel_name = request.POST['channel_name']
 
-            favs = [c for c in favs if not c == channel_name]
-            settings.favorites = json.dumps(favs)
-            settings.save()
+            Favorite.objects.filter(settings=settings, channel_id=channel_name).delete()
 
         elif 'pin' in request.POST:
             channel_name = request.POST['channel_name']
@@ -233,6 +419,9 @@ class ChannelView(ViewMixin, generic.ListView):
                     channel.delete()
                     messages.error(request, "Channel name must be at least 4 characters.")
 
+            elif form.has_error('channel_name', 'reserved'):
+                report_form_errors(request, form)
+
             elif Channel.objects.filter(channel_name=form. data.get('channel_name')).exists():
                 messages.error(request, "Channel already exists with that name.")
 
@@ -243,7 +432,7 @@ class ChannelView(ViewMixin, generic.ListView):
 
         return HttpResponseRedirect(self.request.path_info)
 
-class ThreadView(ViewMixin, generic.DetailView):
+class ThreadView(ChannelConditionalMixin, KeysetListingMixin, generic.DetailView):
     model = Thread
     template_name = 'forumapp/thread.html'
 
@@ -251,21 +440,28 @@ class ThreadView(ViewMixin, generic.DetailView):
 
     queryset = Thread.objects
     context_object_name = 'thread_list'
+    paginate_keys = THREAD_KEYS
+    share_pages = True
+
+    def get_change_scopes(self):
+        return (conditional.GLOBAL_SCOPE, conditional.channel_scope(self.kwargs.get('channel')))
+
+    def get_change_dates(self):
+        access = self.get_access()
+        return [access.channel and access.channel.recent_date]
 
     # Return querylist of threads in the given channel
     def get_object(self):
         c_name = self.kwargs.get('channel')
 
-        return self.queryset.filter(channel__channel_name=c_name)
+        return projections.listing(self.queryset.filter(channel__channel_name=c_name))
 
     def post(self, request, *args, **kwargs):
 
-        channel = Channel.objects.filter(channel_name=self.kwargs.get('channel'))
-        if not channel.exists():
+        channel = Channel.objects.filter(channel_name=self.kwargs.get('channel')).first()
+        if channel is None:
             return HttpResponseRedirect(reverse('forumapp:channel'))
 
-        channel = channel.get()
-
         if 'delete_thread' in request.POST:
             thread_id = request.POST['thread_id']
             thread = self.queryset.filter(channel=channel, thread_id=thread_id)
@@ -341,45 +537,21 @@ class ThreadView(ViewMixin, generic.DetailView):
 
             owner = request.user
             thread = Thread(channel=channel, owner=owner)
-            thread.save()
             form = self.form_class(request.POST, instance=thread)
 
+            # validate before touching the database, then insert once
             if form.is_valid():
-                thread_name = form.cleaned_data.get('thread_name')
-                description = form.cleaned_data.get('description')
-
-                if len(thread_name) > 5:
-
-                    if len(description) > 5:
-
-                        form.save()
-
-                        #Update recent_date of the channel
-                        date = timezone.now()
-                        channel.recent_date = date
-                        channel.save()
-
-                        return HttpResponseRedirect(reverse('forumapp:comment', \
-                                kwargs={'channel': channel.channel_name, 'thread': thread.thread_id}))
-
-                    else:
-                        thread.delete()
-                        messages.error(request, "Thread description must be at least 6 characters.")
-
-                else:
-                    thread.delete()
-                    messages.error(request, "Thread name must be at least 6 characters.")
+                post_thread(thread)
 
-            elif Thread.objects.filter(channel=channel, thread_name=form.data.get('thread_name')).exists():
-                messages.error(request, "Thread already exists with that name.")
+                return HttpResponseRedirect(reverse('forumapp:comment', \
+                        kwargs={'channel': channel.channel_name, 'thread': thread.thread_id}))
 
             else:
-                thread.delete()
-                messages.error(request, "Invalid input")
+                report_form_errors(request, form)
 
         return HttpResponseRedirect(self.request.path_info)
 
-class CommentView(ViewMixin, generic.DetailView):
+class CommentView(ChannelConditionalMixin, KeysetListingMixin, generic.DetailView):
     model = Comment
     template_name = 'forumapp/comment.html'
 
@@ -387,13 +559,31 @@ class CommentView(ViewMixin, generic.DetailView):
 
     queryset = Comment.objects
     context_object_name = 'comment_list'
+    paginate_keys = COMMENT_KEYS
+    share_pages = True
+
+    def get_context_data(self, **kwargs):
+        context = super(CommentView, self).get_context_data(**kwargs)
+        context['live_comments'] = live.is_enabled()
+
+        return context
+
+    def get_change_scopes(self):
+        thread = self.get_access().thread
+        return (conditional.GLOBAL_SCOPE, conditional.channel_scope(self.kwargs.get('channel')), \
+                conditional.thread_scope(thread and thread.pk))
+
+    # the thread's recent_date is the newest comment's pub_date
+    def get_change_dates(self):
+        access = self.get_access()
+        return [access.channel and access.channel.recent_date, access.thread and access.thread.recent_date]
 
     # Return querylist of comments in the given channel and thread
     def get_object(self):
         t_id = self.kwargs.get('thread')
         c_name = self.kwargs.get('channel')
 
-        return self.queryset.filter(thread__thread_id=t_id, thread__channel__channel_name=c_name)
+        return projections.listing(self.queryset.filter(thread__thread_id=t_id, thread__channel__channel_name=c_name))
 
     def post(self, request, *args, **kwargs):
 
@@ -444,35 +634,121 @@ class CommentView(ViewMixin, generic.DetailView):
             
             owner = request.user
             comment = Comment(thread=thread, owner=owner)
-            comment.save()
             form = self.form_class(request.POST, instance=comment)
 
+            # validate before touching the database, then insert once
             if form.is_valid():
-                text = form.cleaned_data.get('text')
+                post_comment(comment)
 
-                if len(text) > 5:
+                # readers streaming the thread get the comment once it's committed
+                channel_name = self.kwargs.get('channel')
+                transaction.on_commit(lambda: live.publish_comment(channel_name, comment))
 
-                    form.save()
+                return HttpResponseRedirect(self.request.path_info)
 
-                    #Update recent_date of the channel and thread
-                    date = timezone.now()
-                    thread.channel.recent_date = date
-                    thread.channel.save()
+            else:
+                report_form_errors(request, form)
 
-                    thread.recent_date = date
-                    thread.save()
+        return HttpResponseRedirect(self.request.path_info)
+
+# Stream a thread's new comments to the page as server-sent events
+class LiveCommentView(generic.View):
+
+    def get(self, request, *args, **kwargs):
+        if not live.is_enabled():
+            raise Http404("Live comments are turned off.")
+
+        access = ChannelAccess.for_request(request, kwargs.get('channel'), kwargs.get('thread'))
+
+        if access.thread is None or access.is_banned(request.user):
+            raise Http404("Couldn't find that thread.")
+
+        # subscribe straight away so nothing posted before streaming starts is missed
+        subscription = live.get_hub().subscribe(live.thread_topic(access.channel_name, access.thread.thread_id))
+
+        last_seen = request.META.get('HTTP_LAST_EVENT_ID')
+        response = StreamingHttpResponse(self.stream(access, subscription, last_seen), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+
+        # picked up by django_forum/asgi.py in place of the blocking stream
+        response.async_streaming_content = self.astream(access, subscription, last_seen)
+
+        return response
+
+    def stream(self, access, subscription, last_seen):
+        keepalive = live.get_keepalive()
+        deadline = time.time() + live.get_lifetime()
+
+        try:
+            yield 'retry: 3000\n\n'
 
-                    return HttpResponseRedirect(self.request.path_info)
+            # also lets go of the connection the view looked the thread up on
+            for event in self.released(self.catch_up, access, last_seen):
+                yield event
 
+            # streams end after a while (or when they fall behind) and the browser reconnects
+            while time.time() < deadline and not subscription.overflowed:
+                event = subscription.get(min(keepalive, max(deadline - time.time(), 0)))
+
+                if event is None:
+                    yield ': keepalive\n\n'
                 else:
-                    comment.delete()
-                    messages.error(request, "Comments must be at least 6 characters.")
+                    yield self.released(self.render_event, access, live.comment_from_event(event))
 
-            else:
-                comment.delete()
-                messages.error(request, "")
+        finally:
+            subscription.close()
 
-        return HttpResponseRedirect(self.request.path_info)
+    # the same stream for the ASGI server, which waits for events on its event loop and
+    # only borrows one of its worker threads (see live.run_blocking) to query and render
+    async def astream(self, access, subscription, last_seen):
+        keepalive = live.get_keepalive()
+        deadline = time.time() + live.get_lifetime()
+
+        try:
+            yield 'retry: 3000\n\n'
+
+            for event in await live.run_blocking(self.released, self.catch_up, access, last_seen):
+                yield event
+
+            while time.time() < deadline and not subscription.overflowed:
+                event = await subscription.aget(min(keepalive, max(deadline - time.time(), 0)))
+
+                if event is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield await live.run_blocking(self.released, self.render_event, access, \
+                            live.comment_from_event(event))
+
+        finally:
+            subscription.close()
+
+    # streams stay open for minutes, so they close the thread's database connection
+    # after each query instead of holding it while they wait (unless a test's
+    # transaction is still using it)
+    def released(self, func, *args):
+        try:
+            return func(*args)
+
+        finally:
+            if not connection.in_atomic_block:
+                connection.close()
+
+    # events for what was posted while the browser was reconnecting
+    def catch_up(self, access, last_seen):
+        if not (last_seen and last_seen.isdigit()):
+            return []
+
+        missed = Comment.objects.filter(thread=access.thread, comment_id__gt=int(last_seen)).order_by('comment_id')
+        missed = projections.listing(missed)
+        return [self.render_event(access, comment) for comment in missed]
+
+    # render the row the way this reader would see it on the page
+    def render_event(self, access, comment):
+        html = render_to_string('forumapp/comment_listing.html', {'listing': comment, 'access': access}, request=self.request)
+        data = ''.join('data: %s\n' % line for line in html.splitlines())
+
+        return 'id: %d\nevent: comment\n%s\n' % (comment.comment_id, data)
 
 class UserView(ViewMixin, generic.DetailView):
     model = User
@@ -534,15 +810,12 @@ class UserView(ViewMixin, generic.DetailView):
 
                     if is_mod(channel, request.user):
 
-                        banned_users = json.loads(channel.banned_users)
-                        banned_users.append(username)
-
-                        moderators = json.loads(channel.banned_users)
-                        moderators = [u for u in moderators if not u == username]
+                        # banned users lose their moderator status
+                        with transaction.atomic():
+                            Ban.objects.get_or_create(channel=channel, user=user)
+                            Moderator.objects.filter(channel=channel, user=user).delete()
 
-                        channel.banned_users = json.dumps(banned_users)
-                        channel.moderators = json.dumps(moderators)
-                        channel.save()
+                        fragments.bump(fragments.channel_scope(channel.channel_name))
 
                     else:
                         raise Http404("Insufficient permissions.")
@@ -564,11 +837,8 @@ class UserView(ViewMixin, generic.DetailView):
 
                     if is_mod(channel, request.user):
 
-                        banned_users = json.loads(channel.banned_users)
-                        banned_users = [u for u in banned_users if not u == username]
-
-                        channel.banned_users = json.dumps(banned_users)
-                        channel.save()
+                        Ban.objects.filter(channel=channel, user=user).delete()
+                        fragments.bump(fragments.channel_scope(channel.channel_name))
 
                     else:
                         raise Http404("Insufficient permissions.")
@@ -590,12 +860,8 @@ class UserView(ViewMixin, generic.DetailView):
 
                     if is_owner(channel, request.user):
 
-                        if not '"'+username+'"' in channel.banned_users:
-                            moderators = json.loads(channel.moderators)
-                            moderators.append(username)
-
-                            channel.moderators = json.dumps(moderators)
-                            channel.save()
+                        if not Ban.objects.filter(channel=channel, user=user).exists():
+                            Moderator.objects.get_or_create(channel=channel, user=user)
 
                         else:
                             messages.error(request, "Channel-banned users cannot be promoted.")
@@ -620,11 +886,7 @@ class UserView(ViewMixin, generic.DetailView):
 
                     if is_owner(channel, request.user):
 
-                        moderators = json.loads(channel.moderators)
-                        moderators = [u for u in moderators if not u == username]
-
-                        channel.moderators = json.dumps(moderators)
-                        channel.save()
+                        Moderator.objects.filter(channel=channel, user=user).delete()
 
                     else:
                         raise Http404("Insufficient permissions.")
@@ -637,7 +899,7 @@ class UserView(ViewMixin, generic.DetailView):
 
         return HttpResponseRedirect(self.request.path_info)
 
-class FavoritesView(ViewMixin, generic.DetailView):
+class FavoritesView(FavoriteNamesMixin, ViewMixin, generic.DetailView):
     model = Channel
     template_name = 'forumapp/favorites.html'
 
@@ -646,8 +908,8 @@ class FavoritesView(ViewMixin, generic.DetailView):
 
     def get_object(self):
         if self.request.user.is_authenticated():
-            settings = get_or_create_settings(self.request.user)
-            return self.queryset.filter(channel_name__in=json.loads(settings.favorites))
+            # settings share the user's primary key, no need to fetch them
+            return projections.listing(self.queryset.filter(favorite__settings=self.request.user.pk))
 
         return self.queryset.none()
 
@@ -657,27 +919,22 @@ class FavoritesView(ViewMixin, generic.DetailView):
 
         if 'add_favorite' in request.POST:
             settings = get_or_create_settings(self.request.user)
-            favs = json.loads(settings.favorites)
             channel_name = request.POST['channel_name']
+            favorites = Favorite.objects.filter(settings=settings, channel_id=channel_name)
 
-            if not channel_name in favs:
-                favs.append(channel_name)
-                settings.favorites = json.dumps(favs)
-                settings.save()
+            if not favorites.exists():
+                if self.queryset.filter(channel_name=channel_name).exists():
+                    Favorite.objects.create(settings=settings, channel_id=channel_name)
 
             else:
                 messages.error(request, "Channel already in favorites")
 
         elif 'remove_favorite' in request.POST:
             settings = get_or_create_settings(self.request.user)
-            favs = json.loads(settings.favorites)
             channel_name = request.POST['channel_name']
 
-            if channel_name in favs:
-                favs.remove(channel_name)
-                settings.favorites = json.dumps(favs)
-                settings.save()
-            else:
+            # delete() reports how many rows it removed
+            if not Favorite.objects.filter(settings=settings, channel_id=channel_name).delete()[0]:
                 messages.error(request, "Channel not found in favorites")
 
         elif 'pin' in request.POST:
@@ -705,3 +962,100 @@ class FavoritesView(ViewMixin, generic.DetailView):
                     channel.save()
 
         return HttpResponseRedirect(self.request.path_info)
+
+# Delete or ban in bulk (see moderation.moderate) and report how many rows were affected.
+# Moderators act within their channel, staff anywhere.
+class ModerationView(generic.View):
+
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            raise Http404("Insufficient permissions.")
+
+        form = ModerationForm(request.POST)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+
+        channel_name = form.cleaned_data['channel']
+
+        if channel_name:
+            channel = Channel.objects.filter(channel_name=channel_name).first()
+
+            if channel is None:
+                raise Http404("Couldn't find that channel.")
+
+            if not (request.user.is_staff or is_mod(channel, request.user)):
+                raise Http404("Insufficient permissions.")
+
+        elif not request.user.is_staff:
+            raise Http404("Insufficient permissions.")
+
+        hours = form.cleaned_data['hours']
+        since = timezone.now() - datetime.timedelta(hours=hours) if hours else None
+
+        counts = moderation.moderate(form.cleaned_data['action'], channel=channel_name or None, \
+                user=form.cleaned_data['user'] or None, since=since, threads=form.cleaned_data['threads'])
+
+        return JsonResponse(counts)
+
+# Who is reading a shared page and where they stand in its channel, for the page's
+# javascript to show them their controls (see pagecache.py)
+class ReaderView(generic.View):
+
+    def get(self, request, *args, **kwargs):
+        user = request.user
+
+        reader = {
+            'authenticated': user.is_authenticated,
+            'username': user.get_username(),
+            'staff': user.is_staff,
+            'can_moderate': user.is_staff,
+            'can_manage': user.is_staff,
+            'favorites': sorted(get_favorite_names(user)),
+            'banned': [],
+        }
+
+        if user.is_authenticated:
+            reader['banned'] = sorted(Ban.objects.filter(user_id=user.get_username()).values_list('channel_id', flat=True))
+
+        channel_name = request.GET.get('channel')
+        if channel_name:
+            access = ChannelAccess.for_request(request, channel_name)
+            reader['can_moderate'] = reader['can_moderate'] or access.is_moderator(user)
+            reader['can_manage'] = reader['can_manage'] or access.is_owner(user)
+
+        response = JsonResponse(reader)
+        patch_cache_control(response, private=True, no_cache=True)
+
+        return response
+
+# Per-view request stats gathered by InstrumentationMiddleware, for staff
+class StatsView(generic.View):
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_staff:
+            raise Http404("Insufficient permissions.")
+
+        return JsonResponse(instrumentation.table.summary())
+
+    # start counting again
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_staff:
+            raise Http404("Insufficient permissions.")
+
+        instrumentation.table.reset()
+        return JsonResponse({})
+
+# Search threads and comments, optionally within one channel
+class SearchView(ViewMixin, generic.TemplateView):
+    template_name = 'forumapp/search.html'
+
+    def get_context_data(self, **kwargs):
+        context = super(SearchView, self).get_context_data(**kwargs)
+        form = SearchForm(self.request.GET or None)
+
+        if form.is_valid():
+            context['results'] = search.search(form.cleaned_data['q'], channel=form.cleaned_data['channel'], \
+                    user=self.request.user, page=form.cleaned_data['page'] or 1)
+
+        context['search_form'] = form
+        return context
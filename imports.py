@@ -1,3 +1,3 @@
-from forumapp.models import Channel, Thread, Comment
+from forumapp.models import Channel, Thread, Comment, Moderator, Ban, Favorite
 from forumapp.tests import create_channel, create_thread, create_comment
 from django.contrib.auth.models import User